@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+# Serve the loan endpoints with async views, which do not hold up the worker while waiting on the database.
+os.environ.setdefault('ASYNC_VIEWS', 'true')
 
 application = get_asgi_application()
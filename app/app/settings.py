@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.RequestMetricsMiddleware',
+    'core.routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,16 +83,77 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# With DB_POOL_SIZE set, each worker process hands out connections from a pool of at most that many connections,
+# returned to the pool at the end of every request. Otherwise, each thread keeps its own connection open for
+# CONN_MAX_AGE seconds (0 closes it at the end of every request; the development server runs each request in a new
+# thread, so persistent connections only pay off in production). CONN_HEALTH_CHECKS checks that a reused connection
+# still works before a request uses it.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.backends.pooled_postgresql' if DB_POOL_SIZE else 'django.db.backends.postgresql',
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+        'POOL': {
+            'MAX_SIZE': DB_POOL_SIZE,
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'MAX_IDLE': int(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+        },
+    }
+}
+
+# Read replicas of the default database, one per host in DB_REPLICA_HOSTS (e.g. "replica-1,replica-2"), connected to
+# with the same settings and, unless DB_REPLICA_NAME is set, under the same database name. The reads of safe requests
+# go to one of them, see core/routing.py; the tests run them as mirrors of the default database.
+DB_REPLICA_HOSTS = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+DATABASE_REPLICAS = ['replica_{}'.format(number) for number in range(1, len(DB_REPLICA_HOSTS) + 1)]
+DATABASES.update({
+    alias: dict(DATABASES['default'], HOST=host, NAME=os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+                TEST={'MIRROR': 'default'})
+    for alias, host in zip(DATABASE_REPLICAS, DB_REPLICA_HOSTS)
+})
+DATABASE_ROUTERS = ['core.routing.ReplicaRouter']
+
+# Number of seconds the reads of a user go to the default database for after each of their writes, so that they see
+# them even while the replicas lag behind. The writes are recorded in the cache below, which must be shared by the
+# workers for their requests to see the writes made through the others.
+READ_YOUR_WRITES = {
+    'WINDOW': int(os.environ.get('DB_READ_YOUR_WRITES_WINDOW', 5)),
+    'CACHE_ALIAS': 'default',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The default in-memory cache is local to each process; point CACHE_BACKEND/CACHE_LOCATION at a shared backend (e.g.
+# memcached) when running multiple workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
+# Authentication user lookups are cached in a bounded in-process LRU, backed by the shared cache above.
+AUTH_USER_CACHE = {
+    'MAX_SIZE': int(os.environ.get('AUTH_USER_CACHE_MAX_SIZE', 10000)),
+    'TTL': int(os.environ.get('AUTH_USER_CACHE_TTL', 30)),
+    'SHARED_TTL': int(os.environ.get('AUTH_USER_CACHE_SHARED_TTL', 300)),
+    'CACHE_ALIAS': 'default',
+}
+
+# Portfolio analytics are cached in the shared cache above for TTL seconds, and invalidated by every loan write.
+PORTFOLIO_ANALYTICS = {
+    'TTL': int(os.environ.get('PORTFOLIO_ANALYTICS_TTL', 300)),
+    'CACHE_ALIAS': 'default',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -138,3 +201,37 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
+
+# Whether the loan, repayment and loan approval endpoints are served by async views, which run their queries on a pool
+# of ASYNC_DB_THREADS threads per worker process. app/asgi.py turns them on.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'false').lower() == 'true'
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 32))
+
+# Loan listings are paginated on (created_date, id). The page size can be chosen by the client, up to the maximum.
+LOAN_PAGE_SIZE = int(os.environ.get('LOAN_PAGE_SIZE', 100))
+LOAN_MAX_PAGE_SIZE = int(os.environ.get('LOAN_MAX_PAGE_SIZE', 1000))
+# Number of loans fetched from the server-side cursor at a time, when streaming the loan listing.
+LOAN_STREAM_CHUNK_SIZE = int(os.environ.get('LOAN_STREAM_CHUNK_SIZE', 500))
+
+# Maximum number of weekly repayments of a loan, which bounds the repayment schedule built and inserted for a new loan.
+LOAN_MAX_TERMS = int(os.environ.get('LOAN_MAX_TERMS', 500))
+
+# Maximum number of loans that can be approved with a single bulk approval request.
+LOAN_APPROVAL_BATCH_LIMIT = int(os.environ.get('LOAN_APPROVAL_BATCH_LIMIT', 1000))
+
+# Maximum number of row errors returned by a bulk loan import request. The full report is kept in the database.
+LOAN_IMPORT_ERROR_LIMIT = int(os.environ.get('LOAN_IMPORT_ERROR_LIMIT', 100))
+
+# Number of days after their creation that paid loans are moved to the archive by the archive_paid_loans command.
+LOAN_ARCHIVE_AFTER_DAYS = int(os.environ.get('LOAN_ARCHIVE_AFTER_DAYS', 365))
+
+# Number of seconds the response to a request made with an Idempotency-Key header is replayed to its retries for.
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Per-request timings. SAMPLE_RATE is the fraction of requests timed; timed requests report a Server-Timing header if
+# SERVER_TIMING is set, and are added to histograms per route, with bucket bounds in milliseconds.
+REQUEST_METRICS = {
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_METRICS_SAMPLE_RATE', 1.0)),
+    'SERVER_TIMING': os.environ.get('REQUEST_METRICS_SERVER_TIMING', 'true').lower() == 'true',
+    'BUCKETS': (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+}
@@ -0,0 +1,51 @@
+"""
+Django settings for serving the app in production, on top of the development settings in settings.py.
+
+Select them with DJANGO_SETTINGS_MODULE=app.settings_production. SECRET_KEY and ALLOWED_HOSTS must be set in the
+environment.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+
+# DEBUG also makes every connection keep a log of all the SQL queries it ran, which grows for the life of the process.
+DEBUG = False
+
+SECRET_KEY = os.environ['SECRET_KEY']
+
+ALLOWED_HOSTS = [host.strip() for host in os.environ['ALLOWED_HOSTS'].split(',') if host.strip()]
+
+# Keep each thread's database connections open across requests, unless connections are pooled.
+if not DB_POOL_SIZE:  # noqa: F405
+    for database in DATABASES.values():  # noqa: F405
+        database['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+# The invalidations of the authentication and analytics caches and the read-your-writes markers of the replica routing
+# only reach the worker processes sharing the cache they are written to, so a process-local cache is limited to a
+# single worker.
+LOCAL_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+if CACHES['default']['BACKEND'] == LOCAL_CACHE_BACKEND and os.environ.get('WEB_WORKERS') != '1':  # noqa: F405
+    raise ImproperlyConfigured('Set CACHE_BACKEND and CACHE_LOCATION to a cache shared by the worker processes, e.g. '
+                               'memcached, or serve the app with WEB_WORKERS=1.')
+
+# Only a sample of the requests is timed in detail, which is enough for the route histograms.
+REQUEST_METRICS = dict(REQUEST_METRICS, SAMPLE_RATE=float(os.environ.get('REQUEST_METRICS_SAMPLE_RATE', 0.1)))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.environ.get('LOG_LEVEL', 'INFO'),
+    },
+    'loggers': {
+        # Never log SQL queries, whatever the root level.
+        'django.db.backends': {'level': 'WARNING', 'propagate': True},
+    },
+}
@@ -21,6 +21,8 @@ from drf_spectacular.views import (
 from django.contrib import admin
 from django.urls import path, include
 
+from core.metrics import metrics_view
+
 urlpatterns = [
     #path('admin/', admin.site.urls),
 path('schema/', SpectacularAPIView.as_view(), name='api-schema'),
@@ -29,5 +31,6 @@ path('schema/', SpectacularAPIView.as_view(), name='api-schema'),
         SpectacularSwaggerView.as_view(url_name='api-schema'),
         name='api-docs',
     ),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('loan.urls')),
 ]
@@ -0,0 +1,173 @@
+"""
+Portfolio analytics over all the loans: outstanding principal by status, repayment rate curves by origination week and
+expected cash flow by due week.
+
+Each metric is aggregated by a single GROUP BY query, so only the aggregated rows, a few per week, reach Python. The
+results are cached in the shared cache for PORTFOLIO_ANALYTICS['TTL'] seconds, under a version that every committed
+loan write bumps, so that a write is reflected by the next request in every worker process sharing that cache (see
+CACHE_BACKEND); with a process-local cache, only in the worker process that made the write.
+"""
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ArchivedLoan, Loan, LoanStatus, Repayment, RepaymentStatus
+
+CACHE_KEY = 'portfolio-analytics:{}'
+VERSION_KEY = 'portfolio-analytics:version'
+
+# Number of loans, principal, amount paid and outstanding balance of the loans in each status, the archived loans
+# being counted as paid.
+OUTSTANDING_BY_STATUS_SQL = '''
+    SELECT status, COUNT(*), SUM(amount), SUM(amount_paid), SUM(outstanding_balance)
+    FROM (
+        SELECT status, amount, amount_paid, outstanding_balance FROM {loan_table}
+        UNION ALL
+        SELECT %(paid_loan)s, amount, amount_paid, 0 FROM {archive_table}
+    ) loans
+    GROUP BY status
+    ORDER BY status
+'''
+
+# For the approved and paid loans originated in each week, archived or not, the amount of the repayments due in each
+# week after origination, up to today, the amount of them that was paid, and the cumulative fraction of the amount due
+# that was paid, up to and including that week. The repayments of an archived loan are [id, amount, status, due_date]
+# arrays.
+REPAYMENT_CURVES_SQL = '''
+    SELECT cohort, week, due_amount, paid_amount,
+        SUM(paid_amount) OVER cohort_weeks::float / NULLIF(SUM(due_amount) OVER cohort_weeks, 0)
+    FROM (
+        SELECT
+            date_trunc('week', repayment.created_date)::date AS cohort,
+            (repayment.due_date - repayment.created_date + 6) / 7 AS week,
+            SUM(repayment.amount) AS due_amount,
+            COALESCE(SUM(repayment.amount) FILTER (WHERE repayment.status = %(paid)s), 0) AS paid_amount
+        FROM (
+            SELECT loan.created_date, repayment.due_date, repayment.amount, repayment.status
+            FROM {repayment_table} repayment
+            JOIN {loan_table} loan ON loan.id = repayment.loan_id
+            WHERE loan.status IN (%(approved)s, %(paid_loan)s)
+            UNION ALL
+            SELECT archived.created_date, (archived_repayment->>3)::date, (archived_repayment->>1)::integer,
+                (archived_repayment->>2)::integer
+            FROM {archive_table} archived
+            CROSS JOIN jsonb_array_elements(archived.repayments) archived_repayment
+        ) repayment
+        WHERE repayment.due_date <= %(today)s
+        GROUP BY 1, 2
+    ) weeks
+    WINDOW cohort_weeks AS (PARTITION BY cohort ORDER BY week)
+    ORDER BY cohort, week
+'''
+
+# Number and amount of the pending repayments of the approved loans due in each week, and the part of it overdue.
+CASH_FLOW_SQL = '''
+    SELECT
+        date_trunc('week', repayment.due_date)::date,
+        COUNT(*),
+        SUM(repayment.amount),
+        COALESCE(SUM(repayment.amount) FILTER (WHERE repayment.due_date < %(today)s), 0)
+    FROM {repayment_table} repayment
+    JOIN {loan_table} loan ON loan.id = repayment.loan_id
+    WHERE repayment.status = %(pending)s AND loan.status = %(approved)s
+    GROUP BY 1
+    ORDER BY 1
+'''
+
+
+def _fetch(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(loan_table=Loan._meta.db_table, repayment_table=Repayment._meta.db_table,
+                                  archive_table=ArchivedLoan._meta.db_table), params)
+        return cursor.fetchall()
+
+
+def outstanding_by_status():
+    return [
+        {
+            'status': LoanStatus.get(loan_status).name,
+            'loans': loans,
+            'principal': principal,
+            'amount_paid': amount_paid,
+            'outstanding_principal': outstanding,
+        }
+        for loan_status, loans, principal, amount_paid, outstanding in _fetch(OUTSTANDING_BY_STATUS_SQL, {
+            'paid_loan': LoanStatus.PAID.value,
+        })
+    ]
+
+
+def repayment_curves(today):
+    cohorts = []
+    for cohort, week, due_amount, paid_amount, cumulative_rate in _fetch(REPAYMENT_CURVES_SQL, {
+        'today': today,
+        'paid': RepaymentStatus.PAID.value,
+        'approved': LoanStatus.APPROVED.value,
+        'paid_loan': LoanStatus.PAID.value,
+    }):
+        if not cohorts or cohorts[-1]['origination_week'] != cohort.isoformat():
+            cohorts.append({'origination_week': cohort.isoformat(), 'weeks': []})
+        cohorts[-1]['weeks'].append({
+            'week': week,
+            'due_amount': due_amount,
+            'paid_amount': paid_amount,
+            'cumulative_repayment_rate': round(cumulative_rate, 4) if cumulative_rate is not None else None,
+        })
+    return cohorts
+
+
+def cash_flow(today):
+    return [
+        {'due_week': week.isoformat(), 'repayments': repayments, 'amount': amount, 'overdue_amount': overdue}
+        for week, repayments, amount, overdue in _fetch(CASH_FLOW_SQL, {
+            'today': today,
+            'pending': RepaymentStatus.PENDING.value,
+            'approved': LoanStatus.APPROVED.value,
+        })
+    ]
+
+
+def compute_portfolio_analytics(today=None):
+    """Computes the portfolio analytics from the loans and repayments, with one aggregate query per metric."""
+    today = today or date.today()
+    return {
+        'generated_at': timezone.now().isoformat(),
+        'outstanding_by_status': outstanding_by_status(),
+        'repayment_curves': repayment_curves(today),
+        'cash_flow': cash_flow(today),
+    }
+
+
+def _cache():
+    return caches[settings.PORTFOLIO_ANALYTICS['CACHE_ALIAS']]
+
+
+def get_portfolio_analytics():
+    """
+    Returns the cached portfolio analytics, computing them if no loan write was committed since they were cached.
+    The version is read before computing, so analytics computed while a write commits are cached under the version
+    the write replaces, and never served.
+    """
+    cache = _cache()
+    version = cache.get_or_set(VERSION_KEY, 0, timeout=None)
+    analytics = cache.get(CACHE_KEY.format(version))
+    if analytics is None:
+        analytics = compute_portfolio_analytics()
+        cache.set(CACHE_KEY.format(version), analytics, settings.PORTFOLIO_ANALYTICS['TTL'])
+    return analytics
+
+
+def _bump_version():
+    cache = _cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+def invalidate_portfolio_analytics():
+    """Invalidates the cached portfolio analytics once the current transaction commits."""
+    transaction.on_commit(_bump_version)
@@ -0,0 +1,103 @@
+"""
+Archival of the paid loans, moved out of the loan and repayment tables in batches.
+
+Each archived loan becomes a single row of the archived loan table, holding its repayments as a JSON array, so that
+the loan listing, its indexes and the repayment partitions only hold the loans still being repaid and the recently
+paid ones. The loan summaries keep counting the archived loans.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .analytics import invalidate_portfolio_analytics
+from .metrics import LOANS_ARCHIVED, count_on_commit
+from .models import ArchivedLoan, Loan, LoanStatus, Repayment
+
+ArchiveBatch = namedtuple('ArchiveBatch', ('archived', 'last_created_date', 'last_id'))
+
+# Moves the next batch of paid loans created before the cutoff, walking loan_status_created_idx in (created_date, id)
+# order, to the archive along with their repayments, deleted in the same statement. Loans locked by a request in
+# progress are skipped; they are archived by the next run.
+ARCHIVE_BATCH_SQL = '''
+    WITH batch AS (
+        SELECT loan.id
+        FROM {loan_table} loan
+        WHERE loan.status = %(paid_loan)s AND loan.created_date < %(before)s
+        ORDER BY loan.created_date, loan.id
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    repayments AS (
+        DELETE FROM {repayment_table} repayment
+        USING batch
+        WHERE repayment.loan_id = batch.id
+        RETURNING repayment.loan_id, repayment.id, repayment.amount, repayment.status, repayment.due_date
+    ),
+    loan_repayments AS (
+        SELECT loan_id, jsonb_agg(jsonb_build_array(id, amount, status, due_date) ORDER BY due_date, id) AS repayments
+        FROM repayments
+        GROUP BY loan_id
+    ),
+    loans AS (
+        DELETE FROM {loan_table} loan
+        USING batch
+        WHERE loan.id = batch.id
+        RETURNING loan.id, loan.user_id, loan.amount, loan.terms, loan.created_date, loan.amount_paid
+    )
+    INSERT INTO {archive_table} (id, user_id, amount, terms, created_date, amount_paid, repayments, archived_at)
+    SELECT loans.id, loans.user_id, loans.amount, loans.terms, loans.created_date, loans.amount_paid,
+        COALESCE(loan_repayments.repayments, '[]'::jsonb), %(archived_at)s
+    FROM loans
+    LEFT JOIN loan_repayments ON loan_repayments.loan_id = loans.id
+    RETURNING created_date, id
+'''
+
+
+def archive_cutoff(today=None, days=None):
+    """
+    Returns the creation date before which paid loans are archived, the given number of days before today, by default
+    LOAN_ARCHIVE_AFTER_DAYS.
+    """
+    return (today or date.today()) - timedelta(days=settings.LOAN_ARCHIVE_AFTER_DAYS if days is None else days)
+
+
+def archive_batch(before, batch_size=1000):
+    """
+    Archives up to batch_size paid loans created before the given date, in a transaction of their own, and returns
+    the number archived and the last (created_date, id) key archived, or None if there was none left.
+    """
+    sql = ARCHIVE_BATCH_SQL.format(loan_table=Loan._meta.db_table, repayment_table=Repayment._meta.db_table,
+                                   archive_table=ArchivedLoan._meta.db_table)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'before': before,
+                'batch_size': batch_size,
+                'paid_loan': LoanStatus.PAID.value,
+                'archived_at': timezone.now(),
+            })
+            rows = cursor.fetchall()
+        if rows:
+            count_on_commit(LOANS_ARCHIVED, len(rows))
+            invalidate_portfolio_analytics()
+    if not rows:
+        return None
+    last_created_date, last_id = max(rows)
+    return ArchiveBatch(len(rows), last_created_date, last_id)
+
+
+def archive_paid_loans(before=None, batch_size=1000):
+    """
+    Archives the paid loans created before the given date, by default archive_cutoff(), one batch at a time, and
+    yields each batch once it is committed. Archived loans are deleted, so each batch starts from the oldest paid loan
+    left, and an interrupted run can simply be started again.
+    """
+    before = before or archive_cutoff()
+    while True:
+        batch = archive_batch(before, batch_size)
+        if batch is None:
+            return
+        yield batch
@@ -0,0 +1,49 @@
+"""
+Database access from async views, on a pool of threads shared by the requests of a worker process.
+
+Django 3.2 has no async ORM, so async views run their ORM calls with database_sync_to_async, which hands them to a
+thread of the pool instead of the single thread Django runs the sync code of a request in. While one request waits on
+the database, the event loop keeps serving the others.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import close_old_connections
+
+from .instrumentation import current_timings, timed_queries
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the database thread pool of this process, with ASYNC_DB_THREADS threads."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix='async-db')
+        return _executor
+
+
+def database_sync_to_async(func):
+    """
+    Returns an async function running func on the database thread pool. The connections of the thread are closed
+    before and after the call, as they would be at the start and end of a request, if they are broken or older than
+    CONN_MAX_AGE. The queries are timed for the request being handled, if it is sampled.
+    """
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            timings = current_timings.get()
+            if timings is None:
+                return func(*args, **kwargs)
+            with timed_queries(timings):
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return SyncToAsync(run, thread_sensitive=False, executor=get_executor())
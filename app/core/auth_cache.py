@@ -0,0 +1,129 @@
+"""
+Two-tier cache for the user lookups made while authenticating requests.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from .metrics import AUTH_CACHE_LOOKUPS
+from .models import User
+from .routing import reading_from_replica
+
+# Label of each lookup counter in the exported metrics.
+LOOKUP_RESULTS = {'local_hits': 'local_hit', 'shared_hits': 'shared_hit', 'misses': 'miss'}
+
+
+class UserLookupCache:
+    """
+    Caches the (id, is_admin) of users by user_name. Lookups go to a bounded, in-process LRU first, then to the shared
+    Django cache backend, and only then to the database. Unknown user_names are not cached, so a user is found as soon
+    as it is created. Entries are invalidated when a user is saved, updated or deleted, in the in-process tier of the
+    current worker process and in the shared tier. The in-process entries of the other workers expire after their
+    (short) TTL, so admin users are kept out of the in-process tier: when the shared tier is shared by the workers
+    (see CACHE_BACKEND), a revoked is_admin is not served by any of them, while a granted one may take up to the TTL
+    to apply.
+    """
+    def __init__(self, max_size=None, ttl=None, shared_ttl=None, cache_alias=None):
+        config = settings.AUTH_USER_CACHE
+        self.max_size = config['MAX_SIZE'] if max_size is None else max_size
+        self.ttl = config['TTL'] if ttl is None else ttl
+        self.shared_ttl = config['SHARED_TTL'] if shared_ttl is None else shared_ttl
+        self.cache_alias = cache_alias or config['CACHE_ALIAS']
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def shared_cache(self):
+        return caches[self.cache_alias]
+
+    @staticmethod
+    def shared_key(user_name):
+        return 'auth:user:{}'.format(hashlib.sha1(user_name.encode()).hexdigest())
+
+    def get(self, user_name):
+        """Returns the user with the given user_name, or None if there is no such user."""
+        value = self._get_local(user_name)
+        if value is None:
+            value = self.shared_cache.get(self.shared_key(user_name))
+            if value is None:
+                self._count('misses')
+                value = self._load(user_name)
+                if value is None:
+                    return None
+                self.shared_cache.set(self.shared_key(user_name), value, self.shared_ttl)
+            else:
+                self._count('shared_hits')
+            self._set_local(user_name, value)
+        else:
+            self._count('local_hits')
+
+        user_id, is_admin = value
+        return User.from_db(DEFAULT_DB_ALIAS, ['id', 'user_name', 'is_admin'], [user_id, user_name, is_admin])
+
+    def invalidate(self, user_name):
+        with self._lock:
+            self._entries.pop(user_name, None)
+        self.shared_cache.delete(self.shared_key(user_name))
+
+    def clear(self):
+        """Drops the in-process entries and resets the counters. Shared entries are left to expire."""
+        with self._lock:
+            self._entries.clear()
+            self.local_hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.local_hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.local_hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def _load(user_name):
+        users = User.objects.filter(user_name=user_name).values_list('id', 'is_admin')[:1]
+        if not users and reading_from_replica():
+            # The user may have just been created and not have reached the replica yet, so misses are confirmed on the
+            # primary.
+            users = User.objects.using(DEFAULT_DB_ALIAS).filter(user_name=user_name).values_list('id', 'is_admin')[:1]
+        return tuple(users[0]) if users else None
+
+    def _get_local(self, user_name):
+        with self._lock:
+            entry = self._entries.get(user_name)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_name]
+                return None
+            self._entries.move_to_end(user_name)
+            return value
+
+    def _set_local(self, user_name, value):
+        if self.max_size <= 0 or value[1]:
+            return
+        with self._lock:
+            self._entries[user_name] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(user_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        AUTH_CACHE_LOOKUPS.labels(LOOKUP_RESULTS[counter]).inc()
+
+
+user_cache = UserLookupCache()
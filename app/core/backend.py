@@ -1,17 +1,21 @@
 from rest_framework.authentication import BaseAuthentication
 
-from .models import User
+from .auth_cache import user_cache
+from .instrumentation import timed
 
 
 class BasicRequestBodyAuthentication(BaseAuthentication):
     """
     This serves as the custom authentication logic for each incoming request. This just requires the user_name to
-    be present in the request header.
+    be present in the request header. The user lookups are served from the two-tier user cache in auth_cache.py.
     """
     def authenticate(self, request):
         user_name = request.META.get('HTTP_USERNAME')
-        try:
-            user = User.objects.get(user_name=user_name)
-            return user, None
-        except User.DoesNotExist:
+        if not user_name:
             return None
+
+        with timed('auth'):
+            user = user_cache.get(user_name)
+        if user is None:
+            return None
+        return user, None
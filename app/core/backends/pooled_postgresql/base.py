@@ -0,0 +1,52 @@
+"""
+PostgreSQL database backend handing out connections from an in-process pool, instead of opening one per thread.
+
+Connections are acquired from the pool when Django connects, and released back to it when Django closes them, which
+happens at the end of every request with CONN_MAX_AGE = 0. The pool is configured by the POOL entry of the database
+settings: MAX_SIZE connections per process, a TIMEOUT in seconds to wait for one, and MAX_IDLE seconds after which
+idle connections are closed. With CONN_HEALTH_CHECKS set, idle connections are checked before being handed out.
+"""
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.base import Database
+
+from core.connection_pool import ConnectionPool, PoolTimeout, get_pool
+
+
+def is_usable(connection):
+    """Returns whether the connection can still run queries."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Database.Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Pool the current connection was acquired from.
+    connection_pool = None
+
+    def pool(self, conn_params):
+        """Returns the pool of connections made with the given parameters, e.g. to the test database while testing."""
+        def create():
+            config = self.settings_dict['POOL']
+            return ConnectionPool(
+                lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                max_size=config['MAX_SIZE'], timeout=config['TIMEOUT'], max_idle=config.get('MAX_IDLE'),
+                check=is_usable if self.settings_dict.get('CONN_HEALTH_CHECKS') else None, alias=self.alias)
+        return get_pool((self.alias, repr(sorted(conn_params.items()))), create)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool(conn_params)
+        try:
+            connection = pool.acquire()
+        except PoolTimeout as ex:
+            raise Database.OperationalError(str(ex)) from ex
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        self.connection_pool = pool
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.connection_pool.release(self.connection)
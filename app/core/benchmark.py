@@ -0,0 +1,220 @@
+"""
+Replay of realistic request mixes against the API, measuring latency, throughput and queries per request.
+"""
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import Loan, LoanStatus, Repayment, RepaymentStatus, User
+from .seeding import in_process_client
+
+# Relative weights of the requests in the default mix, by the short names accepted by --mix.
+DEFAULT_MIX = {
+    'list_loans': 50,
+    'create_loan': 20,
+    'repay': 20,
+    'approve': 5,
+    'create_user': 5,
+}
+ENDPOINTS = {
+    'list_loans': 'GET /loan',
+    'create_loan': 'POST /loan',
+    'repay': 'PUT /repayment/<loan_id>/<repayment_id>',
+    'approve': 'PUT /approval/<loan_id>',
+    'create_user': 'POST /user',
+    'loan_summary': 'GET /loan/summary',
+}
+PERCENTILES = (50, 95, 99)
+
+
+class BenchmarkRequest:
+    def __init__(self, endpoint, method, path, data=None, user_name=None):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.data = data
+        self.headers = {'username': user_name} if user_name else {}
+
+
+def parse_mix(value):
+    """Parses a mix given as comma separated name=weight pairs, e.g. list_loans=80,repay=20."""
+    mix = {}
+    for pair in value.split(','):
+        name, _, weight = pair.partition('=')
+        if name.strip() not in ENDPOINTS or not weight.strip().isdigit():
+            raise ValueError('Invalid mix entry {!r}; expected name=weight with a name among {}.'.format(
+                pair, ', '.join(ENDPOINTS)))
+        mix[name.strip()] = int(weight)
+    return mix
+
+
+def build_requests(users, count, mix=None, seed=None, admin_name='bench_admin'):
+    """
+    Returns the given number of requests, drawn from the mix at random. Approvals are made on distinct pending loans,
+    and repayments pay off the pending repayments of approved loans in due date order, so that each of them succeeds
+    when the requests are replayed in order. Once the loans to approve or repay run out, those requests are replaced by
+    loan listings.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    names, weights = list(mix), [mix[name] for name in mix]
+    user_names = {user.id: user.user_name for user in users}
+    run = uuid.uuid4().hex[:8]
+
+    pending_loans = deque(Loan.objects.filter(user_id__in=user_names, status=LoanStatus.PENDING)
+                          .order_by('id').values_list('id', flat=True)[:count])
+    repayments = deque(Repayment.objects.filter(
+        loan__user_id__in=user_names, loan__status=LoanStatus.APPROVED, status=RepaymentStatus.PENDING
+    ).order_by('loan_id', 'due_date', 'id').values_list('loan_id', 'id', 'amount', 'loan__user_id')[:count])
+
+    built = []
+    for i in range(count):
+        name = rng.choices(names, weights)[0]
+        user_name = user_names[rng.choice(list(user_names))]
+        if name == 'approve' and pending_loans:
+            built.append(BenchmarkRequest(ENDPOINTS[name], 'PUT', '/approval/{}'.format(pending_loans.popleft()),
+                                          user_name=admin_name))
+        elif name == 'repay' and repayments:
+            loan_id, repayment_id, amount, user_id = repayments.popleft()
+            built.append(BenchmarkRequest(ENDPOINTS[name], 'PUT', '/repayment/{}/{}'.format(loan_id, repayment_id),
+                                          {'amount': amount}, user_names[user_id]))
+        elif name == 'loan_summary':
+            built.append(BenchmarkRequest(ENDPOINTS[name], 'GET', '/loan/summary', user_name=user_name))
+        elif name == 'create_loan':
+            built.append(BenchmarkRequest(ENDPOINTS[name], 'POST', '/loan', {'amount': 1200, 'terms': 12}, user_name))
+        elif name == 'create_user':
+            # POST /user rejects a falsy is_admin, so the flag is sent as a string, as form clients do.
+            built.append(BenchmarkRequest(ENDPOINTS[name], 'POST', '/user',
+                                          {'user_name': 'bench_new_{}_{}'.format(run, i), 'is_admin': 'False'}))
+        else:
+            built.append(BenchmarkRequest(ENDPOINTS['list_loans'], 'GET', '/loan', user_name=user_name))
+    return built
+
+
+def create_admin(user_name='bench_admin'):
+    User.objects.get_or_create(user_name=user_name, defaults={'is_admin': True})
+    return user_name
+
+
+class InProcessSender:
+    """Sends requests to the views in-process, counting the queries each of them makes."""
+    def __init__(self):
+        self.client = in_process_client()
+
+    def __call__(self, request):
+        extra = {'HTTP_{}'.format(header.upper()): value for header, value in request.headers.items()}
+        with CaptureQueriesContext(connection) as queries:
+            if request.method == 'GET':
+                response = self.client.get(request.path, **extra)
+            else:
+                response = getattr(self.client, request.method.lower())(
+                    request.path, request.data, format='json', **extra)
+        return response.status_code, len(queries.captured_queries)
+
+
+class HTTPSender:
+    """Sends requests to a running server, over one keep-alive session per thread. Queries are not counted."""
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def __call__(self, request):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        response = session.request(request.method, self.base_url + request.path, json=request.data,
+                                   headers=request.headers)
+        return response.status_code, None
+
+
+def percentile(sorted_values, percent):
+    """Returns the nearest-rank percentile of the sorted values."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize(samples, duration):
+    """Returns the latency percentiles, throughput, error count and queries per request of the samples."""
+    latencies = sorted(latency for latency, _, _ in samples)
+    queries = [query_count for _, _, query_count in samples if query_count is not None]
+    summary = {
+        'requests': len(samples),
+        'errors': sum(status_code >= 400 for _, status_code, _ in samples),
+        'rps': round(len(samples) / duration, 2) if duration else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+    for percent in PERCENTILES:
+        value = percentile(latencies, percent)
+        summary['p{}_ms'.format(percent)] = round(value * 1000, 3) if value is not None else None
+    return summary
+
+
+def run_benchmark(send, benchmark_requests, concurrency=1, warmup=0):
+    """
+    Replays the requests with the given number of concurrent threads, after replaying the first warmup of them
+    unmeasured, and returns the summary of all of them together and of each endpoint.
+    """
+    for request in benchmark_requests[:warmup]:
+        send(request)
+    measured = benchmark_requests[warmup:]
+
+    def timed(request):
+        started = time.perf_counter()
+        status_code, query_count = send(request)
+        return request.endpoint, (time.perf_counter() - started, status_code, query_count)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, measured))
+    else:
+        results = [timed(request) for request in measured]
+    duration = time.perf_counter() - started
+
+    by_endpoint = defaultdict(list)
+    for endpoint, sample in results:
+        by_endpoint[endpoint].append(sample)
+    return {
+        'total': summarize([sample for _, sample in results], duration),
+        'endpoints': {endpoint: summarize(samples, duration) for endpoint, samples in sorted(by_endpoint.items())},
+    }
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    Returns the regressions of the current results against the baseline: a p95 latency above the baseline by more
+    than the tolerance, a total throughput below it by more than the tolerance, or any increase in queries per request.
+    """
+    regressions = []
+
+    def check(label, base, result):
+        if base.get('p95_ms') and result.get('p95_ms') and result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 latency {} ms, baseline {} ms'.format(label, result['p95_ms'], base['p95_ms']))
+        if label == 'total' and base.get('rps') and result.get('rps') and result['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append('{}: {} requests per second, baseline {}'.format(label, result['rps'], base['rps']))
+        if base.get('queries_per_request') is not None and result.get('queries_per_request') is not None and \
+                result['queries_per_request'] > base['queries_per_request']:
+            regressions.append('{}: {} queries per request, baseline {}'.format(
+                label, result['queries_per_request'], base['queries_per_request']))
+
+    check('total', baseline['total'], current['total'])
+    for endpoint, result in current['endpoints'].items():
+        if endpoint in baseline['endpoints']:
+            check(endpoint, baseline['endpoints'][endpoint], result)
+    return regressions
+
+
+def throughput_change(baseline, current):
+    """Returns the ratio of the current total throughput to the baseline one, or None if either is unknown."""
+    if not baseline['total'].get('rps') or not current['total'].get('rps'):
+        return None
+    return round(current['total']['rps'] / baseline['total']['rps'], 2)
@@ -0,0 +1,184 @@
+"""
+In-process pool of database connections, shared by the threads of a worker process.
+"""
+import threading
+import time
+from collections import deque
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from .metrics import DB_POOL_CONNECTIONS, DB_POOL_TIMEOUTS, DB_POOL_WAIT
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available within the timeout."""
+
+
+class ConnectionPool:
+    """
+    Keeps up to max_size connections, opened with connect() when none is idle. A request for a connection when all of
+    them are in use waits for one to be released, for up to timeout seconds. Idle connections are checked with check()
+    before being handed out, if given, and closed once they have been idle for more than max_idle seconds.
+    """
+    def __init__(self, connect, max_size, timeout=10, max_idle=None, check=None, alias='default'):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check = check
+        self.alias = alias
+        # Idle connections, with the time they were released at, the most recently released last.
+        self._idle = deque()
+        self._in_use = 0
+        self._available = threading.Condition(threading.Lock())
+        self.acquired = 0
+        self.opened = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.max_in_use = 0
+
+    @property
+    def size(self):
+        return len(self._idle) + self._in_use
+
+    def acquire(self):
+        """Returns an idle connection, or a new one if the pool is not full, waiting for one otherwise."""
+        with self._available:
+            if not self._idle and self.size >= self.max_size:
+                self._wait()
+            connection = self._idle.pop()[0] if self._idle else None
+            self._in_use += 1
+            self.acquired += 1
+            self.max_in_use = max(self.max_in_use, self._in_use)
+        try:
+            if connection is not None and not self._usable(connection):
+                self._close(connection)
+                connection = None
+            if connection is None:
+                connection = self.connect()
+                with self._available:
+                    self.opened += 1
+        except BaseException:
+            self._discarded()
+            raise
+        self._report()
+        return connection
+
+    def release(self, connection):
+        """Returns a connection to the pool, rolling back any transaction left open on it."""
+        if connection.closed or not self._reset(connection):
+            self.discard(connection)
+            return
+        with self._available:
+            self._in_use -= 1
+            self._idle.append((connection, time.monotonic()))
+            self._available.notify()
+        self._report()
+
+    def discard(self, connection):
+        """Closes an acquired connection instead of returning it to the pool, e.g. after a connection error."""
+        self._close(connection)
+        self._discarded()
+
+    def close_all(self):
+        """Closes the idle connections. Connections in use are closed when they are released."""
+        with self._available:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self._close(connection)
+        self._report()
+
+    def stats(self):
+        with self._available:
+            return {
+                'max_size': self.max_size,
+                'size': self.size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'max_in_use': self.max_in_use,
+                'acquired': self.acquired,
+                'opened': self.opened,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 6),
+                'timeouts': self.timeouts,
+            }
+
+    def _wait(self):
+        """Waits, holding the lock, until a connection is idle or the pool has room for a new one."""
+        started = time.monotonic()
+        self.waits += 1
+        try:
+            if not self._available.wait_for(lambda: self._idle or self.size < self.max_size, self.timeout):
+                self.timeouts += 1
+                DB_POOL_TIMEOUTS.labels(self.alias).inc()
+                raise PoolTimeout('No connection to the {} database became available within {} seconds; all {} '
+                                  'pooled connections are in use.'.format(self.alias, self.timeout, self.max_size))
+        finally:
+            waited = time.monotonic() - started
+            self.wait_seconds += waited
+            DB_POOL_WAIT.labels(self.alias).observe(waited)
+
+    def _usable(self, connection):
+        if connection.closed:
+            return False
+        return self.check is None or self.check(connection)
+
+    def _reset(self, connection):
+        """Rolls back the transaction left open on a connection, if any, and returns whether it can be reused."""
+        try:
+            if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _discarded(self):
+        with self._available:
+            self._in_use -= 1
+            self._available.notify()
+        self._report()
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _expire_idle(self):
+        """Closes the connections idle for more than max_idle seconds, keeping the most recently used ones."""
+        if self.max_idle is None:
+            return
+        expired = []
+        now = time.monotonic()
+        with self._available:
+            while self._idle and now - self._idle[0][1] > self.max_idle:
+                expired.append(self._idle.popleft()[0])
+        for connection in expired:
+            self._close(connection)
+
+    def _report(self):
+        self._expire_idle()
+        with self._available:
+            in_use, idle = self._in_use, len(self._idle)
+        DB_POOL_CONNECTIONS.labels(self.alias, 'in_use').set(in_use)
+        DB_POOL_CONNECTIONS.labels(self.alias, 'idle').set(idle)
+
+
+# Pools by database alias and connection parameters, created by the pooled database backend when it first connects.
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(key, create):
+    """Returns the pool with the given key, creating it with create() if the process has none yet."""
+    with pools_lock:
+        if key not in pools:
+            pools[key] = create()
+        return pools[key]
+
+
+def pool_stats():
+    """Returns the stats of the connection pool of each database, in this process."""
+    with pools_lock:
+        return {pool.alias: pool.stats() for pool in pools.values()}
@@ -0,0 +1,79 @@
+"""
+Verification and backfill of the counters maintained on loans.
+"""
+from django.db import connection, transaction
+
+from .analytics import invalidate_portfolio_analytics
+from .models import Loan, Repayment, RepaymentStatus
+from .summaries import rebuild_summaries
+
+# Recomputes the counters of the loans in an ID range from their repayments, and selects the loans whose stored
+# counters differ from the recomputed ones.
+EXPECTED_COUNTERS_SQL = '''
+    WITH expected AS (
+        SELECT
+            loan.id,
+            loan.amount,
+            COALESCE(SUM(repayment.amount) FILTER (WHERE repayment.status = %(paid)s), 0) AS amount_paid,
+            COUNT(repayment.id) FILTER (WHERE repayment.status = %(pending)s) AS pending_repayments,
+            MIN(repayment.due_date) FILTER (WHERE repayment.status = %(pending)s) AS next_due_date
+        FROM {loan_table} loan
+        LEFT JOIN {repayment_table} repayment ON repayment.loan_id = loan.id
+        WHERE loan.id >= %(start_id)s AND loan.id < %(end_id)s
+        GROUP BY loan.id, loan.amount
+    ),
+    drifted AS (
+        SELECT expected.*, GREATEST(expected.amount - expected.amount_paid, 0) AS outstanding_balance
+        FROM expected
+        JOIN {loan_table} loan ON loan.id = expected.id
+        WHERE (loan.amount_paid, loan.outstanding_balance, loan.pending_repayments, loan.next_due_date)
+            IS DISTINCT FROM (expected.amount_paid, GREATEST(expected.amount - expected.amount_paid, 0),
+                              expected.pending_repayments, expected.next_due_date)
+    )
+'''
+
+FIND_DRIFT_SQL = EXPECTED_COUNTERS_SQL + '''
+    SELECT drifted.id FROM drifted ORDER BY drifted.id
+'''
+
+FIX_DRIFT_SQL = EXPECTED_COUNTERS_SQL + '''
+    UPDATE {loan_table} loan
+    SET amount_paid = drifted.amount_paid,
+        outstanding_balance = drifted.outstanding_balance,
+        pending_repayments = drifted.pending_repayments,
+        next_due_date = drifted.next_due_date
+    FROM drifted
+    WHERE loan.id = drifted.id
+    RETURNING loan.id
+'''
+
+
+def _execute(sql, start_id, end_id):
+    sql = sql.format(loan_table=Loan._meta.db_table, repayment_table=Repayment._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'start_id': start_id,
+            'end_id': end_id,
+            'paid': RepaymentStatus.PAID.value,
+            'pending': RepaymentStatus.PENDING.value,
+        })
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+def sync_loan_counters(start_id, end_id, fix=False):
+    """
+    Recomputes the counters of the loans with start_id <= id < end_id from their repayments, with a single set-based
+    statement, and returns the IDs of the loans whose stored counters had drifted. The drifted counters are
+    overwritten if fix is set; the loans in the range are then locked first, like repayments do, so that no
+    repayment can change them between recomputing and overwriting their counters. The loan summaries of the users of
+    the fixed loans are then recomputed, and the cached portfolio analytics invalidated.
+    """
+    with transaction.atomic():
+        if not fix:
+            return _execute(FIND_DRIFT_SQL, start_id, end_id)
+        list(Loan.objects.select_for_update().filter(id__gte=start_id, id__lt=end_id).values_list('id'))
+        loan_ids = _execute(FIX_DRIFT_SQL, start_id, end_id)
+        if loan_ids:
+            rebuild_summaries(Loan.objects.filter(id__in=loan_ids).values_list('user_id', flat=True))
+            invalidate_portfolio_analytics()
+        return loan_ids
@@ -0,0 +1,111 @@
+"""
+Idempotency keys: replaying the stored response to retries of a request made with an Idempotency-Key header.
+"""
+import functools
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+# Claims the key for the request being made, unless a live response is stored under it already, in which case nothing
+# is returned. The key is reclaimed once it has expired. A request with the same key that is still in progress holds
+# the row, or the pending insert of it, until its transaction ends, so the statement waits for it and then sees the
+# response it stored.
+CLAIM_SQL = '''
+    INSERT INTO {table} AS stored (user_id, key, request_hash, status_code, response, created_at)
+    VALUES (%(user_id)s, %(key)s, %(request_hash)s, NULL, NULL, %(now)s)
+    ON CONFLICT (user_id, key) DO UPDATE SET
+        request_hash = EXCLUDED.request_hash,
+        status_code = NULL,
+        response = NULL,
+        created_at = EXCLUDED.created_at
+    WHERE stored.created_at < %(expired_before)s
+    RETURNING stored.id
+'''
+
+
+def request_hash(request):
+    """Returns the SHA-256 digest of the method, path and body of the request."""
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.get_full_path().encode(), request.body):
+        digest.update(part)
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def claim_key(user_id, key, request_digest):
+    """
+    Claims the key of the user for the request with the given digest, and returns None, or returns the stored key if a
+    response is stored under it and has not expired. Must be called inside a transaction.
+    """
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(CLAIM_SQL.format(table=IdempotencyKey._meta.db_table), {
+            'user_id': user_id,
+            'key': key,
+            'request_hash': request_digest,
+            'now': now,
+            'expired_before': now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+        })
+        if cursor.fetchone() is not None:
+            return None
+    return IdempotencyKey.objects.get(user_id=user_id, key=key)
+
+
+def idempotent(handler):
+    """
+    Makes a view handler idempotent for the requests carrying an Idempotency-Key header. The first request with a key
+    runs the handler, in the same transaction as the key is claimed and its response stored in. Retries with the same
+    key get the stored response, without the handler being run, until the key expires after IDEMPOTENCY_KEY_TTL
+    seconds. Concurrent requests with the same key are handled one after the other. Server errors are not stored; the
+    transaction is rolled back instead, so that the request can be retried.
+    """
+    @functools.wraps(handler)
+    def handle(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if key is None or isinstance(request.user, AnonymousUser):
+            return handler(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({'error': 'The {} header must be between 1 and {} characters long.'.format(
+                IDEMPOTENCY_KEY_HEADER, MAX_KEY_LENGTH)}, status=status.HTTP_400_BAD_REQUEST)
+
+        digest = request_hash(request)
+        with transaction.atomic():
+            stored = claim_key(request.user.id, key, digest)
+            if stored is not None:
+                if stored.request_hash != digest:
+                    return Response({'error': 'The {} has already been used for a different request.'.format(
+                        IDEMPOTENCY_KEY_HEADER)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                return Response(stored.response, status=stored.status_code, headers={REPLAYED_HEADER: 'true'})
+
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code >= 500:
+                transaction.set_rollback(True)
+            else:
+                IdempotencyKey.objects.filter(user_id=request.user.id, key=key).update(
+                    status_code=response.status_code, response=response.data)
+            return response
+    return handle
+
+
+def purge_expired_keys(batch_size=1000):
+    """Deletes the expired idempotency keys, in batches in created_at order, and returns the number deleted."""
+    expired_before = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted = 0
+    while True:
+        key_ids = list(IdempotencyKey.objects.filter(created_at__lt=expired_before).order_by('created_at')
+                       .values_list('id', flat=True)[:batch_size])
+        if not key_ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=key_ids).delete()[0]
@@ -0,0 +1,199 @@
+"""
+Per-request performance instrumentation: wall time, database, authentication and serializer time of sampled requests,
+reported in a Server-Timing header and aggregated into histograms per route.
+"""
+import contextvars
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+
+from .metrics import REQUEST_LATENCY
+from .middleware import HybridMiddleware
+
+# Timings of the request being handled, or None if the request is not sampled.
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+SPANS = ('auth', 'serializer')
+
+
+class RequestTimings:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.spans = dict.fromkeys(SPANS, 0.0)
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper, timing every query made while handling the request."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.db_queries += 1
+
+
+@contextmanager
+def timed_queries(timings):
+    """Times the queries made on the connections of the current thread in the block, for the given request timings."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timings.record_query))
+        yield
+
+
+@contextmanager
+def timed(span):
+    """Adds the time spent in the block to the given span of the current request, if it is sampled."""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.spans[span] += time.perf_counter() - started
+
+
+class Histogram:
+    """Counts of observed values in cumulative buckets, along with their sum, as in Prometheus histograms."""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            buckets['+Inf' if bound == float('inf') else str(bound)] = cumulative
+        return {'count': self.count, 'sum': round(self.sum, 3), 'buckets': buckets}
+
+
+class RouteHistograms:
+    """Histograms of the request timings, in milliseconds, per route name and metric."""
+    METRICS = ('total', 'db', 'auth', 'serializer')
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, values):
+        with self._lock:
+            for metric, value in values.items():
+                histogram = self._histograms.get((route, metric))
+                if histogram is None:
+                    histogram = self._histograms[(route, metric)] = Histogram(
+                        self.buckets or settings.REQUEST_METRICS['BUCKETS'])
+                histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            routes = {}
+            for (route, metric), histogram in sorted(self._histograms.items()):
+                routes.setdefault(route, {})[metric] = histogram.snapshot()
+            return routes
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+route_histograms = RouteHistograms()
+
+
+class RequestMetricsMiddleware(HybridMiddleware):
+    """
+    Records the latency of every request in the request latency metric, by view, and times a sample of the requests,
+    given by REQUEST_METRICS['SAMPLE_RATE'], in detail. For each sampled request, the wall time, the number and time of
+    database queries, and the time spent authenticating and in serializers are added to the route histograms and, if
+    REQUEST_METRICS['SERVER_TIMING'] is set, reported in a Server-Timing response header. Requests that are not
+    sampled are only timed as a whole.
+
+    Under ASGI, the middleware runs asynchronously, so that it does not hold a thread for the whole request. The
+    queries of a sampled request are then the ones made through core.async_db.database_sync_to_async.
+    """
+    def handle(self, request):
+        started = time.perf_counter()
+        timings = self.sample()
+        token = current_timings.set(timings)
+        try:
+            if timings is None:
+                response = self.get_response(request)
+            else:
+                with timed_queries(timings):
+                    response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.record(request, response, started, timings)
+
+    async def ahandle(self, request):
+        started = time.perf_counter()
+        timings = self.sample()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.record(request, response, started, timings)
+
+    @staticmethod
+    def sample():
+        """Returns the timings to record for a request, or None if the request is not sampled."""
+        sample_rate = settings.REQUEST_METRICS['SAMPLE_RATE']
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return None
+        return RequestTimings()
+
+    def record(self, request, response, started, timings):
+        total = time.perf_counter() - started
+        view_name = self.view_name(request)
+        REQUEST_LATENCY.labels(view_name).observe(total)
+        if timings is None:
+            return response
+
+        values = {'total': total, 'db': timings.db_time}
+        values.update(timings.spans)
+        values = {metric: value * 1000 for metric, value in values.items()}
+        route_histograms.observe(view_name, values)
+
+        if settings.REQUEST_METRICS['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join(
+                ['total;dur={:.2f}'.format(values['total']),
+                 'db;dur={:.2f};desc="{} queries"'.format(values['db'], timings.db_queries)] +
+                ['{};dur={:.2f}'.format(span, values[span]) for span in SPANS])
+        return response
+
+    @staticmethod
+    def view_name(request):
+        resolver_match = getattr(request, 'resolver_match', None)
+        return resolver_match.view_name if resolver_match else 'unmatched'
+
+
+class TimedSerializerMixin:
+    """Times the validation and representation of the serializer as the serializer span of the current request."""
+    def is_valid(self, *args, **kwargs):
+        with timed('serializer'):
+            return super().is_valid(*args, **kwargs)
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
@@ -0,0 +1,36 @@
+"""
+Django command to move the old paid loans to the archive.
+"""
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from core.archive import archive_cutoff, archive_paid_loans
+
+
+class Command(BaseCommand):
+    """Django command to archive the paid loans in batches, e.g. daily from a scheduler."""
+    help = ('Moves the paid loans created more than --older-than-days days ago, LOAN_ARCHIVE_AFTER_DAYS by default, '
+            'along with their repayments, to the archived loan table, in batches each committed on its own. The '
+            'archived loans are only listed by GET /loan with include_archived=true.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--older-than-days', type=int, help='Archive the paid loans created this many days ago.')
+        parser.add_argument('--today', type=date.fromisoformat, help='Archive as of this date, e.g. 2023-07-31.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches, to leave room for live traffic.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        before = archive_cutoff(options['today'], options['older_than_days'])
+        archived = 0
+        for batch in archive_paid_loans(before, options['batch_size']):
+            archived += batch.archived
+            if options['verbosity'] > 1:
+                self.stdout.write('Archived {} loans, up to created date {} and ID {}'.format(
+                    archived, batch.last_created_date, batch.last_id))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS('Archived {} paid loans created before {}.'.format(archived, before)))
@@ -0,0 +1,107 @@
+"""
+Django command to benchmark the latency and throughput of the API endpoints against a seeded dataset.
+"""
+import json
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.auth_cache import user_cache
+from core.benchmark import (
+    DEFAULT_MIX,
+    PERCENTILES,
+    HTTPSender,
+    InProcessSender,
+    build_requests,
+    compare,
+    create_admin,
+    parse_mix,
+    run_benchmark,
+    throughput_change,
+)
+from core.seeding import seed_dataset
+
+
+class Command(BaseCommand):
+    """Django command to replay a request mix against the API and report its latency and throughput."""
+    help = ('Seeds a dataset, replays a mix of requests to the API endpoints, either in-process or against a running '
+            'server, and reports the p50/p95/p99 latency, requests per second and queries per request of each '
+            'endpoint. The results can be saved as a JSON baseline, and compared against a previous baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--loans-per-user', type=int, default=10)
+        parser.add_argument('--terms', type=int, default=12)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--warmup', type=int, default=50, help='Number of unmeasured requests replayed first.')
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help='Request weights, e.g. list_loans=50,create_loan=20,repay=20,approve=5,create_user=5')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--base-url', help='Benchmark a running server instead of calling the views in-process. '
+                                               'The seeded data is then committed.')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Number of concurrent clients, when benchmarking a running server.')
+        parser.add_argument('--keep-data', action='store_true', help='Commit the seeded data.')
+        parser.add_argument('--output', help='Save the results as a JSON baseline to this file.')
+        parser.add_argument('--compare', help='Compare the results against the JSON baseline in this file.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Fraction by which latency and throughput may regress against the baseline.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if options['concurrency'] > 1 and not options['base_url']:
+            raise CommandError('--concurrency requires --base-url; in-process requests are replayed one at a time.')
+
+        if options['base_url']:
+            results = self.benchmark(HTTPSender(options['base_url']), options)
+        else:
+            with transaction.atomic():
+                results = self.benchmark(InProcessSender(), options)
+                if not options['keep_data']:
+                    transaction.set_rollback(True)
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write('Saved the results to {}'.format(options['output']))
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            change = throughput_change(baseline, results)
+            if change is not None:
+                self.stdout.write('Throughput: {} requests per second, {}x the baseline of {}.'.format(
+                    results['total']['rps'], change, baseline['total']['rps']))
+            regressions = compare(baseline, results, tolerance=options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against {}:\n  {}'.format(options['compare'], '\n  '.join(regressions)))
+            self.stdout.write(self.style.SUCCESS('No regressions against {}.'.format(options['compare'])))
+
+    def benchmark(self, send, options):
+        self.stdout.write('Seeding the dataset...')
+        users = seed_dataset(users=options['users'], loans_per_user=options['loans_per_user'], terms=options['terms'],
+                             prefix='bench_{}_'.format(uuid.uuid4().hex[:8]), seed=options['seed'])
+        admin_name = create_admin()
+        benchmark_requests = build_requests(users, options['warmup'] + options['requests'], mix=options['mix'],
+                                            seed=options['seed'], admin_name=admin_name)
+        user_cache.clear()
+
+        self.stdout.write('Replaying {} requests...'.format(options['requests']))
+        results = run_benchmark(send, benchmark_requests, concurrency=options['concurrency'],
+                                warmup=options['warmup'])
+        results['config'] = {key: options[key] for key in (
+            'users', 'loans_per_user', 'terms', 'requests', 'warmup', 'mix', 'seed', 'base_url', 'concurrency')}
+        return results
+
+    def report(self, results):
+        columns = ['requests', 'errors', 'rps'] + ['p{}_ms'.format(percent) for percent in PERCENTILES] + \
+            ['queries_per_request']
+        widths = [max(len(column), 8) + 2 for column in columns]
+        self.stdout.write('{:<40}'.format('endpoint') + ''.join(
+            '{:>{}}'.format(column, width) for column, width in zip(columns, widths)))
+        rows = list(results['endpoints'].items()) + [('total', results['total'])]
+        for endpoint, summary in rows:
+            self.stdout.write('{:<40}'.format(endpoint) + ''.join(
+                '{:>{}}'.format('-' if summary[column] is None else summary[column], width)
+                for column, width in zip(columns, widths)))
@@ -0,0 +1,175 @@
+"""
+Django command to benchmark the admin loan search against a seeded dataset.
+"""
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.auth_cache import user_cache
+from core.benchmark import create_admin, percentile
+from core.management.commands.explain_queries import find_scans
+from core.models import Loan, LoanStatus
+from core.seeding import in_process_client, seed_dataset
+from loan.search import search_loans
+
+# Makes every fourth approved loan overdue, by moving the due date of its next repayment back by four weeks.
+MAKE_OVERDUE_SQL = '''
+    UPDATE {loan_table} SET next_due_date = next_due_date - 28
+    WHERE status = %(approved)s AND id %% 4 = 0
+'''
+
+
+def plan_nodes(plan):
+    """Yields every node of the plan tree."""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def search_cases(user_name, today):
+    """Returns the (name, query parameters) of the searches to benchmark, one per supported filter combination."""
+    month_ago = (today - timedelta(days=30)).isoformat()
+    return [
+        ('all', {}),
+        ('newest first', {'ordering': '-created_date'}),
+        ('status', {'status': 'APPROVED'}),
+        ('created range', {'created_from': month_ago}),
+        ('status, created range', {'status': 'PENDING', 'created_from': month_ago}),
+        ('amount range', {'min_amount': 1000, 'max_amount': 5000, 'ordering': 'amount'}),
+        ('status, amount range', {'status': 'PAID', 'min_amount': 1000, 'ordering': '-amount'}),
+        ('user', {'user_name': user_name}),
+        ('user, created range', {'user_name': user_name, 'created_from': month_ago}),
+        ('overdue', {'overdue': 'true', 'ordering': 'next_due_date'}),
+        ('approved, next due', {'status': 'APPROVED', 'ordering': 'next_due_date'}),
+        ('not overdue', {'overdue': 'false'}),
+    ]
+
+
+def unserved_search_cases(user_name, today):
+    """
+    Returns the (name, filters, ordering) of selective searches that no index walked in their ordering serves, which
+    GET /admin/loans rejects.
+    """
+    month_ago = today - timedelta(days=30)
+    return [
+        ('amount range by date', {'min_amount': 1000, 'max_amount': 1100}, 'created_date'),
+        ('created range by amount', {'created_from': month_ago}, 'amount'),
+        ('user, status', {'user_name': user_name, 'status': 'APPROVED'}, 'created_date'),
+        ('user by amount', {'user_name': user_name}, '-amount'),
+        ('overdue by date', {'overdue': True}, 'created_date'),
+    ]
+
+
+class Command(BaseCommand):
+    """Django command to measure the latency and query plan of each filter combination of GET /admin/loans."""
+    help = ('Seeds a dataset, then pages through GET /admin/loans for each supported filter combination and reports '
+            'the p50/p95/max latency of its pages, the indexes its page query uses, and the rows it reads and '
+            'discards per page. Fails if a query scans the table sequentially, sorts the loans, or if a p95 latency '
+            'is over --max-p95-ms, and checks that the selective searches no index serves are rejected, reporting the '
+            'rows a page of each would discard if it was served. A quarter of the approved loans are made overdue by '
+            'moving their next due date back. The seeded data is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--loans-per-user', type=int, default=50)
+        parser.add_argument('--terms', type=int, default=12)
+        parser.add_argument('--pages', type=int, default=20, help='Number of consecutive pages fetched per search.')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--max-p95-ms', type=float, help='Fail if a search has a higher p95 page latency.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        with transaction.atomic():
+            self.stdout.write('Seeding the dataset...')
+            users = seed_dataset(users=options['users'], loans_per_user=options['loans_per_user'],
+                                 terms=options['terms'], prefix='search_user_', seed=0)
+            admin_name = create_admin('search_admin')
+            with connection.cursor() as cursor:
+                cursor.execute(MAKE_OVERDUE_SQL.format(loan_table=Loan._meta.db_table),
+                               {'approved': LoanStatus.APPROVED.value})
+                overdue = cursor.rowcount
+                cursor.execute('ANALYZE {}'.format(Loan._meta.db_table))
+            self.stdout.write('{} loans, {} of them overdue.'.format(Loan.objects.count(), overdue))
+
+            failures = []
+            for name, params in search_cases(users[0].user_name, date.today()):
+                params = dict(params, page_size=options['page_size'])
+                latencies, queries = self.page_through(params, admin_name, options['pages'])
+                scans, sorts, removed = self.explain(queries)
+                p95 = percentile(latencies, 95) * 1000
+                self.stdout.write('{:<24} p50 {:>7.2f} ms  p95 {:>7.2f} ms  max {:>7.2f} ms  {:>6} rows discarded  '
+                                  '{}'.format(name, percentile(latencies, 50) * 1000, p95, latencies[-1] * 1000,
+                                              removed, ', '.join(index or node_type for node_type, _, index in scans)))
+                if any(node_type == 'Seq Scan' for node_type, _, _ in scans):
+                    failures.append('{}: sequential scan'.format(name))
+                if sorts:
+                    failures.append('{}: sorts the loans'.format(name))
+                if options['max_p95_ms'] is not None and p95 > options['max_p95_ms']:
+                    failures.append('{}: p95 of {:.2f} ms'.format(name, p95))
+
+            for name, filters, ordering in unserved_search_cases(users[0].user_name, date.today()):
+                status_code, scans, removed = self.try_unserved(filters, ordering, admin_name, options['page_size'])
+                self.stdout.write('{:<24} rejected with {}  {:>6} rows discarded if served  {}'.format(
+                    name, status_code, removed, ', '.join(index or node_type for node_type, _, index in scans)))
+                if status_code != 400:
+                    failures.append('{}: not rejected'.format(name))
+
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError('Searches over budget:\n  {}'.format('\n  '.join(failures)))
+        self.stdout.write(self.style.SUCCESS('Every search is served by an index.'))
+
+    def page_through(self, params, admin_name, pages):
+        """
+        Fetches up to the given number of consecutive pages of the search, and returns the sorted latencies of the
+        requests and the queries of the last one.
+        """
+        client = in_process_client()
+        user_cache.clear()
+        client.get('/admin/loans', params, HTTP_USERNAME=admin_name)
+
+        latencies = []
+        path = '/admin/loans'
+        for _ in range(pages):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(path, params, HTTP_USERNAME=admin_name)
+                latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError('GET /admin/loans?{} returned {}: {}'.format(
+                    params, response.status_code, response.content.decode()))
+            if 'Link' not in response:
+                break
+            path, params = response['Link'][1:response['Link'].index('>')], {}
+        return sorted(latencies), queries.captured_queries
+
+    def try_unserved(self, filters, ordering, admin_name, page_size):
+        """
+        Requests the first page of a search no index serves, and returns the status code of the response along with
+        the scans of the page query it would have run and the number of rows they read and discarded.
+        """
+        params = {name: str(value).lower() if isinstance(value, bool) else value for name, value in filters.items()}
+        response = in_process_client().get('/admin/loans', dict(params, ordering=ordering, page_size=page_size),
+                                           HTTP_USERNAME=admin_name)
+        with CaptureQueriesContext(connection) as queries:
+            list(search_loans(**filters).order_by(ordering, '-id' if ordering.startswith('-') else 'id')[:page_size])
+        scans, _, removed = self.explain(queries.captured_queries)
+        return response.status_code, scans, removed
+
+    def explain(self, queries):
+        """
+        Runs EXPLAIN ANALYZE on the page query among the queries, and returns its scans, whether it sorts, and the
+        number of rows its scans read and discarded.
+        """
+        sql = next(query['sql'] for query in queries if Loan._meta.db_table in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0][0]['Plan']
+        nodes = list(plan_nodes(plan))
+        return (find_scans(plan), any(node['Node Type'] in ('Sort', 'Incremental Sort') for node in nodes),
+                sum(node.get('Rows Removed by Filter', 0) + node.get('Rows Removed by Index Recheck', 0)
+                    for node in nodes))
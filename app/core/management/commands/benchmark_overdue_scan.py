@@ -0,0 +1,73 @@
+"""
+Django command to benchmark the overdue repayment scan against a seeded dataset.
+"""
+import time
+import tracemalloc
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import LoanStatus, Repayment, RepaymentStatus
+from core.overdue import mark_overdue_repayments
+from core.seeding import seed_dataset
+
+
+class Command(BaseCommand):
+    """Django command to measure the throughput and memory use of the overdue scan over a large table."""
+    help = ('Seeds a dataset, with the past due repayments of the approved loans left unpaid, then marks them overdue '
+            'and reports the repayments marked per second over each window of batches, and the peak memory '
+            'allocated during the scan. The seeded data is rolled back unless --keep-data is set.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--loans-per-user', type=int, default=10)
+        parser.add_argument('--terms', type=int, default=12)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--window', type=int, default=100, help='Number of batches per reported window.')
+        parser.add_argument('--keep-data', action='store_true', help='Commit the seeded data.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        with transaction.atomic():
+            self.stdout.write('Seeding the dataset...')
+            seed_dataset(users=options['users'], loans_per_user=options['loans_per_user'], terms=options['terms'],
+                         prefix='overdue_user_', seed=0)
+            Repayment.objects.filter(
+                loan__status=LoanStatus.APPROVED, status=RepaymentStatus.PAID, due_date__lt=date.today(),
+            ).update(status=RepaymentStatus.PENDING)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE {}'.format(Repayment._meta.db_table))
+            overdue = Repayment.objects.filter(status=RepaymentStatus.PENDING, due_date__lt=date.today()).count()
+            self.stdout.write('{} repayments, {} of them overdue.'.format(Repayment.objects.count(), overdue))
+
+            self.scan(options['batch_size'], options['window'])
+            if not options['keep_data']:
+                transaction.set_rollback(True)
+
+    def scan(self, batch_size, window):
+        """Runs the scan, reporting its throughput over each window of batches and its peak memory allocation."""
+        rates = []
+        marked = window_marked = batches = 0
+        tracemalloc.start()
+        started = window_started = time.perf_counter()
+        for batch in mark_overdue_repayments(batch_size=batch_size):
+            marked += batch.marked
+            window_marked += batch.marked
+            batches += 1
+            if batches % window == 0:
+                now = time.perf_counter()
+                rates.append(window_marked / (now - window_started))
+                self.stdout.write('  batches {:>6}: {:>9.0f} repayments/s, {:>8.1f} KiB allocated'.format(
+                    batches, rates[-1], tracemalloc.get_traced_memory()[0] / 1024))
+                window_marked, window_started = 0, now
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self.stdout.write('Marked {} repayments overdue in {} batches, in {:.2f}s ({:.0f} repayments/s).'.format(
+            marked, batches, elapsed, marked / elapsed if elapsed else 0))
+        if rates:
+            self.stdout.write('Throughput per window: min {:.0f}, max {:.0f} repayments/s.'.format(
+                min(rates), max(rates)))
+        self.stdout.write('Peak memory allocated during the scan: {:.1f} KiB.'.format(peak / 1024))
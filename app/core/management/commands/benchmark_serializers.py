@@ -0,0 +1,67 @@
+"""
+Django command to benchmark the serialization of the loan listings against a seeded dataset.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Loan
+from core.seeding import seed_dataset
+from loan.fast_serializers import FastJSONRenderer, loan_rows, serialize_loans
+from loan.pagination import ordered_repayments_prefetch
+from loan.serializers import LoanListSerializer
+
+
+class Command(BaseCommand):
+    """Django command to compare the cost per loan of the DRF serializers and of the fast serializers."""
+    help = ('Seeds a dataset, then reads, serializes and renders the same page of loans with LoanListSerializer and '
+            'JSONRenderer, and with the fast serializers and FastJSONRenderer, and reports the time per loan of each, '
+            'checking that both render the same bytes. The seeded data is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--loans-per-user', type=int, default=50)
+        parser.add_argument('--terms', type=int, default=12)
+        parser.add_argument('--page-size', type=int, default=500, help='Number of loans serialized per round.')
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        with transaction.atomic():
+            self.stdout.write('Seeding the dataset...')
+            seed_dataset(users=options['users'], loans_per_user=options['loans_per_user'], terms=options['terms'],
+                         prefix='serializer_user_', seed=0)
+            loans = Loan.objects.order_by('created_date', 'id')[:options['page_size']]
+
+            def drf():
+                return JSONRenderer().render(
+                    LoanListSerializer(loans.prefetch_related(ordered_repayments_prefetch()), many=True).data)
+
+            def fast():
+                return FastJSONRenderer().render(serialize_loans(list(loan_rows(loans))))
+
+            count = len(loans)
+            if drf() != fast():
+                raise CommandError('The fast serializers do not render the same bytes as LoanListSerializer.')
+
+            results = {name: self.time_per_loan(render, count, options['rounds'])
+                       for name, render in (('serializers', drf), ('fast', fast))}
+            transaction.set_rollback(True)
+
+        self.stdout.write('{} loans per round, {} rounds; identical output.'.format(count, options['rounds']))
+        for name, per_loan in results.items():
+            self.stdout.write('  {:<12} {:>9.1f} us per loan'.format(name, per_loan))
+        if results['fast']:
+            self.stdout.write('Speedup: {:.1f}x'.format(results['serializers'] / results['fast']))
+
+    def time_per_loan(self, render, count, rounds):
+        """Returns the median time, in microseconds per loan, to read, serialize and render the page of loans."""
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return timings[len(timings) // 2] / max(count, 1) * 1e6
@@ -0,0 +1,107 @@
+"""
+Django command to check the query plans of the API endpoints against a seeded dataset.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.auth_cache import user_cache
+from core.models import Loan, LoanStatus, Repayment, RepaymentStatus, User
+from core.seeding import in_process_client, seed_dataset
+
+SCAN_NODE_TYPES = ('Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+IGNORED_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def find_scans(plan):
+    """Returns the (node type, relation, index) of every scan in the plan tree."""
+    scans = []
+    if plan['Node Type'] in SCAN_NODE_TYPES:
+        scans.append((plan['Node Type'], plan.get('Relation Name'), plan.get('Index Name')))
+    for child in plan.get('Plans', []):
+        scans.extend(find_scans(child))
+    return scans
+
+
+class Command(BaseCommand):
+    """Django command to run EXPLAIN ANALYZE on the queries of each API endpoint."""
+    help = ('Seeds a dataset, replays a request to each API endpoint, runs EXPLAIN ANALYZE on every query it made '
+            'and reports whether each query uses an index. The seeded data is rolled back unless --keep-data is set.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--loans-per-user', type=int, default=50)
+        parser.add_argument('--terms', type=int, default=12)
+        parser.add_argument('--keep-data', action='store_true', help='Commit the seeded data.')
+        parser.add_argument('--fail-on-seq-scan', action='store_true',
+                            help='Exit with an error if any query does a sequential scan.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        with transaction.atomic():
+            self.stdout.write('Seeding the dataset...')
+            users = seed_dataset(users=options['users'], loans_per_user=options['loans_per_user'],
+                                 terms=options['terms'], prefix='explain_user_', seed=0)
+            User.objects.create(user_name='explain_admin', is_admin=True)
+
+            seq_scans = 0
+            for endpoint, request in self.get_requests(users[0]):
+                self.stdout.write(self.style.MIGRATE_HEADING(endpoint))
+                for sql, scans, duration in self.explain_request(request):
+                    if not scans:
+                        label = 'no scan'
+                    elif any(node_type == 'Seq Scan' for node_type, _, _ in scans):
+                        seq_scans += 1
+                        label = self.style.ERROR('seq scan')
+                    else:
+                        label = self.style.SUCCESS('index')
+                    self.stdout.write('  [{}] {:.3f} ms  {}'.format(label, duration, ' '.join(sql.split())[:120]))
+                    for node_type, relation, index in scans:
+                        self.stdout.write('      {}{} on {}'.format(
+                            node_type, ' using {}'.format(index) if index else '', relation or '-'))
+
+            if not options['keep_data']:
+                transaction.set_rollback(True)
+
+        if seq_scans and options['fail_on_seq_scan']:
+            raise CommandError('{} queries do a sequential scan.'.format(seq_scans))
+
+    def get_requests(self, user):
+        """Returns the (endpoint, request) pairs to replay, each request being a callable taking an API client."""
+        headers = {'HTTP_USERNAME': user.user_name}
+        admin_headers = {'HTTP_USERNAME': 'explain_admin'}
+        pending_loan = Loan.objects.filter(user=user, status=LoanStatus.PENDING).first() or \
+            Loan.objects.create(user=user, amount=1200, terms=12)
+        repayment = Repayment.objects.filter(
+            loan__user=user, loan__status=LoanStatus.APPROVED, status=RepaymentStatus.PENDING).first()
+
+        requests = [
+            ('GET /loan', lambda client: client.get('/loan', **headers)),
+            ('POST /loan', lambda client: client.post('/loan', {'amount': 1200, 'terms': 12}, **headers)),
+            ('PUT /approval/<loan_id>',
+             lambda client: client.put('/approval/{}'.format(pending_loan.id), **admin_headers)),
+        ]
+        if repayment is not None:
+            requests.append((
+                'PUT /repayment/<loan_id>/<repayment_id>',
+                lambda client: client.put('/repayment/{}/{}'.format(repayment.loan_id, repayment.id),
+                                          {'amount': repayment.amount}, **headers)))
+        return requests
+
+    def explain_request(self, request):
+        """Replays the request, then explains each of its queries in a savepoint that is rolled back afterwards."""
+        user_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            request(in_process_client())
+
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if sql.startswith(IGNORED_STATEMENTS):
+                continue
+
+            savepoint = transaction.savepoint()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql)
+                explained = cursor.fetchone()[0][0]
+            transaction.savepoint_rollback(savepoint)
+            yield sql, find_scans(explained['Plan']), explained['Execution Time']
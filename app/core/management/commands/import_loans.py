@@ -0,0 +1,55 @@
+"""
+Django command to import loans in bulk from a JSONL or CSV file.
+"""
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import LoanImport
+from loan.imports import IMPORT_BATCH_SIZE, ImportConflict, detect_format, import_loans, iter_errors
+from loan.serializers import IMPORT_FORMATS
+
+
+class Command(BaseCommand):
+    """Django command to import loans, along with their repayment schedules, in batches."""
+    help = ('Imports the loans in a JSONL or CSV file with user_name, amount, terms and optionally created_date '
+            'columns, creating their repayment schedules, in batches. An interrupted import is resumed from its last '
+            'imported batch when run again with the same name.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to csv for .csv files, jsonl otherwise.')
+        parser.add_argument('--name', help='Name the progress of the import is saved under. Defaults to the path.')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--error-report', help='Write the errors of the import to this file, as JSON lines.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        path = options['path']
+        name = options['name'] or os.path.abspath(path)
+        file_format = options['format'] or detect_format(path)
+
+        loan_import = LoanImport.objects.filter(name=name).first()
+        if loan_import is not None and loan_import.last_line:
+            self.stdout.write('Resuming the import {} after line {}.'.format(name, loan_import.last_line))
+
+        try:
+            with open(path, newline='', encoding='utf-8') as lines:
+                for loan_import in import_loans(lines, file_format, name, batch_size=options['batch_size']):
+                    self.stdout.write('Up to line {}: {} loans imported, {} rows failed'.format(
+                        loan_import.last_line, loan_import.imported, loan_import.failed))
+        except (OSError, ValueError, ImportConflict) as ex:
+            raise CommandError(str(ex))
+
+        loan_import = LoanImport.objects.get(name=name)
+        if options['error_report']:
+            self.write_error_report(loan_import, options['error_report'])
+        message = 'Imported {} loans, {} rows failed.'.format(loan_import.imported, loan_import.failed)
+        self.stdout.write(self.style.WARNING(message) if loan_import.failed else self.style.SUCCESS(message))
+
+    @staticmethod
+    def write_error_report(loan_import, path):
+        with open(path, 'w', encoding='utf-8') as report:
+            for error in iter_errors(loan_import):
+                report.write(json.dumps(error) + '\n')
@@ -0,0 +1,46 @@
+"""
+Django command to create the future partitions of the repayment table and archive the old ones left empty.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from core.partitions import ARCHIVE_SCHEMA, add_months, archivable_partitions, archive_partitions, create_partitions
+
+
+class Command(BaseCommand):
+    """Django command to maintain the monthly partitions of the repayment table, e.g. monthly from a scheduler."""
+    help = ('Creates the monthly partitions of the repayment table up to --months-ahead months ahead, moving the '
+            'repayments due in them out of the default partition. With --archive-before, detaches the oldest '
+            'partitions ending by that date left without repayments once their loans were archived by '
+            'archive_paid_loans, and moves them to the archive schema.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=12,
+                            help='Create the partitions up to this many months after the current one.')
+        parser.add_argument('--today', type=date.fromisoformat, help='Run as of this date, e.g. 2023-07-31.')
+        parser.add_argument('--archive-before', type=date.fromisoformat,
+                            help='Archive the emptied partitions ending on or before this date, e.g. 2022-01-01.')
+        parser.add_argument('--archive-schema', default=ARCHIVE_SCHEMA)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the partitions that would be archived without archiving them.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        this_month = add_months(options['today'] or date.today(), 0)
+        for partition, moved in create_partitions(this_month, add_months(this_month, options['months_ahead'])):
+            self.stdout.write('Created partition {} for {} to {}, moving {} repayments from the default partition.'
+                              .format(partition.name, partition.start, partition.end, moved))
+
+        if options['archive_before']:
+            partitions = archivable_partitions(options['archive_before'])
+            for partition in partitions:
+                self.stdout.write('{} partition {} for {} to {}.'.format(
+                    'Would archive' if options['dry_run'] else 'Archiving', partition.name, partition.start,
+                    partition.end))
+            if not options['dry_run']:
+                archive_partitions(partitions, options['archive_schema'])
+                self.stdout.write('Archived {} partitions to the {} schema.'.format(
+                    len(partitions), options['archive_schema']))
+
+        self.stdout.write(self.style.SUCCESS('Repayment partitions are up to date.'))
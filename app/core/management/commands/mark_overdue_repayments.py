@@ -0,0 +1,38 @@
+"""
+Django command to mark the pending repayments that are past their due date as overdue.
+"""
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from core.overdue import SCAN_START, mark_overdue_repayments
+
+
+class Command(BaseCommand):
+    """Django command to scan for overdue repayments in batches, e.g. daily from a scheduler."""
+    help = ('Marks the pending repayments that are due before today as overdue, whatever the status of their loan, in '
+            'batches walked in due date order, each committed on its own. The scan can run alongside live traffic, '
+            'and be resumed from the last due date and ID it reported.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--today', type=date.fromisoformat, help='Scan as of this date, e.g. 2023-07-31.')
+        parser.add_argument('--after-due-date', type=date.fromisoformat,
+                            help='Resume after this due date, as reported by a previous scan.')
+        parser.add_argument('--after-id', type=int, default=0, help='Resume after this repayment ID.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches, to leave room for live traffic.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        after = (options['after_due_date'], options['after_id']) if options['after_due_date'] else SCAN_START
+        marked = 0
+        for batch in mark_overdue_repayments(options['today'], after, options['batch_size']):
+            marked += batch.marked
+            if options['verbosity'] > 1:
+                self.stdout.write('Marked {} repayments, up to due date {} and ID {}'.format(
+                    marked, batch.last_due_date, batch.last_id))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS('Marked {} repayments overdue.'.format(marked)))
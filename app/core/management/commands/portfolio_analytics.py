@@ -0,0 +1,43 @@
+"""
+Django command to report the portfolio analytics.
+"""
+import json
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from core.analytics import compute_portfolio_analytics
+
+
+class Command(BaseCommand):
+    """Django command to compute the portfolio analytics, as served by GET /admin/analytics, bypassing the cache."""
+    help = ('Computes the outstanding principal by loan status, the repayment rate curves by origination week and the '
+            'expected cash flow by due week, with one aggregate query each, and prints them, or saves them as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--today', type=date.fromisoformat, help='Compute as of this date, e.g. 2023-07-31.')
+        parser.add_argument('--output', help='Save the analytics as JSON to this file.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        analytics = compute_portfolio_analytics(options['today'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(analytics, output, indent=2)
+            self.stdout.write('Saved the analytics to {}'.format(options['output']))
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Outstanding principal by status'))
+        for row in analytics['outstanding_by_status']:
+            self.stdout.write('  {status:<9} {loans:>9} loans  principal {principal:>13}  paid {amount_paid:>13}  '
+                              'outstanding {outstanding_principal:>13}'.format(**row))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Cumulative repayment rate by origination week'))
+        for cohort in analytics['repayment_curves']:
+            self.stdout.write('  {}  {}'.format(cohort['origination_week'], ' '.join(
+                '{:.2f}'.format(week['cumulative_repayment_rate'] or 0) for week in cohort['weeks'])))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Expected cash flow by due week'))
+        for row in analytics['cash_flow']:
+            self.stdout.write('  {due_week}  {repayments:>9} repayments  {amount:>13}  overdue {overdue_amount:>13}'
+                              .format(**row))
@@ -0,0 +1,20 @@
+"""
+Django command to delete the expired idempotency keys.
+"""
+from django.core.management.base import BaseCommand
+
+from core.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    """Django command to delete the idempotency keys older than IDEMPOTENCY_KEY_TTL, e.g. hourly from a scheduler."""
+    help = ('Deletes the stored responses of the idempotency keys that have expired, in batches, oldest first. '
+            'Expired keys are no longer replayed whether or not they have been deleted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        deleted = purge_expired_keys(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Deleted {} expired idempotency keys.'.format(deleted)))
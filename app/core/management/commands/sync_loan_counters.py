@@ -0,0 +1,45 @@
+"""
+Django command to verify, and optionally backfill, the counters maintained on loans.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from core.counters import sync_loan_counters
+from core.models import Loan
+
+
+class Command(BaseCommand):
+    """Django command to recompute the loan counters in bulk and report any drift."""
+    help = ('Recomputes the amount paid, outstanding balance, pending repayment count and next due date of every '
+            'loan from its repayments, in batches of loan IDs, and reports the loans whose counters have drifted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Overwrite the counters that have drifted.')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--start-id', type=int, help='Resume from this loan ID.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        bounds = Loan.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if bounds['min_id'] is None:
+            self.stdout.write('There are no loans.')
+            return
+
+        start_id = options['start_id'] or bounds['min_id']
+        batch_size = options['batch_size']
+        drifted = 0
+        while start_id <= bounds['max_id']:
+            end_id = start_id + batch_size
+            loan_ids = sync_loan_counters(start_id, end_id, fix=options['fix'])
+            drifted += len(loan_ids)
+            if loan_ids:
+                self.stdout.write('Loans {} to {}: {} drifted ({})'.format(
+                    start_id, end_id - 1, len(loan_ids), ', '.join(str(loan_id) for loan_id in loan_ids[:20])))
+            start_id = end_id
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All loan counters are up to date.'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS('Fixed the counters of {} loans.'.format(drifted)))
+        else:
+            raise CommandError('The counters of {} loans have drifted. Run with --fix to fix them.'.format(drifted))
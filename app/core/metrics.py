@@ -0,0 +1,83 @@
+"""
+Prometheus metrics: request latency per view, database connections and connection pools, authentication cache lookups
+and domain counters.
+
+When the PROMETHEUS_MULTIPROC_DIR environment variable is set, the metrics of every worker process are kept in files
+in that directory and aggregated when scraped, so the exported numbers cover all the workers of the server.
+"""
+import os
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time taken to handle requests, by view.', ['view'],
+    buckets=[bound / 1000 for bound in settings.REQUEST_METRICS['BUCKETS']])
+AUTH_CACHE_LOOKUPS = Counter(
+    'auth_user_cache_lookups_total', 'User lookups made while authenticating, by the cache tier serving them.',
+    ['result'])
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Connections held by the in-process connection pools, by state.', ['database', 'state'],
+    multiprocess_mode='livesum')
+DB_POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a pooled connection, when all of them were in use.', ['database'])
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts_total', 'Waits for a pooled connection that timed out.', ['database'])
+LOANS_CREATED = Counter('loans_created_total', 'Loans created, including imported loans.')
+LOANS_APPROVED = Counter('loans_approved_total', 'Loans approved.')
+REPAYMENTS_PROCESSED = Counter('repayments_processed_total', 'Repayments made.')
+REBALANCES = Counter('repayment_rebalances_total', 'Rebalances of the pending repayments of a loan.')
+LOANS_PAID = Counter('loans_paid_total', 'Loans fully repaid.')
+REPAYMENTS_OVERDUE = Counter('repayments_marked_overdue_total', 'Repayments marked overdue by the overdue scan.')
+LOANS_ARCHIVED = Counter('loans_archived_total', 'Paid loans moved to the archive.')
+
+# Connections to each configured database, by state, as seen by the database server.
+DB_CONNECTIONS_SQL = '''
+    SELECT COALESCE(state, 'unknown'), COUNT(*) FROM pg_stat_activity
+    WHERE datname = current_database() AND backend_type = 'client backend'
+    GROUP BY 1
+'''
+
+
+def count_on_commit(counter, amount=1):
+    """Increments the counter once the current transaction commits, so that rolled back work is not counted."""
+    if amount:
+        transaction.on_commit(lambda: counter.inc(amount))
+
+
+class DatabaseConnectionCollector:
+    """Collects, at scrape time, the number of connections each configured Postgres database has, by state."""
+    def collect(self):
+        metric = GaugeMetricFamily('db_connections', 'Connections to the database, by state.',
+                                   labels=['database', 'state'])
+        for connection in connections.all():
+            if connection.vendor != 'postgresql':
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(DB_CONNECTIONS_SQL)
+                for state, count in cursor.fetchall():
+                    metric.add_metric([connection.alias, state], count)
+        yield metric
+
+
+database_registry = CollectorRegistry()
+database_registry.register(DatabaseConnectionCollector())
+
+
+def get_registry():
+    """Returns the registry of the metrics of all the worker processes, or of this process in single process mode."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_view(request):
+    """Exports the metrics in the Prometheus text format."""
+    return HttpResponse(generate_latest(get_registry()) + generate_latest(database_registry),
+                        content_type=CONTENT_TYPE_LATEST)
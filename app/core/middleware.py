@@ -0,0 +1,35 @@
+"""
+Base class of the middleware of the app, which run synchronously under WSGI and asynchronously under ASGI.
+"""
+from abc import ABC, abstractmethod
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class HybridMiddleware(ABC):
+    """
+    Middleware running the way the rest of the middleware chain does: handle() is called with the requests served
+    synchronously, and ahandle() awaited with the requests served asynchronously.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            # Makes Django call the middleware as a coroutine function.
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.ahandle(request)
+        return self.handle(request)
+
+    @abstractmethod
+    def handle(self, request):
+        """Handles a request served synchronously, returning its response."""
+
+    @abstractmethod
+    async def ahandle(self, request):
+        """Handles a request served asynchronously, returning its response."""
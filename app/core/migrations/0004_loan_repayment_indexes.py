@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-16 20:43
+
+import core.models
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # The indexes are built concurrently, so that writes to the tables are not blocked while they are being built.
+    # The foreign key indexes are dropped once the new indexes, which lead with the same columns, are in place.
+    atomic = False
+
+    dependencies = [
+        ('core', '0003_user_is_admin'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='loan',
+            index=models.Index(fields=['user', 'created_date', 'id'], name='loan_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='repayment',
+            index=models.Index(fields=['loan', 'status'], name='repayment_loan_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='repayment',
+            index=models.Index(condition=models.Q(('status', core.models.RepaymentStatus(0))), fields=['loan', 'due_date', 'id'], name='repayment_pending_idx'),
+        ),
+        migrations.AlterField(
+            model_name='loan',
+            name='user',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.user'),
+        ),
+        migrations.AlterField(
+            model_name='repayment',
+            name='loan',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='repayments', to='core.loan'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.25 on 2026-10-16 20:45
+
+import datetime
+from django.db import migrations, models
+
+
+# Backfills the counters of the existing loans from their repayments (status 0 is PENDING, 1 is PAID). Drift
+# introduced later on can be checked and fixed with the sync_loan_counters command.
+BACKFILL_LOAN_COUNTERS_SQL = '''
+    UPDATE core_loan SET outstanding_balance = amount;
+    UPDATE core_loan loan
+    SET amount_paid = repayments.amount_paid,
+        outstanding_balance = GREATEST(loan.amount - repayments.amount_paid, 0),
+        pending_repayments = repayments.pending_repayments,
+        next_due_date = repayments.next_due_date
+    FROM (
+        SELECT
+            loan_id,
+            COALESCE(SUM(amount) FILTER (WHERE status = 1), 0) AS amount_paid,
+            COUNT(*) FILTER (WHERE status = 0) AS pending_repayments,
+            MIN(due_date) FILTER (WHERE status = 0) AS next_due_date
+        FROM core_repayment
+        GROUP BY loan_id
+    ) repayments
+    WHERE loan.id = repayments.loan_id;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_loan_repayment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='amount_paid',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='next_due_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='outstanding_balance',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='pending_repayments',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='loan',
+            name='created_date',
+            field=models.DateField(default=datetime.date.today),
+        ),
+        migrations.RunSQL(BACKFILL_LOAN_COUNTERS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-16 20:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_loan_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('last_line', models.IntegerField(default=0)),
+                ('imported', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoanImportError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line', models.IntegerField()),
+                ('errors', models.JSONField()),
+                ('loan_import', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='core.loanimport')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='loanimporterror',
+            index=models.Index(fields=['loan_import', 'line'], name='loan_import_error_line_idx'),
+        ),
+    ]
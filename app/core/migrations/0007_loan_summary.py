@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-16 22:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Backfills the summaries of the users with loans from the loan counters (status 0 is PENDING, 1 is APPROVED and 2 is
+# PAID).
+BACKFILL_LOAN_SUMMARIES_SQL = '''
+    INSERT INTO core_loansummary
+        (user_id, loans, pending_loans, active_loans, paid_loans, total_borrowed, total_paid, outstanding_balance,
+         next_due_date)
+    SELECT
+        user_id,
+        COUNT(*),
+        COUNT(*) FILTER (WHERE status = 0),
+        COUNT(*) FILTER (WHERE status = 1),
+        COUNT(*) FILTER (WHERE status = 2),
+        SUM(amount),
+        SUM(amount_paid),
+        SUM(outstanding_balance),
+        MIN(next_due_date) FILTER (WHERE status = 1)
+    FROM core_loan
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id;
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_loan_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='loan_summary', serialize=False, to='core.user')),
+                ('loans', models.IntegerField(default=0)),
+                ('pending_loans', models.IntegerField(default=0)),
+                ('active_loans', models.IntegerField(default=0)),
+                ('paid_loans', models.IntegerField(default=0)),
+                ('total_borrowed', models.BigIntegerField(default=0)),
+                ('total_paid', models.BigIntegerField(default=0)),
+                ('outstanding_balance', models.BigIntegerField(default=0)),
+                ('next_due_date', models.DateField(null=True)),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL_LOAN_SUMMARIES_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-16 21:05
+
+import core.models
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently, so that repayments can still be made while it is being built.
+    atomic = False
+
+    dependencies = [
+        ('core', '0007_loan_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repayment',
+            name='overdue',
+            field=models.BooleanField(default=False),
+        ),
+        AddIndexConcurrently(
+            model_name='repayment',
+            index=models.Index(condition=models.Q(('overdue', False), ('status', core.models.RepaymentStatus(0))), fields=['due_date', 'id'], name='repayment_overdue_scan_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-16 22:34
+
+import core.models
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The indexes are built concurrently, so that loans can still be created and repaid while they are being built.
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_idempotency_key'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='loan',
+            index=models.Index(fields=['created_date', 'id'], name='loan_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='loan',
+            index=models.Index(fields=['status', 'created_date', 'id'], name='loan_status_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='loan',
+            index=models.Index(fields=['amount', 'id'], name='loan_amount_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='loan',
+            index=models.Index(fields=['status', 'amount', 'id'], name='loan_status_amount_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('status', core.models.LoanStatus(1))), fields=['next_due_date', 'id'], name='loan_approved_due_idx'),
+        ),
+    ]
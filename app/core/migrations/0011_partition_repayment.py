@@ -0,0 +1,98 @@
+# Generated by Django 3.2.25 on 2026-10-16 23:40
+
+from django.db import migrations
+
+
+# Rebuilds the repayment table as a table partitioned by due_date range, with one partition per month, named
+# core_repayment_pYYYY_MM, from the month of the earliest due date to 12 months ahead, and a default partition for
+# the repayments due in the other months. Partitions for later months are created by the manage_repayment_partitions
+# command. The primary key of a partitioned table must include the partition key, so it becomes (id, due_date); ids
+# stay unique as they are all drawn from the same sequence. Indexes are created once the rows are copied, with the
+# names the model declares, and are then created on every partition attached later on. Postgres cannot build an index
+# on a partitioned table concurrently, so indexes added to the model from now on cannot use AddIndexConcurrently.
+# The table is rewritten in a single transaction, during which repayments can neither be read nor written.
+PARTITION_REPAYMENT_SQL = '''
+    ALTER TABLE core_repayment RENAME TO core_repayment_unpartitioned;
+    ALTER SEQUENCE core_repayment_id_seq OWNED BY NONE;
+
+    CREATE TABLE core_repayment (
+        id bigint NOT NULL DEFAULT nextval('core_repayment_id_seq'),
+        amount integer NOT NULL,
+        status integer NOT NULL,
+        due_date date NOT NULL,
+        loan_id bigint NOT NULL,
+        overdue boolean NOT NULL
+    ) PARTITION BY RANGE (due_date);
+    CREATE TABLE core_repayment_default PARTITION OF core_repayment DEFAULT;
+
+    DO $$
+    DECLARE
+        month date;
+    BEGIN
+        FOR month IN
+            SELECT generate_series(first_month, date_trunc('month', CURRENT_DATE) + INTERVAL '12 months',
+                                   INTERVAL '1 month')::date
+            FROM (
+                SELECT date_trunc('month', LEAST(MIN(due_date), CURRENT_DATE)) AS first_month
+                FROM core_repayment_unpartitioned
+            ) repayments
+        LOOP
+            EXECUTE format('CREATE TABLE %I PARTITION OF core_repayment FOR VALUES FROM (%L) TO (%L)',
+                           'core_repayment_p' || to_char(month, 'YYYY_MM'), month,
+                           (month + INTERVAL '1 month')::date);
+        END LOOP;
+    END
+    $$;
+
+    INSERT INTO core_repayment (id, amount, status, due_date, loan_id, overdue)
+    SELECT id, amount, status, due_date, loan_id, overdue FROM core_repayment_unpartitioned;
+    DROP TABLE core_repayment_unpartitioned;
+    ALTER SEQUENCE core_repayment_id_seq OWNED BY core_repayment.id;
+
+    ALTER TABLE core_repayment ADD CONSTRAINT core_repayment_pkey PRIMARY KEY (id, due_date);
+    ALTER TABLE core_repayment ADD CONSTRAINT core_repayment_loan_id_fk_core_loan_id
+        FOREIGN KEY (loan_id) REFERENCES core_loan (id) DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX repayment_loan_status_idx ON core_repayment (loan_id, status);
+    CREATE INDEX repayment_pending_idx ON core_repayment (loan_id, due_date, id) WHERE status = 0;
+    CREATE INDEX repayment_overdue_scan_idx ON core_repayment (due_date, id) WHERE NOT overdue AND status = 0;
+    ANALYZE core_repayment;
+'''
+
+# Rebuilds the plain repayment table from the partitions still attached. Partitions archived by the
+# manage_repayment_partitions command are left in their archive schema.
+UNPARTITION_REPAYMENT_SQL = '''
+    ALTER TABLE core_repayment RENAME TO core_repayment_partitioned;
+    ALTER TABLE core_repayment_partitioned DROP CONSTRAINT core_repayment_pkey;
+    ALTER SEQUENCE core_repayment_id_seq OWNED BY NONE;
+    DROP INDEX repayment_loan_status_idx, repayment_pending_idx, repayment_overdue_scan_idx;
+
+    CREATE TABLE core_repayment (
+        id bigint NOT NULL DEFAULT nextval('core_repayment_id_seq') PRIMARY KEY,
+        amount integer NOT NULL,
+        status integer NOT NULL,
+        due_date date NOT NULL,
+        loan_id bigint NOT NULL,
+        overdue boolean NOT NULL
+    );
+    INSERT INTO core_repayment (id, amount, status, due_date, loan_id, overdue)
+    SELECT id, amount, status, due_date, loan_id, overdue FROM core_repayment_partitioned;
+    DROP TABLE core_repayment_partitioned;
+    ALTER SEQUENCE core_repayment_id_seq OWNED BY core_repayment.id;
+
+    ALTER TABLE core_repayment ADD CONSTRAINT core_repayment_loan_id_fk_core_loan_id
+        FOREIGN KEY (loan_id) REFERENCES core_loan (id) DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX repayment_loan_status_idx ON core_repayment (loan_id, status);
+    CREATE INDEX repayment_pending_idx ON core_repayment (loan_id, due_date, id) WHERE status = 0;
+    CREATE INDEX repayment_overdue_scan_idx ON core_repayment (due_date, id) WHERE NOT overdue AND status = 0;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_loan_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_REPAYMENT_SQL, UNPARTITION_REPAYMENT_SQL),
+    ]
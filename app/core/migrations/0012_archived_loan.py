@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-16 23:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_partition_repayment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedLoan',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.IntegerField()),
+                ('terms', models.IntegerField()),
+                ('created_date', models.DateField()),
+                ('amount_paid', models.IntegerField()),
+                ('repayments', models.JSONField()),
+                ('archived_at', models.DateTimeField()),
+                ('user', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.user')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['user', 'created_date', 'id'], name='archived_loan_user_created_idx'),
+        ),
+    ]
@@ -1,9 +1,15 @@
 """
 Database models.
 """
+from datetime import date
+
 from django.contrib.auth.base_user import BaseUserManager
 from django_enumfield import enum
 from django.db import models
+from django.dispatch import Signal
+
+# Sent with the user_names of the users changed by UserQuerySet.update(), which, unlike User.save(), sends no post_save.
+users_updated = Signal()
 
 
 class LoanStatus(enum.Enum):
@@ -25,7 +31,15 @@ class RepaymentStatus(enum.Enum):
         return cls.get(type_id).name
 
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        user_names = list(self.values_list('user_name', flat=True))
+        rows = super().update(**kwargs)
+        users_updated.send(sender=self.model, user_names=user_names)
+        return rows
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     def create_user(self, user_name, is_admin):
         user = self.model(user_name=user_name, is_admin=is_admin)
         user.save(using=self._db)
@@ -39,17 +53,135 @@ class User(models.Model):
 
 
 class Loan(models.Model):
-    user = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
+    # Lookups by user are served by loan_user_created_idx, which leads with the user.
+    user = models.ForeignKey(User, null=True, on_delete=models.CASCADE, db_index=False)
     amount = models.IntegerField()
     terms = models.IntegerField()
-    created_date = models.DateField(auto_now_add=True)
+    created_date = models.DateField(default=date.today)
     status = enum.EnumField(LoanStatus, default=LoanStatus.PENDING)
+    # Counters maintained on every repayment, so the state of a loan can be read without aggregating its repayments.
+    amount_paid = models.IntegerField(default=0)
+    outstanding_balance = models.IntegerField(default=0)
+    pending_repayments = models.IntegerField(default=0)
+    next_due_date = models.DateField(null=True)
+
+    class Meta:
+        indexes = [
+            # Loans of a user, in the (created_date, id) order the loan listing is paginated on.
+            models.Index(fields=['user', 'created_date', 'id'], name='loan_user_created_idx'),
+            # Loans of all the users in each of the orderings of the admin loan search, with or without a status.
+            models.Index(fields=['created_date', 'id'], name='loan_created_idx'),
+            models.Index(fields=['status', 'created_date', 'id'], name='loan_status_created_idx'),
+            models.Index(fields=['amount', 'id'], name='loan_amount_idx'),
+            models.Index(fields=['status', 'amount', 'id'], name='loan_status_amount_idx'),
+            # Approved loans by the due date of their next repayment, i.e. the overdue loans first.
+            models.Index(fields=['next_due_date', 'id'], condition=models.Q(status=LoanStatus.APPROVED),
+                         name='loan_approved_due_idx'),
+        ]
 
 
 class Repayment(models.Model):
-    loan = models.ForeignKey('Loan', related_name='repayments', on_delete=models.CASCADE)
+    # The table is partitioned by due_date range, one partition per month, with (id, due_date) as its primary key in
+    # the database; see partitions.py. Queries filtering on due_date only read the partitions of the months they cover.
+    loan = models.ForeignKey('Loan', related_name='repayments', on_delete=models.CASCADE, db_index=False)
     amount = models.IntegerField()
     status = enum.EnumField(RepaymentStatus, default=RepaymentStatus.PENDING)
     due_date = models.DateField()
-
-
+    # Set by the overdue repayment scan once a pending repayment is past its due date, whatever the status of its loan,
+    # and kept once the repayment is made, as a record of it having been paid late.
+    overdue = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Repayments of a loan by status, e.g. the paid repayments summed up while rebalancing.
+            models.Index(fields=['loan', 'status'], name='repayment_loan_status_idx'),
+            # Pending repayments of a loan in due date order, as rebalanced after each repayment.
+            models.Index(fields=['loan', 'due_date', 'id'], condition=models.Q(status=RepaymentStatus.PENDING),
+                         name='repayment_pending_idx'),
+            # Pending repayments not yet marked overdue, in the (due_date, id) order the overdue scan walks them in.
+            models.Index(fields=['due_date', 'id'], condition=models.Q(status=RepaymentStatus.PENDING, overdue=False),
+                         name='repayment_overdue_scan_idx'),
+        ]
+
+
+class ArchivedLoan(models.Model):
+    """
+    A paid loan moved out of the loan and repayment tables by the loan archival, under the ID it had, with its
+    repayments stored along with it as [id, amount, status, due_date] arrays, in due date order. See archive.py.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, null=True, on_delete=models.CASCADE, db_index=False)
+    amount = models.IntegerField()
+    terms = models.IntegerField()
+    created_date = models.DateField()
+    amount_paid = models.IntegerField()
+    repayments = models.JSONField()
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Archived loans of a user, in the (created_date, id) order the loan listing is paginated on.
+            models.Index(fields=['user', 'created_date', 'id'], name='archived_loan_user_created_idx'),
+        ]
+
+
+class LoanSummary(models.Model):
+    """
+    Totals of the loans of a user, kept up to date in the same transaction as every loan creation, approval and
+    repayment, so that they can be read from a single row. The outstanding balance covers pending and approved loans;
+    the next due date is the earliest one of the approved loans.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name='loan_summary', on_delete=models.CASCADE)
+    loans = models.IntegerField(default=0)
+    pending_loans = models.IntegerField(default=0)
+    active_loans = models.IntegerField(default=0)
+    paid_loans = models.IntegerField(default=0)
+    total_borrowed = models.BigIntegerField(default=0)
+    total_paid = models.BigIntegerField(default=0)
+    outstanding_balance = models.BigIntegerField(default=0)
+    next_due_date = models.DateField(null=True)
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a request made with an Idempotency-Key header, replayed to the retries of the request with the
+    same key until the key expires. The row is claimed in the same transaction as the request it is stored for.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    key = models.CharField(max_length=255)
+    # SHA-256 digest of the method, path and body of the request, so that a key reused for another request is caught.
+    request_hash = models.CharField(max_length=64)
+    status_code = models.SmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_user_key_uniq'),
+        ]
+        indexes = [
+            # Expired keys, in the order they are purged in.
+            models.Index(fields=['created_at'], name='idempotency_key_created_idx'),
+        ]
+
+
+class LoanImport(models.Model):
+    """Progress of a bulk loan import, updated in the same transaction as each imported batch so it can be resumed."""
+    name = models.CharField(max_length=255, unique=True)
+    last_line = models.IntegerField(default=0)
+    imported = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class LoanImportError(models.Model):
+    loan_import = models.ForeignKey(LoanImport, related_name='errors', on_delete=models.CASCADE, db_index=False)
+    line = models.IntegerField()
+    errors = models.JSONField()
+
+    class Meta:
+        indexes = [
+            # Errors of an import in line order, as reported back.
+            models.Index(fields=['loan_import', 'line'], name='loan_import_error_line_idx'),
+        ]
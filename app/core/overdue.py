@@ -0,0 +1,81 @@
+"""
+Marking of the pending repayments that are past their due date as overdue, in batches.
+"""
+from collections import namedtuple
+from datetime import date
+
+from django.db import connection, transaction
+
+from .metrics import REPAYMENTS_OVERDUE, count_on_commit
+from .models import Repayment, RepaymentStatus
+
+OverdueBatch = namedtuple('OverdueBatch', ('marked', 'last_due_date', 'last_id'))
+
+# The position every scan starts from, before the first (due_date, id) key.
+SCAN_START = (date.min, 0)
+
+# Marks the next batch of overdue repayments, walking repayment_overdue_scan_idx in (due_date, id) order from the key
+# the previous batch stopped at. Repayments locked by a repayment in progress are skipped rather than waited for; they
+# are marked by the next scan if they are still pending then. The repayments are marked whatever the status of their
+# loan, so that every entry of the index the scan walks past leaves it; the readers of the overdue repayments filter
+# on the status of their loans.
+MARK_OVERDUE_SQL = '''
+    WITH batch AS (
+        SELECT repayment.id, repayment.due_date
+        FROM {repayment_table} repayment
+        WHERE repayment.status = %(pending)s AND NOT repayment.overdue
+            AND (repayment.due_date, repayment.id) > (%(after_due_date)s, %(after_id)s)
+            AND repayment.due_date >= %(after_due_date)s
+            AND repayment.due_date < %(today)s
+        ORDER BY repayment.due_date, repayment.id
+        LIMIT %(batch_size)s
+        FOR UPDATE OF repayment SKIP LOCKED
+    )
+    UPDATE {repayment_table} repayment
+    SET overdue = TRUE
+    FROM batch
+    WHERE repayment.id = batch.id AND repayment.due_date = batch.due_date
+    RETURNING repayment.due_date, repayment.id
+'''
+
+
+def mark_overdue_batch(today, after=SCAN_START, batch_size=1000):
+    """
+    Marks up to batch_size overdue repayments with a (due_date, id) key past after, in a transaction of their own,
+    and returns the number marked and the last key marked, or None if there was none left.
+    """
+    sql = MARK_OVERDUE_SQL.format(repayment_table=Repayment._meta.db_table)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'after_due_date': after[0],
+                'after_id': after[1],
+                'today': today,
+                'batch_size': batch_size,
+                'pending': RepaymentStatus.PENDING.value,
+            })
+            rows = cursor.fetchall()
+        count_on_commit(REPAYMENTS_OVERDUE, len(rows))
+    if not rows:
+        return None
+    last_due_date, last_id = max(rows)
+    return OverdueBatch(len(rows), last_due_date, last_id)
+
+
+def mark_overdue_repayments(today=None, after=SCAN_START, batch_size=1000):
+    """
+    Marks the pending repayments due before today as overdue, one batch at a time, and yields each batch once it is
+    committed. Each batch holds its row locks only for its own short transaction, and never waits on the locks of
+    repayments being made, so the scan can run alongside live traffic.
+
+    The scan resumes from the key of the previous batch rather than from the start of the index, so it does not walk
+    back over the index entries of the rows it has already marked. Marked repayments drop out of the index, so a scan
+    that is interrupted can be restarted from the start, or from the last key it reported.
+    """
+    today = today or date.today()
+    while True:
+        batch = mark_overdue_batch(today, after, batch_size)
+        if batch is None:
+            return
+        yield batch
+        after = (batch.last_due_date, batch.last_id)
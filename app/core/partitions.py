@@ -0,0 +1,148 @@
+"""
+Maintenance of the monthly partitions of the repayment table.
+
+The repayment table is partitioned by due_date range (see migration 0011), one partition per month, named
+core_repayment_pYYYY_MM, with a default partition holding the repayments due in months that have no partition yet.
+Queries bounded by due date only read the partitions of the months they cover.
+"""
+import re
+from collections import namedtuple
+from datetime import date
+
+from django.db import connection, transaction
+
+from .models import Repayment
+
+Partition = namedtuple('Partition', ('name', 'start', 'end'))
+
+ARCHIVE_SCHEMA = 'repayment_archive'
+PARTITION_BOUND_RE = re.compile(r"^FOR VALUES FROM \('([\d-]+)'\) TO \('([\d-]+)'\)$")
+
+PARTITIONS_SQL = '''
+    SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = %(table)s::regclass
+'''
+
+# Creates the partition as a plain table, moves the repayments due in its month out of the default partition into
+# it, then attaches it, which creates the indexes and foreign key of the repayment table on it.
+CREATE_PARTITION_SQL = 'CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+MOVE_FROM_DEFAULT_SQL = '''
+    WITH moved AS (
+        DELETE FROM {default} WHERE due_date >= %(start)s AND due_date < %(end)s RETURNING *
+    )
+    INSERT INTO {partition} SELECT * FROM moved
+'''
+ATTACH_PARTITION_SQL = 'ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM (%(start)s) TO (%(end)s)'
+
+# Whether the partition holds any repayment. Every repayment belongs to a loan of the loan table, the repayments of
+# archived loans being deleted along with them (see archive.py), so a partition holding none has no loan left to serve.
+PARTITION_IN_USE_SQL = 'SELECT EXISTS (SELECT 1 FROM {partition})'
+
+FOREIGN_KEYS_SQL = "SELECT conname FROM pg_constraint WHERE conrelid = %(table)s::regclass AND contype = 'f'"
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _table():
+    return Repayment._meta.db_table
+
+
+def partition_name(month):
+    return '{}_p{:%Y_%m}'.format(_table(), month)
+
+
+def default_partition_name():
+    return '{}_default'.format(_table())
+
+
+def add_months(month, months):
+    """Returns the first day of the month the given number of months after the month of the given date."""
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def repayment_partitions():
+    """Returns the monthly partitions attached to the repayment table, by start date, leaving out the default one."""
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, {'table': _table()})
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = PARTITION_BOUND_RE.match(bound)
+        if match:
+            partitions.append(Partition(name, date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition.start)
+
+
+def create_partitions(first_month, last_month):
+    """
+    Creates the missing monthly partitions from the month of first_month to the month of last_month, moving the
+    repayments due in those months out of the default partition. Each partition is created in its own transaction.
+    Returns the created partitions along with the number of repayments moved into each.
+    """
+    existing = {partition.start for partition in repayment_partitions()}
+    created = []
+    month = add_months(first_month, 0)
+    while month <= last_month:
+        if month not in existing:
+            partition = Partition(partition_name(month), month, add_months(month, 1))
+            created.append((partition, create_partition(partition)))
+        month = add_months(month, 1)
+    return created
+
+
+def create_partition(partition):
+    """Creates and attaches the partition, and returns the number of repayments moved into it."""
+    names = {'table': _quote(_table()), 'partition': _quote(partition.name),
+             'default': _quote(default_partition_name())}
+    bounds = {'start': partition.start.isoformat(), 'end': partition.end.isoformat()}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(CREATE_PARTITION_SQL.format(**names))
+        cursor.execute(MOVE_FROM_DEFAULT_SQL.format(**names), bounds)
+        moved = cursor.rowcount
+        cursor.execute(ATTACH_PARTITION_SQL.format(**names), bounds)
+    return moved
+
+
+def archivable_partitions(before):
+    """
+    Returns the oldest partitions, ending on or before the given date, that can be archived: those left without
+    repayments once the loans they held repayments of have been archived by archive_paid_loans(), so that no loan of
+    the loan table loses its repayments. The partitions are checked from the oldest one up to the first one still
+    holding repayments, so that the archived partitions are always the oldest ones.
+    """
+    archivable = []
+    with connection.cursor() as cursor:
+        for partition in repayment_partitions():
+            if partition.end > before:
+                break
+            cursor.execute(PARTITION_IN_USE_SQL.format(partition=_quote(partition.name)))
+            if cursor.fetchone()[0]:
+                break
+            archivable.append(partition)
+    return archivable
+
+
+def archive_partitions(partitions, schema=ARCHIVE_SCHEMA):
+    """
+    Detaches the partitions from the repayment table, drops their foreign keys to the loans, and moves them to the
+    archive schema, from where they can be dropped; the repayments that were due in them are held by the archived
+    loans. Each partition is archived in its own transaction, or savepoint when called inside a transaction.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(_quote(schema)))
+    for partition in partitions:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # The repayment table cannot be altered while the checks of its deferred foreign keys are pending, e.g. for
+            # repayments written earlier in the enclosing transaction, so they are run first.
+            connection.check_constraints()
+            cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(_quote(_table()), _quote(partition.name)))
+            cursor.execute(FOREIGN_KEYS_SQL, {'table': partition.name})
+            for (foreign_key,) in cursor.fetchall():
+                cursor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(
+                    _quote(partition.name), _quote(foreign_key)))
+            cursor.execute('ALTER TABLE {} SET SCHEMA {}'.format(_quote(partition.name), _quote(schema)))
@@ -0,0 +1,168 @@
+"""
+Routing of the database reads to the read replicas of the default database.
+
+Reads go to the primary unless the request being handled has opted into replica reads: ReplicaRoutingMiddleware opts
+in the safe (GET, HEAD and OPTIONS) requests of the users that have not made a write in the last
+READ_YOUR_WRITES['WINDOW'] seconds, so that users read their own writes even while the replicas lag behind. Writes, the
+reads made in a transaction on the primary, and anything run outside a request, such as the management commands,
+always use the primary.
+"""
+import contextvars
+import functools
+import hashlib
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .middleware import HybridMiddleware
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Alias of the replica the reads of the request being handled go to, or None if they go to the primary.
+read_database = contextvars.ContextVar('read_database', default=None)
+
+
+class ReplicaRouter:
+    """Database router sending the reads to the replica chosen for the request, if any, and the rest to the primary."""
+    def db_for_read(self, model, **hints):
+        alias = read_database.get()
+        # Reads made in a transaction on the primary, e.g. under the row locks of a repayment, must see its writes.
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas get the schema changes of the primary through replication.
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    """Sends the reads made in the block to one of DATABASE_REPLICAS, picked at random, if there are any."""
+    replicas = settings.DATABASE_REPLICAS
+    token = read_database.set(random.choice(replicas) if replicas else None)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Sends the reads made in the block to the primary."""
+    token = read_database.set(None)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def reading_from_replica():
+    return read_database.get() is not None
+
+
+def with_request_reads(iterator):
+    """
+    Returns a generator over the given iterator that reads from the database the current request reads from, even when
+    it is iterated after the request has been handled, as the content of a streaming response is.
+    """
+    alias = read_database.get()
+
+    def iterate():
+        try:
+            while True:
+                token = read_database.set(alias)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    read_database.reset(token)
+                yield item
+        finally:
+            # Closes a generator left half-way, e.g. when the client disconnects, along with the cursors it holds open.
+            if hasattr(iterator, 'close'):
+                iterator.close()
+    return iterate()
+
+
+def use_primary(handler):
+    """Runs a view, or view handler, with all its reads on the primary, like its writes."""
+    @functools.wraps(handler)
+    def handle(*args, **kwargs):
+        with primary_reads():
+            return handler(*args, **kwargs)
+    return handle
+
+
+def recent_write_key(user_name):
+    return 'db:recent-write:{}'.format(hashlib.sha1(user_name.encode()).hexdigest())
+
+
+def mark_recent_write(user_name):
+    """
+    Records that the user made a write, in the READ_YOUR_WRITES['CACHE_ALIAS'] cache. Only the worker processes sharing
+    that cache see it, so it must not be process-local when several workers serve the requests.
+    """
+    config = settings.READ_YOUR_WRITES
+    caches[config['CACHE_ALIAS']].set(recent_write_key(user_name), True, config['WINDOW'])
+
+
+def made_recent_write(user_name):
+    """Returns whether the user made a write in the last READ_YOUR_WRITES['WINDOW'] seconds."""
+    return caches[settings.READ_YOUR_WRITES['CACHE_ALIAS']].get(recent_write_key(user_name)) is not None
+
+
+class ReplicaRoutingMiddleware(HybridMiddleware):
+    """
+    Sends the reads of the safe requests to a replica, unless the user making the request, given by the Username header
+    the requests are authenticated with, made a write in the last READ_YOUR_WRITES['WINDOW'] seconds. Any other
+    request by a user marks them as having made a write. Does nothing unless DATABASE_REPLICAS are configured.
+    """
+    def handle(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            try:
+                return self.get_response(request)
+            finally:
+                self.mark_write(request)
+        if self.made_recent_write(request):
+            return self.get_response(request)
+        with replica_reads():
+            return self.get_response(request)
+
+    async def ahandle(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            try:
+                return await self.get_response(request)
+            finally:
+                self.mark_write(request)
+        if self.made_recent_write(request):
+            return await self.get_response(request)
+        with replica_reads():
+            return await self.get_response(request)
+
+    @staticmethod
+    def mark_write(request):
+        """Marks the user making an unsafe request as having made a write, once it is handled, even if it failed."""
+        user_name = request.META.get('HTTP_USERNAME')
+        if user_name:
+            mark_recent_write(user_name)
+
+    @staticmethod
+    def made_recent_write(request):
+        user_name = request.META.get('HTTP_USERNAME')
+        return bool(user_name) and made_recent_write(user_name)
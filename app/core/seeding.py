@@ -0,0 +1,86 @@
+"""
+Generation of synthetic users, loans and repayments, and in-process API clients, for benchmarks and query plan checks.
+"""
+import random
+from datetime import date, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework.test import APIClient
+
+from .models import Loan, LoanStatus, LoanSummary, Repayment, RepaymentStatus, User
+from .summaries import rebuild_summaries
+
+REPAYMENT_INTERVAL = timedelta(weeks=1)
+LOAN_BATCH_SIZE = 1000
+
+
+def _generate_loans(rng, users, loans_per_user, terms, installment, max_age_days, today):
+    """Yields a (loan, due dates, number of paid terms) tuple for each loan to seed."""
+    for user in users:
+        for _ in range(loans_per_user):
+            created_date = today - timedelta(days=rng.randrange(max_age_days))
+            status = rng.choice((LoanStatus.PENDING, LoanStatus.APPROVED, LoanStatus.APPROVED, LoanStatus.PAID))
+            due_dates = [created_date + REPAYMENT_INTERVAL * term for term in range(1, terms + 1)]
+            if status == LoanStatus.APPROVED and due_dates[-1] < today:
+                status = LoanStatus.PAID
+
+            if status == LoanStatus.PAID:
+                paid_terms = terms
+            elif status == LoanStatus.APPROVED:
+                paid_terms = sum(due_date < today for due_date in due_dates)
+            else:
+                paid_terms = 0
+
+            loan = Loan(
+                user=user, amount=installment * terms, terms=terms, created_date=created_date, status=status,
+                amount_paid=installment * paid_terms, outstanding_balance=installment * (terms - paid_terms),
+                pending_repayments=terms - paid_terms,
+                next_due_date=due_dates[paid_terms] if paid_terms < terms else None)
+            yield loan, due_dates, paid_terms
+
+
+def seed_dataset(users=100, loans_per_user=10, terms=12, amount=1200, max_age_days=365, prefix='seed_user_',
+                 seed=None, stdout=None):
+    """
+    Creates users, each with loans in a mix of states, and their repayment schedules, using batched inserts. Loans
+    are backdated over the last max_age_days days; approved loans have the repayments that are past due paid, and
+    paid loans have all of them paid. The loans are generated one batch at a time, so large datasets can be seeded
+    in bounded memory. Returns the created users.
+    """
+    rng = random.Random(seed)
+    installment = amount // terms
+    total = users * loans_per_user
+
+    with transaction.atomic():
+        created_users = User.objects.bulk_create(
+            [User(user_name='{}{}'.format(prefix, i)) for i in range(users)], batch_size=LOAN_BATCH_SIZE)
+
+        loans = _generate_loans(rng, created_users, loans_per_user, terms, installment, max_age_days, date.today())
+        seeded = 0
+        while True:
+            batch = list(islice(loans, LOAN_BATCH_SIZE))
+            if not batch:
+                break
+            Loan.objects.bulk_create([loan for loan, _, _ in batch])
+            Repayment.objects.bulk_create([
+                Repayment(loan=loan, amount=installment, due_date=due_date,
+                          status=RepaymentStatus.PAID if term < paid_terms else RepaymentStatus.PENDING)
+                for loan, due_dates, paid_terms in batch for term, due_date in enumerate(due_dates)
+            ], batch_size=LOAN_BATCH_SIZE * 5)
+            seeded += len(batch)
+            if stdout:
+                stdout.write('Seeded {} of {} loans'.format(seeded, total))
+        rebuild_summaries([user.id for user in created_users])
+
+    with connection.cursor() as cursor:
+        for model in (User, Loan, Repayment, LoanSummary):
+            cursor.execute('ANALYZE {}'.format(model._meta.db_table))
+    return created_users
+
+
+def in_process_client():
+    """Returns an API client that calls the views in-process, using a host name that ALLOWED_HOSTS accepts."""
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    return APIClient(SERVER_NAME=hosts[0] if hosts else 'localhost')
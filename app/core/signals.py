@@ -0,0 +1,36 @@
+"""
+Signal handlers for the database models and database connections.
+"""
+from django.core.signals import request_started
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth_cache import user_cache
+from .models import User, users_updated
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drops the cached authentication lookup of a user that has been created, updated (e.g. is_admin) or deleted."""
+    user_cache.invalidate(instance.user_name)
+
+
+@receiver(users_updated, sender=User)
+def invalidate_cached_users(sender, user_names, **kwargs):
+    """Drops the cached authentication lookups of the users updated in bulk, e.g. by User.objects.update()."""
+    for user_name in user_names:
+        user_cache.invalidate(user_name)
+
+
+@receiver(request_started)
+def check_persistent_connections(sender, **kwargs):
+    """
+    Closes the persistent database connections that no longer work, e.g. after a database restart, when their database
+    has CONN_HEALTH_CHECKS set, so that the request opens a new connection instead of failing.
+    """
+    for connection in connections.all():
+        if connection.settings_dict.get('CONN_HEALTH_CHECKS') and connection.connection is not None and \
+                not connection.is_usable():
+            connection.close()
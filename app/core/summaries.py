@@ -0,0 +1,142 @@
+"""
+Maintenance of the per-user loan summaries, updated in the same transaction as every change to the loans they cover.
+
+GET /loan/summary reads the totals of a user from their summary rather than aggregating their loans and repayments.
+"""
+from collections import defaultdict
+from datetime import date
+
+from django.db import connection
+
+from .models import ArchivedLoan, Loan, LoanStatus, LoanSummary, Repayment, RepaymentStatus
+
+# Adds newly created, pending loans to the summaries of their users, creating the summaries that do not exist yet.
+ADD_LOANS_SQL = '''
+    INSERT INTO {summary_table} AS summary
+        (user_id, loans, pending_loans, active_loans, paid_loans, total_borrowed, total_paid, outstanding_balance,
+         next_due_date)
+    SELECT new.user_id, new.loans, new.loans, 0, 0, new.amount, 0, new.amount, NULL
+    FROM unnest(%(user_ids)s::bigint[], %(loans)s::integer[], %(amounts)s::bigint[]) AS new (user_id, loans, amount)
+    ON CONFLICT (user_id) DO UPDATE SET
+        loans = summary.loans + EXCLUDED.loans,
+        pending_loans = summary.pending_loans + EXCLUDED.pending_loans,
+        total_borrowed = summary.total_borrowed + EXCLUDED.total_borrowed,
+        outstanding_balance = summary.outstanding_balance + EXCLUDED.outstanding_balance
+'''
+
+# Records a repayment made against an approved loan of the user. The loan has been updated already, so the next due
+# date is re-read from the counters of the user's approved loans.
+ADD_REPAYMENT_SQL = '''
+    UPDATE {summary_table} summary SET
+        total_paid = summary.total_paid + %(amount)s,
+        outstanding_balance = summary.outstanding_balance - %(balance_change)s,
+        active_loans = summary.active_loans - %(paid_off)s,
+        paid_loans = summary.paid_loans + %(paid_off)s,
+        next_due_date = (
+            SELECT MIN(loan.next_due_date) FROM {loan_table} loan
+            WHERE loan.user_id = %(user_id)s AND loan.status = %(approved)s
+        )
+    WHERE summary.user_id = %(user_id)s
+'''
+
+# Recomputes the summaries of the given users from the counters of their loans, and their archived loans, all paid.
+REBUILD_SQL = '''
+    INSERT INTO {summary_table} AS summary
+        (user_id, loans, pending_loans, active_loans, paid_loans, total_borrowed, total_paid, outstanding_balance,
+         next_due_date)
+    SELECT
+        user_id,
+        COUNT(*),
+        COUNT(*) FILTER (WHERE status = %(pending)s),
+        COUNT(*) FILTER (WHERE status = %(approved)s),
+        COUNT(*) FILTER (WHERE status = %(paid)s),
+        SUM(amount),
+        SUM(amount_paid),
+        SUM(outstanding_balance),
+        MIN(next_due_date) FILTER (WHERE status = %(approved)s)
+    FROM (
+        SELECT user_id, status, amount, amount_paid, outstanding_balance, next_due_date
+        FROM {loan_table}
+        WHERE user_id = ANY(%(user_ids)s)
+        UNION ALL
+        SELECT user_id, %(paid)s, amount, amount_paid, 0, NULL
+        FROM {archive_table}
+        WHERE user_id = ANY(%(user_ids)s)
+    ) loans
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        loans = EXCLUDED.loans,
+        pending_loans = EXCLUDED.pending_loans,
+        active_loans = EXCLUDED.active_loans,
+        paid_loans = EXCLUDED.paid_loans,
+        total_borrowed = EXCLUDED.total_borrowed,
+        total_paid = EXCLUDED.total_paid,
+        outstanding_balance = EXCLUDED.outstanding_balance,
+        next_due_date = EXCLUDED.next_due_date
+'''
+
+
+def _execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(summary_table=LoanSummary._meta.db_table, loan_table=Loan._meta.db_table,
+                                  archive_table=ArchivedLoan._meta.db_table), params)
+
+
+def add_loans(loans):
+    """Adds the newly created loans to the summaries of their users, with a single statement."""
+    by_user = defaultdict(lambda: [0, 0])
+    for loan in loans:
+        if loan.user_id is not None:
+            by_user[loan.user_id][0] += 1
+            by_user[loan.user_id][1] += loan.amount
+    if not by_user:
+        return
+    user_ids = list(by_user)
+    _execute(ADD_LOANS_SQL, {
+        'user_ids': user_ids,
+        'loans': [by_user[user_id][0] for user_id in user_ids],
+        'amounts': [by_user[user_id][1] for user_id in user_ids],
+    })
+
+
+def add_repayment(loan, amount, balance_change):
+    """
+    Records, in the summary of the loan's user, a repayment of the given amount that lowered the outstanding balance
+    of the loan by balance_change. Must be called once the loan itself has been updated.
+    """
+    if loan.user_id is None:
+        return
+    _execute(ADD_REPAYMENT_SQL, {
+        'user_id': loan.user_id,
+        'amount': amount,
+        'balance_change': balance_change,
+        'paid_off': int(loan.status == LoanStatus.PAID),
+        'approved': LoanStatus.APPROVED.value,
+    })
+
+
+def rebuild_summaries(user_ids):
+    """Recomputes the summaries of the given users from their loans, e.g. after their loan counters were fixed."""
+    user_ids = [user_id for user_id in set(user_ids) if user_id is not None]
+    if not user_ids:
+        return
+    _execute(REBUILD_SQL, {
+        'user_ids': user_ids,
+        'pending': LoanStatus.PENDING.value,
+        'approved': LoanStatus.APPROVED.value,
+        'paid': LoanStatus.PAID.value,
+    })
+
+
+def count_overdue_repayments(summary, today=None):
+    """
+    Returns the number of pending repayments of the user's approved loans that are past their due date. The summary
+    holds the earliest due date of those, so the repayments are only counted when that date has passed, and only in
+    the partitions of the repayment table from its month on.
+    """
+    today = today or date.today()
+    if summary.next_due_date is None or summary.next_due_date >= today:
+        return 0
+    return Repayment.objects.filter(loan__user_id=summary.user_id, loan__status=LoanStatus.APPROVED,
+                                    status=RepaymentStatus.PENDING, due_date__gte=summary.next_due_date,
+                                    due_date__lt=today).count()
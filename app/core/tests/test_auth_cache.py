@@ -0,0 +1,94 @@
+"""
+Test the user lookup cache used for authentication.
+"""
+from django.core.cache import caches
+from django.test import TestCase
+
+from core.auth_cache import UserLookupCache, user_cache
+from core.models import User
+
+
+class UserLookupCacheTests(TestCase):
+    """Test the two-tier user lookup cache."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user_cache = UserLookupCache(max_size=2, ttl=60, shared_ttl=60)
+        self.user = User.objects.create(user_name='sample_user', is_admin=True)
+
+    def test_lookup_is_cached(self):
+        """Test that repeated lookups are served without querying the database."""
+        regular_user = User.objects.create(user_name='regular_user')
+        user = self.user_cache.get('regular_user')
+        self.assertEqual(user.id, regular_user.id)
+        self.assertFalse(user.is_admin)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user_cache.get('regular_user').id, regular_user.id)
+
+        self.assertEqual(self.user_cache.stats()['misses'], 1)
+        self.assertEqual(self.user_cache.stats()['local_hits'], 1)
+
+    def test_admin_lookup_is_not_cached_locally(self):
+        """Test that the lookups of admin users are served from the shared cache, never the in-process one."""
+        self.assertTrue(self.user_cache.get('sample_user').is_admin)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.user_cache.get('sample_user').is_admin)
+        self.assertEqual(self.user_cache.stats()['local_hits'], 0)
+        self.assertEqual(self.user_cache.stats()['shared_hits'], 1)
+
+    def test_lookup_from_shared_cache(self):
+        """Test that a lookup cached by another process is served from the shared cache."""
+        UserLookupCache(ttl=60, shared_ttl=60).get('sample_user')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user_cache.get('sample_user').id, self.user.id)
+        self.assertEqual(self.user_cache.stats()['shared_hits'], 1)
+
+    def test_unknown_user_is_not_cached(self):
+        """Test that unknown users are not cached, so that a user created by another worker process is found."""
+        self.assertIsNone(self.user_cache.get('new_user'))
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.user_cache.get('new_user'))
+        self.assertEqual(self.user_cache.stats()['size'], 0)
+
+        # Created without a signal, as by another worker process, whose invalidations this cache does not see.
+        User.objects.bulk_create([User(user_name='new_user')])
+        self.assertIsNotNone(self.user_cache.get('new_user'))
+
+    def test_is_admin_change_invalidates_cache(self):
+        """Test that saving a user invalidates its cached lookup."""
+        user_cache.clear()
+        self.assertTrue(user_cache.get('sample_user').is_admin)
+        self.user.is_admin = False
+        self.user.save()
+        self.assertFalse(user_cache.get('sample_user').is_admin)
+
+    def test_is_admin_revoked_on_other_worker(self):
+        """Test that an is_admin revoked by a bulk update is not served by the cache of another worker process."""
+        self.assertTrue(self.user_cache.get('sample_user').is_admin)
+        User.objects.filter(user_name='sample_user').update(is_admin=False)
+        self.assertFalse(self.user_cache.get('sample_user').is_admin)
+
+    def test_renamed_user_invalidates_cache(self):
+        """Test that a user renamed by a bulk update is no longer found under the old user_name."""
+        user_cache.clear()
+        self.assertEqual(user_cache.get('sample_user').id, self.user.id)
+        User.objects.filter(user_name='sample_user').update(user_name='renamed_user')
+        self.assertEqual(user_cache.get('renamed_user').id, self.user.id)
+        self.assertIsNone(user_cache.get('sample_user'))
+
+    def test_local_entries_are_bounded(self):
+        """Test that the least recently used entries are evicted from the in-process cache."""
+        for user_name in ('user_1', 'user_2', 'user_3'):
+            User.objects.create(user_name=user_name)
+            self.user_cache.get(user_name)
+        self.assertEqual(self.user_cache.stats()['size'], 2)
+
+    def test_local_entries_expire(self):
+        """Test that in-process entries are not served after their TTL."""
+        user_cache = UserLookupCache(ttl=0, shared_ttl=60)
+        user_cache.get('sample_user')
+        user_cache.get('sample_user')
+        self.assertEqual(user_cache.stats()['local_hits'], 0)
+        self.assertEqual(user_cache.stats()['shared_hits'], 1)
@@ -0,0 +1,52 @@
+"""
+Test the summaries and baseline comparisons of the API benchmark.
+"""
+from django.test import SimpleTestCase
+
+from core.benchmark import compare, parse_mix, percentile, summarize, throughput_change
+
+
+class BenchmarkTests(SimpleTestCase):
+    """Test the benchmark statistics."""
+
+    def test_percentile(self):
+        """Test the nearest-rank percentiles."""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        """Test summarizing (latency, status code, query count) samples."""
+        summary = summarize([(0.001, 200, 2), (0.003, 200, 4), (0.002, 400, 3)], duration=0.5)
+        self.assertEqual(summary['requests'], 3)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['rps'], 6.0)
+        self.assertEqual(summary['queries_per_request'], 3.0)
+        self.assertEqual((summary['p50_ms'], summary['p99_ms']), (2.0, 3.0))
+
+    def test_compare(self):
+        """Test that only regressions beyond the tolerance are reported."""
+        baseline = {'total': {'p95_ms': 10.0, 'rps': 100.0, 'queries_per_request': 3.0},
+                    'endpoints': {'GET /loan': {'p95_ms': 10.0, 'rps': 50.0, 'queries_per_request': 2.0}}}
+        current = {'total': {'p95_ms': 11.0, 'rps': 90.0, 'queries_per_request': 3.0},
+                   'endpoints': {'GET /loan': {'p95_ms': 13.0, 'rps': 30.0, 'queries_per_request': 3.0}}}
+
+        regressions = compare(baseline, current, tolerance=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('GET /loan: p95 latency'))
+        self.assertTrue(regressions[1].startswith('GET /loan: 3.0 queries per request'))
+
+    def test_throughput_change(self):
+        """Test the throughput ratio against a baseline."""
+        baseline = {'total': {'rps': 80.0}, 'endpoints': {}}
+        self.assertEqual(throughput_change(baseline, {'total': {'rps': 200.0}, 'endpoints': {}}), 2.5)
+        self.assertIsNone(throughput_change(baseline, {'total': {'rps': None}, 'endpoints': {}}))
+
+    def test_parse_mix(self):
+        """Test parsing request mixes."""
+        self.assertEqual(parse_mix('list_loans=80, repay=20'), {'list_loans': 80, 'repay': 20})
+        with self.assertRaises(ValueError):
+            parse_mix('unknown=1')
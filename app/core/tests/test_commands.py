@@ -1,13 +1,28 @@
 """
 Test custom Django management commands.
 """
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
 from unittest.mock import patch
 
 from psycopg2 import OperationalError as Psycopg2OpError
 
+from django.conf import settings
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from core.models import (
+    ArchivedLoan, IdempotencyKey, Loan, LoanImport, LoanStatus, LoanSummary, Repayment, RepaymentStatus, User
+)
+from core.seeding import seed_dataset
+from core.summaries import rebuild_summaries
 
 
 @patch('core.management.commands.wait_for_db.Command.check')
@@ -32,3 +47,356 @@ class CommandTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class ExplainQueriesCommandTests(TestCase):
+    """Test the explain_queries command."""
+
+    def test_explain_queries(self):
+        """Test explaining the endpoint queries against a seeded dataset, which is rolled back afterwards."""
+        out = StringIO()
+        call_command('explain_queries', users=5, loans_per_user=4, terms=3, stdout=out)
+
+        output = out.getvalue()
+        for endpoint in ('GET /loan', 'POST /loan', 'PUT /approval/<loan_id>'):
+            self.assertIn(endpoint, output)
+        self.assertIn('Scan on core_loan', output)
+        self.assertEqual(User.objects.count(), 0)
+        self.assertEqual(Loan.objects.count(), 0)
+
+
+class BenchmarkSerializersCommandTests(TestCase):
+    """Test the benchmark_serializers command."""
+
+    def test_benchmark_serializers(self):
+        """Test benchmarking both serializers against a seeded dataset, which is rolled back afterwards."""
+        out = StringIO()
+        call_command('benchmark_serializers', users=2, loans_per_user=3, terms=3, rounds=2, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn('6 loans per round, 2 rounds; identical output.', output)
+        self.assertIn('us per loan', output)
+        self.assertEqual(Loan.objects.count(), 0)
+
+
+class BenchmarkLoanSearchCommandTests(TestCase):
+    """Test the benchmark_loan_search command."""
+
+    def test_benchmark_loan_search(self):
+        """Test benchmarking each search against a seeded dataset, which is rolled back afterwards."""
+        out = StringIO()
+        try:
+            call_command('benchmark_loan_search', users=3, loans_per_user=4, terms=3, pages=2, page_size=2, stdout=out)
+        except CommandError as ex:
+            # A table this small may well be planned as a sequential scan.
+            self.assertIn('Searches over budget', str(ex))
+
+        output = out.getvalue()
+        for name in ('all', 'status, created range', 'amount range', 'user, created range', 'overdue'):
+            self.assertIn(name, output)
+        for name in ('amount range by date', 'created range by amount', 'user, status'):
+            self.assertIn('{:<24} rejected with 400'.format(name), output)
+        self.assertIn('p95', output)
+        self.assertEqual(Loan.objects.count(), 0)
+
+
+class SyncLoanCountersCommandTests(TestCase):
+    """Test the sync_loan_counters command."""
+
+    def setUp(self):
+        seed_dataset(users=3, loans_per_user=4, terms=4, seed=0)
+
+    def test_counters_up_to_date(self):
+        """Test that the counters of consistent loans are reported as up to date."""
+        out = StringIO()
+        call_command('sync_loan_counters', batch_size=5, stdout=out)
+        self.assertIn('All loan counters are up to date.', out.getvalue())
+
+    def test_counters_drifted(self):
+        """Test that drifted counters are reported, and fixed with --fix."""
+        loan = Loan.objects.order_by('id').last()
+        expected = (loan.amount_paid, loan.outstanding_balance, loan.pending_repayments, loan.next_due_date)
+        Loan.objects.filter(id=loan.id).update(amount_paid=0, outstanding_balance=0, pending_repayments=0,
+                                               next_due_date=None)
+
+        with self.assertRaises(CommandError):
+            call_command('sync_loan_counters', stdout=StringIO())
+
+        out = StringIO()
+        call_command('sync_loan_counters', fix=True, batch_size=5, stdout=out)
+        self.assertIn('Fixed the counters of 1 loans.', out.getvalue())
+        loan.refresh_from_db()
+        self.assertEqual((loan.amount_paid, loan.outstanding_balance, loan.pending_repayments, loan.next_due_date),
+                         expected)
+
+
+class MarkOverdueRepaymentsCommandTests(TestCase):
+    """Test the mark_overdue_repayments command."""
+
+    def setUp(self):
+        user = User.objects.create(user_name='overdue_user')
+        self.loan = Loan.objects.create(user=user, amount=300, terms=3, status=LoanStatus.APPROVED)
+        self.repayments = [
+            Repayment.objects.create(loan=self.loan, amount=100, due_date=date(2023, 7, day)) for day in (3, 10, 17)
+        ]
+
+    def test_mark_overdue_repayments(self):
+        """Test that the repayments due before the given date are marked, in batches, and the rest left as is."""
+        out = StringIO()
+        call_command('mark_overdue_repayments', today='2023-07-17', batch_size=1, verbosity=2, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn('Marked 2 repayments, up to due date 2023-07-10 and ID {}'.format(self.repayments[1].id),
+                      output)
+        self.assertIn('Marked 2 repayments overdue.', output)
+        self.assertEqual(list(Repayment.objects.filter(overdue=True).order_by('id')), self.repayments[:2])
+
+    def test_mark_overdue_repayments_of_pending_loan(self):
+        """Test that the past due repayments of a pending loan are marked too, so that later scans skip them."""
+        pending_loan = Loan.objects.create(user=self.loan.user, amount=100, terms=1, status=LoanStatus.PENDING)
+        repayment = Repayment.objects.create(loan=pending_loan, amount=100, due_date=date(2023, 7, 3))
+
+        call_command('mark_overdue_repayments', today='2023-07-17', stdout=StringIO())
+        self.assertEqual(set(Repayment.objects.filter(overdue=True)), {repayment, *self.repayments[:2]})
+
+        out = StringIO()
+        call_command('mark_overdue_repayments', today='2023-07-17', stdout=out)
+        self.assertIn('Marked 0 repayments overdue.', out.getvalue())
+
+    def test_resume(self):
+        """Test that a scan resumed after a due date and ID only marks the repayments past them."""
+        out = StringIO()
+        call_command('mark_overdue_repayments', today='2023-08-01', after_due_date='2023-07-03',
+                     after_id=self.repayments[0].id, stdout=out)
+
+        self.assertIn('Marked 2 repayments overdue.', out.getvalue())
+        self.assertEqual(list(Repayment.objects.filter(overdue=True).order_by('id')), self.repayments[1:])
+
+
+class BenchmarkOverdueScanCommandTests(TestCase):
+    """Test the benchmark_overdue_scan command."""
+
+    def test_benchmark_overdue_scan(self):
+        """Test benchmarking the scan against a seeded dataset, which is rolled back afterwards."""
+        out = StringIO()
+        call_command('benchmark_overdue_scan', users=3, loans_per_user=4, terms=3, batch_size=2, window=1,
+                     stdout=out)
+
+        output = out.getvalue()
+        self.assertIn('repayments/s', output)
+        self.assertIn('Peak memory allocated during the scan', output)
+        self.assertEqual(Repayment.objects.count(), 0)
+
+
+class ManageRepaymentPartitionsCommandTests(TestCase):
+    """Test the manage_repayment_partitions command."""
+
+    def setUp(self):
+        user = User.objects.create(user_name='partition_user')
+        self.paid_loan = Loan.objects.create(user=user, amount=200, terms=2, status=LoanStatus.PAID, amount_paid=200)
+        for day in (3, 10):
+            Repayment.objects.create(loan=self.paid_loan, amount=100, due_date=date(2023, 7, day),
+                                     status=RepaymentStatus.PAID)
+        self.approved_loan = Loan.objects.create(user=user, amount=100, terms=1, status=LoanStatus.APPROVED,
+                                                 outstanding_balance=100, pending_repayments=1,
+                                                 next_due_date=date(2023, 8, 7))
+        Repayment.objects.create(loan=self.approved_loan, amount=100, due_date=date(2023, 8, 7))
+
+    def partition_of(self, repayment):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM core_repayment WHERE id = %s', [repayment.id])
+            return cursor.fetchone()[0]
+
+    def test_create_partitions(self):
+        """Test that the missing partitions are created, with the repayments due in them moved out of the default."""
+        out = StringIO()
+        call_command('manage_repayment_partitions', today=date(2023, 7, 15), months_ahead=1, stdout=out)
+
+        self.assertIn('Created partition core_repayment_p2023_07 for 2023-07-01 to 2023-08-01, moving 2 repayments '
+                      'from the default partition.', out.getvalue())
+        self.assertEqual(self.partition_of(Repayment.objects.get(loan=self.approved_loan)), 'core_repayment_p2023_08')
+
+        out = StringIO()
+        call_command('manage_repayment_partitions', today=date(2023, 7, 15), months_ahead=1, stdout=out)
+        self.assertNotIn('Created partition', out.getvalue())
+        self.assertIn('Repayment partitions are up to date.', out.getvalue())
+
+    def test_archive_emptied_partitions(self):
+        """Test that only the old partitions left empty by the archival of their paid loans are archived."""
+        call_command('manage_repayment_partitions', today=date(2023, 7, 15), months_ahead=1, stdout=StringIO())
+
+        # The paid loan is still listed with its repayments, so its partition is kept.
+        out = StringIO()
+        call_command('manage_repayment_partitions', today=date(2023, 7, 15), months_ahead=1,
+                     archive_before=date(2023, 9, 1), dry_run=True, stdout=out)
+        self.assertNotIn('Would archive', out.getvalue())
+
+        call_command('archive_paid_loans', today=date.today() + timedelta(days=1), older_than_days=0, stdout=StringIO())
+        out = StringIO()
+        call_command('manage_repayment_partitions', today=date(2023, 7, 15), months_ahead=1,
+                     archive_before=date(2023, 9, 1), dry_run=True, stdout=out)
+        self.assertIn('Would archive partition core_repayment_p2023_07', out.getvalue())
+        self.assertNotIn('core_repayment_p2023_08', out.getvalue())
+
+        out = StringIO()
+        call_command('manage_repayment_partitions', today=date(2023, 7, 15), months_ahead=1,
+                     archive_before=date(2023, 9, 1), stdout=out)
+        self.assertIn('Archived 1 partitions to the repayment_archive schema.', out.getvalue())
+        self.assertEqual(len(ArchivedLoan.objects.get(id=self.paid_loan.id).repayments), 2)
+        self.assertTrue(Repayment.objects.filter(loan=self.approved_loan).exists())
+
+
+class ArchivePaidLoansCommandTests(TestCase):
+    """Test the archive_paid_loans command."""
+
+    def setUp(self):
+        self.user = User.objects.create(user_name='archive_user')
+        self.old_paid = Loan.objects.create(user=self.user, amount=200, terms=2, status=LoanStatus.PAID,
+                                            amount_paid=200, created_date=date(2023, 1, 2))
+        self.repayments = [
+            Repayment.objects.create(loan=self.old_paid, amount=100, status=RepaymentStatus.PAID,
+                                     due_date=date(2023, 1, 2) + timedelta(weeks=week)) for week in (1, 2)
+        ]
+        self.recent_paid = Loan.objects.create(user=self.user, amount=100, terms=1, status=LoanStatus.PAID,
+                                               amount_paid=100, created_date=date(2023, 6, 1))
+        self.old_approved = Loan.objects.create(user=self.user, amount=100, terms=1, status=LoanStatus.APPROVED,
+                                                outstanding_balance=100, created_date=date(2023, 1, 2))
+
+    def test_archive_paid_loans(self):
+        """Test that only the paid loans older than the given age are archived, along with their repayments."""
+        out = StringIO()
+        call_command('archive_paid_loans', today=date(2023, 7, 1), older_than_days=90, batch_size=1, stdout=out)
+
+        self.assertIn('Archived 1 paid loans created before 2023-04-02.', out.getvalue())
+        self.assertEqual(list(Loan.objects.order_by('id')), [self.recent_paid, self.old_approved])
+        self.assertFalse(Repayment.objects.filter(loan_id=self.old_paid.id).exists())
+        archived = ArchivedLoan.objects.get()
+        self.assertEqual((archived.id, archived.user_id, archived.amount, archived.terms, archived.amount_paid,
+                          archived.created_date), (self.old_paid.id, self.user.id, 200, 2, 200, date(2023, 1, 2)))
+        self.assertEqual(archived.repayments, [
+            [self.repayments[0].id, 100, RepaymentStatus.PAID.value, '2023-01-09'],
+            [self.repayments[1].id, 100, RepaymentStatus.PAID.value, '2023-01-16'],
+        ])
+
+        rebuild_summaries([self.user.id])
+        summary = LoanSummary.objects.get(user=self.user)
+        self.assertEqual((summary.loans, summary.paid_loans, summary.total_paid), (3, 2, 300))
+
+
+class PurgeIdempotencyKeysCommandTests(TestCase):
+    """Test the purge_idempotency_keys command."""
+
+    def test_purge_idempotency_keys(self):
+        """Test that only the keys older than IDEMPOTENCY_KEY_TTL are deleted."""
+        user = User.objects.create(user_name='idempotency_user')
+        now = timezone.now()
+        for i, age in enumerate((settings.IDEMPOTENCY_KEY_TTL + 60, settings.IDEMPOTENCY_KEY_TTL + 1, 60)):
+            IdempotencyKey.objects.create(user=user, key='key-{}'.format(i), request_hash='0' * 64, status_code=200,
+                                          response={'id': i}, created_at=now - timedelta(seconds=age))
+
+        out = StringIO()
+        call_command('purge_idempotency_keys', batch_size=1, stdout=out)
+
+        self.assertIn('Deleted 2 expired idempotency keys.', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['key-2'])
+
+
+class PortfolioAnalyticsCommandTests(TestCase):
+    """Test the portfolio_analytics command."""
+
+    def setUp(self):
+        seed_dataset(users=3, loans_per_user=4, terms=4, seed=0)
+
+    def test_portfolio_analytics(self):
+        """Test that the analytics are printed, and saved as JSON with --output."""
+        out = StringIO()
+        call_command('portfolio_analytics', stdout=out)
+        self.assertIn('Outstanding principal by status', out.getvalue())
+        self.assertIn('Expected cash flow by due week', out.getvalue())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'analytics.json')
+            call_command('portfolio_analytics', output=path, stdout=StringIO())
+            with open(path) as file:
+                analytics = json.load(file)
+        self.assertEqual(sum(row['loans'] for row in analytics['outstanding_by_status']), 12)
+
+
+class ImportLoansCommandTests(TestCase):
+    """Test the import_loans command."""
+
+    def setUp(self):
+        User.objects.create(user_name='import_user')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, file_name, lines):
+        path = os.path.join(self.directory.name, file_name)
+        with open(path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        return path
+
+    def test_import_csv(self):
+        """Test that valid rows are imported with their schedules, and invalid rows reported."""
+        path = self.write_file('loans.csv', [
+            'user_name,amount,terms,created_date',
+            'import_user,1000,3,2022-01-03',
+            'import_user,0,3,',
+            'unknown_user,1000,3,',
+            'import_user,500,2,',
+        ])
+        report = os.path.join(self.directory.name, 'errors.jsonl')
+
+        out = StringIO()
+        call_command('import_loans', path, batch_size=2, error_report=report, stdout=out)
+
+        self.assertIn('Imported 2 loans, 2 rows failed.', out.getvalue())
+        loan = Loan.objects.get(amount=1000)
+        self.assertEqual(loan.created_date, date(2022, 1, 3))
+        self.assertEqual((loan.outstanding_balance, loan.pending_repayments, loan.next_due_date),
+                         (1000, 3, date(2022, 1, 10)))
+        self.assertEqual(sorted(Repayment.objects.filter(loan=loan).values_list('amount', flat=True)), [333, 333, 334])
+        self.assertEqual(Repayment.objects.count(), 5)
+        with open(report) as errors:
+            self.assertEqual([json.loads(line)['line'] for line in errors], [3, 4])
+
+    def test_import_resumes(self):
+        """Test that running an import again with the same name only imports the rows after its progress."""
+        lines = ['{"user_name": "import_user", "amount": 100, "terms": 1}'] * 3 + ['not json']
+        call_command('import_loans', self.write_file('part.jsonl', lines[:2]), name='book', stdout=StringIO())
+        self.assertEqual(Loan.objects.count(), 2)
+
+        out = StringIO()
+        call_command('import_loans', self.write_file('full.jsonl', lines), name='book', stdout=out)
+        self.assertIn('Resuming the import book after line 2.', out.getvalue())
+        self.assertEqual(Loan.objects.count(), 3)
+        loan_import = LoanImport.objects.get(name='book')
+        self.assertEqual((loan_import.last_line, loan_import.imported, loan_import.failed), (4, 3, 1))
+
+
+class BenchmarkAPICommandTests(TestCase):
+    """Test the benchmark_api command."""
+
+    def test_benchmark_and_compare(self):
+        """Test benchmarking the endpoints in-process, saving a baseline and comparing a later run against it."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = os.path.join(directory.name, 'baseline.json')
+
+        out = StringIO()
+        call_command('benchmark_api', users=5, loans_per_user=4, terms=3, requests=40, warmup=5, output=baseline,
+                     stdout=out)
+        with open(baseline) as results:
+            results = json.load(results)
+        self.assertEqual(results['total']['requests'], 40)
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertIn('GET /loan', results['endpoints'])
+        self.assertIsNotNone(results['endpoints']['GET /loan']['queries_per_request'])
+        self.assertEqual(Loan.objects.count(), 0)
+
+        results['total']['queries_per_request'] = 0
+        with open(baseline, 'w') as output:
+            json.dump(results, output)
+        with self.assertRaisesMessage(CommandError, 'queries per request'):
+            call_command('benchmark_api', users=5, loans_per_user=4, terms=3, requests=40, warmup=5,
+                         compare=baseline, tolerance=100, stdout=StringIO())
@@ -0,0 +1,93 @@
+"""
+Test the in-process database connection pool.
+"""
+import threading
+
+from django.test import SimpleTestCase
+
+from core.connection_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.transaction_status = 0
+        self.rolled_back = False
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def rollback(self):
+        self.rolled_back = True
+        self.transaction_status = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Test the connection pool."""
+
+    def pool(self, **kwargs):
+        return ConnectionPool(FakeConnection, **dict({'max_size': 2, 'timeout': 0.05}, **kwargs))
+
+    def test_connections_are_reused(self):
+        """Test that released connections are handed out again instead of opening new ones."""
+        pool = self.pool()
+        connection = pool.acquire()
+        pool.release(connection)
+
+        self.assertIs(pool.acquire(), connection)
+        stats = pool.stats()
+        self.assertEqual((stats['opened'], stats['acquired'], stats['in_use'], stats['idle']), (1, 2, 1, 0))
+
+    def test_open_transaction_is_rolled_back(self):
+        """Test that a transaction left open on a released connection is rolled back."""
+        pool = self.pool()
+        connection = pool.acquire()
+        connection.transaction_status = 2
+        pool.release(connection)
+        self.assertTrue(connection.rolled_back)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_unusable_connections_are_replaced(self):
+        """Test that idle connections failing the health check, or closed, are replaced by new ones."""
+        pool = self.pool(check=lambda connection: False)
+        connection = pool.acquire()
+        pool.release(connection)
+
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_idle_connections_expire(self):
+        """Test that connections idle for longer than max_idle are closed."""
+        pool = self.pool(max_idle=0)
+        connection = pool.acquire()
+        pool.release(connection)
+
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertTrue(connection.closed)
+
+    def test_saturated_pool_waits(self):
+        """Test that a full pool waits for a connection to be released, and times out if none is."""
+        pool = self.pool(timeout=5)
+        first, _ = pool.acquire(), pool.acquire()
+        threading.Timer(0.05, pool.release, [first]).start()
+        self.assertIs(pool.acquire(), first)
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertGreater(pool.stats()['wait_seconds'], 0)
+
+        pool.timeout = 0.01
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        self.assertEqual(pool.stats()['max_in_use'], 2)
+
+    def test_discarded_connections_free_their_slot(self):
+        """Test that discarding a connection lets a new one be opened."""
+        pool = self.pool(max_size=1)
+        connection = pool.acquire()
+        pool.discard(connection)
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertEqual(pool.stats()['size'], 1)
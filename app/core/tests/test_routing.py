@@ -0,0 +1,123 @@
+"""
+Test the routing of the database reads to the read replicas.
+"""
+import asyncio
+
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from core.models import Loan
+from core.routing import (
+    ReplicaRouter,
+    ReplicaRoutingMiddleware,
+    made_recent_write,
+    replica_reads,
+    use_primary,
+    with_request_reads
+)
+
+REPLICA_SETTINGS = {
+    'DATABASE_REPLICAS': ['replica_1'],
+    'READ_YOUR_WRITES': {'WINDOW': 60, 'CACHE_ALIAS': 'default'},
+}
+
+
+def read_database():
+    return ReplicaRouter().db_for_read(Loan)
+
+
+@override_settings(**REPLICA_SETTINGS)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Test the database router and the middleware choosing the database each request reads from."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.factory = RequestFactory()
+        self.read_databases = []
+
+        def get_response(request):
+            self.read_databases.append(read_database())
+            return HttpResponse()
+        self.middleware = ReplicaRoutingMiddleware(get_response)
+
+    def test_reads_outside_requests_go_to_primary(self):
+        """Test that reads made outside a request, e.g. by the management commands, go to the primary."""
+        self.assertEqual(read_database(), 'default')
+
+    def test_writes_go_to_primary(self):
+        """Test that writes go to the primary, even from a request reading from a replica."""
+        with replica_reads():
+            self.assertEqual(ReplicaRouter().db_for_write(Loan), 'default')
+
+    def test_safe_request_reads_from_replica(self):
+        """Test that the reads of a safe request go to a replica."""
+        self.middleware(self.factory.get('/loan', HTTP_USERNAME='sample_user'))
+        self.middleware(self.factory.get('/loan'))
+        self.assertEqual(self.read_databases, ['replica_1', 'replica_1'])
+        self.assertEqual(read_database(), 'default')
+
+    def test_reads_follow_own_writes(self):
+        """Test that the user making a write reads from the primary afterwards, and other users from a replica."""
+        self.middleware(self.factory.post('/loan', HTTP_USERNAME='sample_user'))
+        self.assertTrue(made_recent_write('sample_user'))
+
+        self.middleware(self.factory.get('/loan', HTTP_USERNAME='sample_user'))
+        self.middleware(self.factory.get('/loan', HTTP_USERNAME='other_user'))
+        self.assertEqual(self.read_databases, ['default', 'default', 'replica_1'])
+
+    @override_settings(READ_YOUR_WRITES={'WINDOW': 0, 'CACHE_ALIAS': 'default'})
+    def test_reads_go_back_to_replica_after_window(self):
+        """Test that the reads of a user go back to a replica once the window after their write has passed."""
+        self.middleware(self.factory.put('/repayment/1/1', HTTP_USERNAME='sample_user'))
+        self.middleware(self.factory.get('/loan', HTTP_USERNAME='sample_user'))
+        self.assertEqual(self.read_databases, ['default', 'replica_1'])
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_reads_go_to_primary_without_replicas(self):
+        """Test that every read goes to the primary when no replica is configured."""
+        self.middleware(self.factory.get('/loan', HTTP_USERNAME='sample_user'))
+        self.middleware(self.factory.post('/loan', HTTP_USERNAME='sample_user'))
+        self.assertEqual(self.read_databases, ['default', 'default'])
+        self.assertFalse(made_recent_write('sample_user'))
+
+    def test_async_safe_request_reads_from_replica(self):
+        """Test that the middleware routes the reads of requests served over ASGI too."""
+        async def get_response(request):
+            self.read_databases.append(read_database())
+            return HttpResponse()
+        middleware = ReplicaRoutingMiddleware(get_response)
+        factory = AsyncRequestFactory()
+
+        asyncio.run(middleware(factory.post('/loan', username='sample_user')))
+        asyncio.run(middleware(factory.get('/loan', username='sample_user')))
+        asyncio.run(middleware(factory.get('/loan', username='other_user')))
+        self.assertEqual(self.read_databases, ['default', 'default', 'replica_1'])
+
+    def test_use_primary_pins_reads(self):
+        """Test that the reads of the views pinned to the primary go to the primary."""
+        with replica_reads():
+            self.assertEqual(use_primary(read_database)(), 'default')
+            self.assertEqual(read_database(), 'replica_1')
+
+    def test_streamed_content_reads_from_request_database(self):
+        """Test that content streamed after the request has been handled reads from the database of the request."""
+        def stream():
+            yield read_database()
+            yield read_database()
+
+        with replica_reads():
+            content = with_request_reads(stream())
+        self.assertEqual(list(content), ['replica_1', 'replica_1'])
+        self.assertEqual(read_database(), 'default')
+
+
+@override_settings(**REPLICA_SETTINGS)
+class ReplicaRoutingTransactionTests(TestCase):
+    """Test the routing of the reads made in a transaction."""
+
+    def test_reads_in_transaction_go_to_primary(self):
+        """Test that the reads made in a transaction on the primary go to the primary, to see its writes."""
+        with replica_reads(), transaction.atomic():
+            self.assertEqual(read_database(), 'default')
@@ -0,0 +1,50 @@
+"""
+Gunicorn configuration for serving the app in production, with several worker processes.
+
+    gunicorn -c gunicorn.conf.py
+
+serves app/wsgi.py with threaded workers, or app/asgi.py with Uvicorn workers if SERVER_INTERFACE=asgi. The number of
+workers and threads, and the keep-alive timeout, are read from the environment.
+"""
+import multiprocessing
+import os
+import shutil
+
+SERVER_INTERFACE = os.environ.get('SERVER_INTERFACE', 'wsgi')
+if SERVER_INTERFACE not in ('wsgi', 'asgi'):
+    raise ValueError('SERVER_INTERFACE must be wsgi or asgi, not {}.'.format(SERVER_INTERFACE))
+
+wsgi_app = 'app.asgi:application' if SERVER_INTERFACE == 'asgi' else 'app.wsgi:application'
+worker_class = 'uvicorn_worker.UvicornWorker' if SERVER_INTERFACE == 'asgi' else 'gthread'
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Threads per worker, for the WSGI interface. ASGI workers serve concurrent requests from their event loop.
+threads = int(os.environ.get('WEB_THREADS', 4))
+# Seconds to keep idle client connections open, so that clients and proxies can reuse them across requests.
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = timeout
+# Workers are recycled after serving this many requests, with some jitter so they do not all restart at once.
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+raw_env = ['DJANGO_SETTINGS_MODULE={}'.format(os.environ.get('DJANGO_SETTINGS_MODULE', 'app.settings_production'))]
+
+
+def on_starting(server):
+    """Clears the metrics of the previous run, when the workers share their Prometheus metrics through files."""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drops the live metrics of a worker that exited, so that they are no longer reported."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,82 @@
+"""
+Approval of pending loans, one or many at a time.
+
+Bulk approvals are given either a list of loan IDs or a filter matching pending loans, in both cases up to
+LOAN_APPROVAL_BATCH_LIMIT loans per request.
+"""
+from django.db import connection
+
+from core.analytics import invalidate_portfolio_analytics
+from core.metrics import LOANS_APPROVED, count_on_commit
+from core.models import Loan, LoanStatus, LoanSummary
+
+APPROVED = 'approved'
+ALREADY_APPROVED = 'already_approved'
+NOT_FOUND = 'not_found'
+
+# The approved loans are moved from the pending to the active loans of the summaries of their users, in the same
+# statement.
+APPROVE_LOANS_SQL = '''
+    WITH approved AS (
+        UPDATE {loan_table} SET status = %(approved)s
+        WHERE id = ANY(%(loan_ids)s) AND status = %(pending)s
+        RETURNING id, user_id, next_due_date
+    ),
+    summaries AS (
+        UPDATE {summary_table} summary SET
+            pending_loans = summary.pending_loans - approved_by_user.loans,
+            active_loans = summary.active_loans + approved_by_user.loans,
+            next_due_date = LEAST(summary.next_due_date, approved_by_user.next_due_date)
+        FROM (
+            SELECT user_id, COUNT(*) AS loans, MIN(next_due_date) AS next_due_date
+            FROM approved
+            GROUP BY user_id
+        ) approved_by_user
+        WHERE summary.user_id = approved_by_user.user_id
+    )
+    SELECT id FROM approved
+'''
+
+
+def approve_loans(loan_ids):
+    """
+    Approves the loans with the given IDs that are still pending, with a single conditional update that also updates
+    the loan summaries of their users. Returns the outcome of each ID, in the given order: approved, already approved
+    (i.e. approved or paid before), or not found.
+    """
+    loan_ids = list(dict.fromkeys(loan_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(APPROVE_LOANS_SQL.format(loan_table=Loan._meta.db_table,
+                                                summary_table=LoanSummary._meta.db_table), {
+            'loan_ids': loan_ids,
+            'approved': LoanStatus.APPROVED.value,
+            'pending': LoanStatus.PENDING.value,
+        })
+        approved = {row[0] for row in cursor.fetchall()}
+
+    count_on_commit(LOANS_APPROVED, len(approved))
+    if approved:
+        invalidate_portfolio_analytics()
+
+    remaining = [loan_id for loan_id in loan_ids if loan_id not in approved]
+    existing = set(Loan.objects.filter(id__in=remaining).values_list('id', flat=True)) if remaining else set()
+    return {
+        loan_id: APPROVED if loan_id in approved else ALREADY_APPROVED if loan_id in existing else NOT_FOUND
+        for loan_id in loan_ids
+    }
+
+
+def pending_loan_ids(limit, user_name=None, created_from=None, created_to=None, min_amount=None, max_amount=None):
+    """Returns the IDs of up to limit pending loans matching the given filters, in ID order."""
+    loans = Loan.objects.filter(status=LoanStatus.PENDING)
+    if user_name is not None:
+        loans = loans.filter(user__user_name=user_name)
+    if created_from is not None:
+        loans = loans.filter(created_date__gte=created_from)
+    if created_to is not None:
+        loans = loans.filter(created_date__lte=created_to)
+    if min_amount is not None:
+        loans = loans.filter(amount__gte=min_amount)
+    if max_amount is not None:
+        loans = loans.filter(amount__lte=max_amount)
+    return list(loans.order_by('id').values_list('id', flat=True)[:limit])
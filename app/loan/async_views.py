@@ -0,0 +1,55 @@
+"""
+Async versions of the loan, repayment and loan approval views, routed instead of the sync ones when ASYNC_VIEWS is
+set, as it is when the app is served over ASGI (see app/asgi.py).
+
+Under ASGI, Django runs sync views one at a time on a single thread per worker process, so a request waiting on the
+database holds up every other one. These views run the sync view on the database thread pool of core.async_db
+instead, so the event loop keeps serving other requests while the pool threads wait on the database. The responses are
+the same as those of the sync views, except that the loan listing cannot be streamed.
+"""
+import functools
+
+from django.http import JsonResponse
+from rest_framework import status
+
+from core.async_db import database_sync_to_async
+from . import views
+
+# Django 3.2 iterates streaming responses on the event loop under ASGI, where queries are not allowed, and buffering
+# them would load the whole listing in memory, so the streamed loan listing is not served by the async views.
+STREAMING_NOT_SUPPORTED = ('Streaming the loan listing with stream=true is not supported when the API is served over '
+                           'ASGI. Please page through it instead, following the URL of the next page in the Link '
+                           'header.')
+
+
+def run_view(view, request, *args, **kwargs):
+    """Calls the view and renders its response, so that no query or rendering is left to the event loop."""
+    response = view(request, *args, **kwargs)
+    if callable(getattr(response, 'render', None)):
+        response.render()
+    return response
+
+
+def async_view(view):
+    """Returns an async view running the given view on the database thread pool."""
+    @functools.wraps(view)
+    async def handle(request, *args, **kwargs):
+        return await database_sync_to_async(run_view)(view, request, *args, **kwargs)
+    return handle
+
+
+def loan_view(view):
+    """Returns the async loan view, rejecting the streamed loan listing before the view is run."""
+    handle = async_view(view)
+
+    @functools.wraps(view)
+    async def handle_loan(request, *args, **kwargs):
+        if request.method == 'GET' and request.GET.get('stream') == 'true':
+            return JsonResponse({'error': STREAMING_NOT_SUPPORTED}, status=status.HTTP_400_BAD_REQUEST)
+        return await handle(request, *args, **kwargs)
+    return handle_loan
+
+
+loan = loan_view(views.LoanView.as_view())
+repayment = async_view(views.RepaymentView.as_view())
+loan_approval = async_view(views.loan_approval)
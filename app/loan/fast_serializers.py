@@ -0,0 +1,98 @@
+"""
+Read-only serialization of the loan listings, without the DRF field machinery.
+
+The loans and their repayments are read as plain rows with values() and turned into the same dicts, in the same
+key order, as LoanListSerializer and RepaymentListSerializer produce. Statuses are looked up in precomputed tables
+instead of through the enums, and the result is rendered with orjson, to the same bytes as DRF's JSONRenderer.
+Archived loans are serialized the same way, from the repayments stored along with them.
+"""
+from collections import defaultdict
+
+import orjson
+from django.db.models import ExpressionWrapper, F, IntegerField
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+from core.instrumentation import timed
+from core.models import LoanStatus, Repayment, RepaymentStatus
+
+LOAN_STATUS_NAMES = {status.value: status.name for status in LoanStatus}
+REPAYMENT_STATUS_NAMES = {status.value: status.name for status in RepaymentStatus}
+# Only paid loans are archived.
+ARCHIVED_LOAN_STATUS = LoanStatus.PAID.name
+
+# Statuses read as plain integers, skipping the conversion of every value to its enum by EnumField.
+RAW_STATUS = ExpressionWrapper(F('status'), output_field=IntegerField())
+REPAYMENT_COLUMNS = ('loan_id', 'id', 'amount', 'raw_status', 'due_date')
+
+
+def loan_rows(queryset):
+    """Returns the queryset of the loans as dicts of their id, amount, terms, raw_status and created_date."""
+    return queryset.annotate(raw_status=RAW_STATUS).values('id', 'amount', 'terms', 'raw_status', 'created_date')
+
+
+def archived_loan_rows(queryset):
+    """Returns the queryset of the archived loans as dicts of their id, amount, terms, created_date and repayments."""
+    return queryset.values('id', 'amount', 'terms', 'created_date', 'repayments')
+
+
+def serialize_archived_loan(row):
+    """Returns the archived loan row, as read by archived_loan_rows(), serialized like the loan it was archived from."""
+    return {
+        'id': row['id'],
+        'amount': row['amount'],
+        'terms': row['terms'],
+        'repayments': [
+            {'id': repayment_id, 'amount': amount, 'status': REPAYMENT_STATUS_NAMES[status], 'due_date': due_date}
+            for repayment_id, amount, status, due_date in row['repayments']
+        ],
+        'status': ARCHIVED_LOAN_STATUS,
+    }
+
+
+def serialize_loans(rows):
+    """
+    Returns the loan rows, as read by loan_rows() or archived_loan_rows(), serialized like LoanListSerializer does,
+    with the repayments of all the loans that are not archived read with a single query, in due date order.
+    """
+    repayments = defaultdict(list)
+    loan_ids = [row['id'] for row in rows if 'repayments' not in row]
+    if loan_ids:
+        repayment_rows = list(Repayment.objects.filter(loan_id__in=loan_ids).annotate(
+            raw_status=RAW_STATUS).order_by('loan_id', 'due_date', 'id').values_list(*REPAYMENT_COLUMNS))
+    else:
+        repayment_rows = []
+
+    with timed('serializer'):
+        for loan_id, repayment_id, amount, status, due_date in repayment_rows:
+            repayments[loan_id].append({
+                'id': repayment_id,
+                'amount': amount,
+                'status': REPAYMENT_STATUS_NAMES[status],
+                'due_date': due_date.isoformat(),
+            })
+        return [
+            serialize_archived_loan(row) if 'repayments' in row else {
+                'id': row['id'],
+                'amount': row['amount'],
+                'terms': row['terms'],
+                'repayments': repayments[row['id']],
+                'status': LOAN_STATUS_NAMES[row['raw_status']],
+            }
+            for row in rows
+        ]
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Renders compact JSON with orjson, falling back to JSONRenderer when indented output is asked for. The output is
+    the same as JSONRenderer's for data made of dicts, lists, strings, integers, booleans and None.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not self.compact or self.ensure_ascii or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        # As JSONRenderer does, escape the line and paragraph separators, which are not valid in JavaScript strings.
+        return orjson.dumps(data, default=JSONEncoder().default).replace(
+            b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,169 @@
+"""
+Bulk import of loans, along with their repayment schedules, from JSONL or CSV files.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import connection, transaction
+
+from core.analytics import invalidate_portfolio_analytics
+from core.metrics import LOANS_CREATED, count_on_commit
+from core.models import Loan, LoanImport, LoanImportError, Repayment, User
+from core.summaries import add_loans
+from .schedule import new_loan
+from .serializers import IMPORT_FORMATS, LoanImportSerializer
+
+IMPORT_BATCH_SIZE = 1000
+# COPY writes every column given, with no defaults from Django, so all the NOT NULL columns of the tables are listed.
+LOAN_COPY_FIELDS = ('id', 'user', 'amount', 'terms', 'created_date', 'status', 'amount_paid', 'outstanding_balance',
+                    'pending_repayments', 'next_due_date')
+REPAYMENT_COPY_FIELDS = ('loan', 'amount', 'status', 'due_date', 'overdue')
+UNPARSABLE_ROW = {'non_field_errors': ['The row could not be parsed.']}
+
+
+class ImportConflict(Exception):
+    """Raised when the progress of an import was moved on by another run of the same import."""
+
+
+def detect_format(file_name):
+    """Returns the format of a file to import, from its extension."""
+    return 'csv' if file_name.lower().endswith('.csv') else 'jsonl'
+
+
+def read_rows(lines, file_format, after_line=0):
+    """
+    Yields a (line number, row) pair for each row of the file after the given line, the row being None if it cannot
+    be parsed. The line number of a CSV row is that of its last line, so that it can be resumed from.
+    """
+    if file_format not in IMPORT_FORMATS:
+        raise ValueError('Unsupported import format {}.'.format(file_format))
+
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            if reader.line_num > after_line:
+                yield reader.line_num, {key: value for key, value in row.items() if value not in ('', None)}
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if line_number <= after_line or not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def import_loans(lines, file_format, name, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports the loans in the given lines of a JSONL or CSV file, one batch of rows at a time, so that memory use does
+    not grow with the size of the file. Each row is validated with the rules of POST /loan and needs the user_name of
+    an existing user; its loan is created with its repayment schedule. The rows that fail are recorded as import
+    errors. The loans, the errors and the progress of each batch are written in a single transaction, so an import
+    that was interrupted can be resumed by running it again with the same name. Yields the progress after each batch.
+    """
+    loan_import, _ = LoanImport.objects.get_or_create(name=name)
+    rows = read_rows(lines, file_format, after_line=loan_import.last_line)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        loan_import = _import_batch(loan_import, batch)
+        yield loan_import
+
+
+def iter_errors(loan_import):
+    """Yields the errors recorded for the import, in line order."""
+    errors = LoanImportError.objects.filter(loan_import=loan_import).order_by('line').values_list('line', 'errors')
+    for line_number, row_errors in errors.iterator():
+        yield {'line': line_number, 'errors': row_errors}
+
+
+def _import_batch(loan_import, batch):
+    validated, errors = [], []
+    for line_number, row in batch:
+        if row is None:
+            errors.append((line_number, UNPARSABLE_ROW))
+            continue
+        serializer = LoanImportSerializer(data=row)
+        if serializer.is_valid():
+            validated.append((line_number, serializer.validated_data))
+        else:
+            errors.append((line_number, serializer.errors))
+
+    user_ids = dict(User.objects.filter(
+        user_name__in={data['user_name'] for _, data in validated}).values_list('user_name', 'id'))
+    loans = []
+    for line_number, data in validated:
+        user_id = user_ids.get(data['user_name'])
+        if user_id is None:
+            errors.append((line_number, {'user_name': ['User {} does not exist.'.format(data['user_name'])]}))
+            continue
+        loans.append(new_loan(User(id=user_id, user_name=data['user_name']), data['amount'], data['terms'],
+                              data.get('created_date')))
+
+    with transaction.atomic():
+        progress = LoanImport.objects.select_for_update().get(id=loan_import.id)
+        if progress.last_line != loan_import.last_line:
+            raise ImportConflict('The import {} is being run concurrently.'.format(loan_import.name))
+
+        _insert_loans(loans)
+        add_loans([loan for loan, _ in loans])
+        count_on_commit(LOANS_CREATED, len(loans))
+        invalidate_portfolio_analytics()
+        LoanImportError.objects.bulk_create(
+            [LoanImportError(loan_import=progress, line=line_number, errors=row_errors)
+             for line_number, row_errors in sorted(errors)])
+        progress.last_line = batch[-1][0]
+        progress.imported += len(loans)
+        progress.failed += len(errors)
+        progress.save(update_fields=['last_line', 'imported', 'failed', 'updated_at'])
+    return progress
+
+
+def _insert_loans(loans):
+    """
+    Inserts the (loan, repayments) pairs. On Postgres, the loan IDs are reserved from their sequence up front, so that
+    both the loans and the repayments can be written with COPY.
+    """
+    if not loans:
+        return
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                           [Loan._meta.db_table, len(loans)])
+            for (loan, _), (loan_id,) in zip(loans, cursor.fetchall()):
+                loan.id = loan_id
+            repayments = _link_repayments(loans)
+            _copy(cursor, Loan, LOAN_COPY_FIELDS, [loan for loan, _ in loans])
+            _copy(cursor, Repayment, REPAYMENT_COPY_FIELDS, repayments)
+    else:
+        for loan, _ in loans:
+            loan.save()
+        Repayment.objects.bulk_create(_link_repayments(loans), batch_size=IMPORT_BATCH_SIZE)
+
+
+def _link_repayments(loans):
+    repayments = []
+    for loan, loan_repayments in loans:
+        for repayment in loan_repayments:
+            repayment.loan_id = loan.id
+        repayments.extend(loan_repayments)
+    return repayments
+
+
+def _copy(cursor, model, field_names, objects):
+    fields = [model._meta.get_field(field_name) for field_name in field_names]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objects:
+        writer.writerow([field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields])
+    buffer.seek(0)
+
+    quote_name = connection.ops.quote_name
+    cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        quote_name(model._meta.db_table), ', '.join(quote_name(field.column) for field in fields)), buffer)
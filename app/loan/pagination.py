@@ -0,0 +1,132 @@
+"""
+Keyset (cursor) pagination and streaming for the loan listings.
+
+The archived loans of a user are left out of the listings unless include_archived=true is given, in which case they are
+merged in, in the same order. The loans are serialized on the read-only path of fast_serializers.py.
+"""
+import base64
+import binascii
+import heapq
+from datetime import date
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+from core.models import Repayment
+from core.routing import with_request_reads
+from .fast_serializers import FastJSONRenderer, archived_loan_rows, loan_rows, serialize_loans
+
+LOAN_ORDERING = ('created_date', 'id')
+
+
+def loan_key(row):
+    return row['created_date'], row['id']
+
+
+def merge_archived(loans, archived):
+    """
+    Merges the loan rows with the archived loan rows, both in (created_date, id) order, into a single iterator in that
+    order. Archived loans keep the IDs they had, so the order is the one the loans had before being archived.
+    """
+    return heapq.merge(loans, archived, key=loan_key)
+
+
+def ordered_repayments_prefetch():
+    """Prefetches the repayments of loans in due date order, as LoanListSerializer lists them."""
+    return Prefetch('repayments', queryset=Repayment.objects.order_by('due_date', 'id'))
+
+
+def encode_cursor(created_date, loan_id):
+    return base64.urlsafe_b64encode('{}:{}'.format(created_date.isoformat(), loan_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_date, loan_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return date.fromisoformat(created_date), int(loan_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+class LoanKeysetPagination:
+    """
+    Paginates loans on (created_date, id), so every page is read with an indexed range scan instead of an OFFSET.
+    The cursor for the next page is returned in the Link response header. The loans are read as the rows of
+    fast_serializers.loan_rows(). Given archived loans too, a page of them is read the same way and merged in.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self, request):
+        self.request = request
+        self.page_size = self.get_page_size()
+        self.next_cursor = None
+
+    def get_page_size(self):
+        page_size = self.request.query_params.get(self.page_size_query_param)
+        if page_size is None:
+            return settings.LOAN_PAGE_SIZE
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            page_size = 0
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: 'Page size must be a positive integer.'})
+        return min(page_size, settings.LOAN_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, archived=None):
+        cursor = self.request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_date, loan_id = decode_cursor(cursor)
+            after_cursor = Q(created_date__gt=created_date) | Q(created_date=created_date, id__gt=loan_id)
+            queryset = queryset.filter(after_cursor)
+            if archived is not None:
+                archived = archived.filter(after_cursor)
+
+        loans = list(queryset.order_by(*LOAN_ORDERING)[:self.page_size + 1])
+        if archived is not None:
+            archived = list(archived_loan_rows(archived).order_by(*LOAN_ORDERING)[:self.page_size + 1])
+            loans = list(islice(merge_archived(loans, archived), self.page_size + 1))
+        if len(loans) > self.page_size:
+            loans = loans[:self.page_size]
+            self.next_cursor = encode_cursor(loans[-1]['created_date'], loans[-1]['id'])
+        return loans
+
+    def get_headers(self):
+        if self.next_cursor is None:
+            return {}
+        next_url = replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+        return {'Link': '<{}>; rel="next"'.format(next_url)}
+
+
+def stream_loans(queryset, archived=None, chunk_size=None):
+    """
+    Yields the JSON array of the serialized loans piece by piece. The loans are read through a server-side cursor
+    and their repayments are read one chunk at a time, so memory use does not grow with the number of loans. Given
+    archived loans too, they are read through a server-side cursor of their own and merged in as they come.
+    """
+    chunk_size = chunk_size or settings.LOAN_STREAM_CHUNK_SIZE
+    renderer = FastJSONRenderer()
+    loans = loan_rows(queryset).order_by(*LOAN_ORDERING).iterator(chunk_size=chunk_size)
+    if archived is not None:
+        loans = merge_archived(loans, archived_loan_rows(archived).order_by(*LOAN_ORDERING).iterator(
+            chunk_size=chunk_size))
+
+    yield b'['
+    separator = b''
+    while True:
+        chunk = list(islice(loans, chunk_size))
+        if not chunk:
+            break
+        yield separator + renderer.render(serialize_loans(chunk))[1:-1]
+        separator = b','
+    yield b']'
+
+
+def streaming_loans_response(queryset, archived=None):
+    # The loans are streamed once the request has been handled, from the same database as the request read from.
+    return StreamingHttpResponse(with_request_reads(stream_loans(queryset, archived)), content_type='application/json')
@@ -0,0 +1,61 @@
+"""
+Rebalancing of the pending repayments of a loan.
+"""
+from collections import namedtuple
+from datetime import date
+
+from django.db import connection
+
+from core.metrics import REBALANCES, count_on_commit
+from core.models import Repayment, RepaymentStatus
+
+RebalanceResult = namedtuple('RebalanceResult', ('pending', 'updated', 'next_due_date'))
+
+# The outstanding balance of the loan is split into whole-number installments over its pending repayments, ordered
+# by due date, with the remainder of the division spread one unit each over the earliest of them. Only the rows whose
+# amount actually changes are written.
+REBALANCE_SQL = '''
+    WITH pending AS (
+        SELECT
+            repayment.id,
+            repayment.due_date,
+            repayment.amount AS current_amount,
+            %(balance)s / COUNT(*) OVER () + CASE
+                WHEN ROW_NUMBER() OVER (ORDER BY repayment.due_date, repayment.id)
+                    <= %(balance)s %% COUNT(*) OVER () THEN 1
+                ELSE 0
+            END AS new_amount
+        FROM {repayment_table} repayment
+        WHERE repayment.loan_id = %(loan_id)s AND repayment.status = %(pending)s
+            AND repayment.due_date >= %(from_due_date)s
+    ),
+    updated AS (
+        UPDATE {repayment_table} repayment
+        SET amount = pending.new_amount
+        FROM pending
+        WHERE repayment.id = pending.id AND repayment.due_date = pending.due_date
+            AND repayment.due_date >= %(from_due_date)s AND pending.current_amount <> pending.new_amount
+        RETURNING repayment.id
+    )
+    SELECT COUNT(*), (SELECT COUNT(*) FROM updated), MIN(due_date) FROM pending
+'''
+
+
+def rebalance_pending_repayments(loan_id, balance, from_due_date=None):
+    """
+    Recomputes the amounts of the pending repayments of the given loan, so that they add up exactly to the given
+    outstanding balance, in a single set-based statement scoped to the loan. Returns the number of pending
+    repayments, the number of them that were updated, and the earliest due date among them. Given the next due date
+    of the loan as from_due_date, only the partitions of the repayment table from its month on are read.
+    """
+    sql = REBALANCE_SQL.format(repayment_table=Repayment._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'loan_id': loan_id,
+            'balance': max(balance, 0),
+            'pending': RepaymentStatus.PENDING.value,
+            'from_due_date': from_due_date or date.min,
+        })
+        result = RebalanceResult(*cursor.fetchone())
+    count_on_commit(REBALANCES)
+    return result
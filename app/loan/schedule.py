@@ -0,0 +1,60 @@
+"""
+Repayment schedule generation for new loans.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+
+from core.analytics import invalidate_portfolio_analytics
+from core.metrics import LOANS_CREATED, count_on_commit
+from core.models import Loan, Repayment
+from core.summaries import add_loans
+
+REPAYMENT_INTERVAL = timedelta(weeks=1)
+REPAYMENT_BATCH_SIZE = 500
+
+
+def split_amount(total, parts):
+    """
+    Splits the integer total into the given number of integer parts that add up exactly to the total. The remainder
+    of the division is spread, one unit each, over the leading parts.
+    """
+    base, remainder = divmod(total, parts)
+    return [base + 1 if i < remainder else base for i in range(parts)]
+
+
+def build_repayment_schedule(loan):
+    """Computes, in memory, the unsaved repayment records for every term of the given loan."""
+    return [
+        Repayment(loan=loan, amount=amount, due_date=loan.created_date + REPAYMENT_INTERVAL * (i + 1))
+        for i, amount in enumerate(split_amount(loan.amount, loan.terms))
+    ]
+
+
+def new_loan(user, amount, terms, created_date=None):
+    """
+    Returns the unsaved loan along with its repayment schedule, with the loan counters set accordingly. The loan is
+    created today unless a created_date is given.
+    """
+    loan = Loan(user=user, amount=amount, terms=terms, outstanding_balance=amount, pending_repayments=terms)
+    if created_date is not None:
+        loan.created_date = created_date
+    repayments = build_repayment_schedule(loan)
+    loan.next_due_date = repayments[0].due_date
+    return loan, repayments
+
+
+def create_loan_with_schedule(user, amount, terms):
+    """
+    Creates the loan along with its complete repayment schedule in a single transaction, and adds it to the loan
+    summary of the user. The repayments are written with inserts of up to REPAYMENT_BATCH_SIZE rows each, so a single
+    one for the up to LOAN_MAX_TERMS terms a loan has with the default settings.
+    """
+    loan, repayments = new_loan(user, amount, terms)
+    with transaction.atomic():
+        loan.save()
+        Repayment.objects.bulk_create(repayments, batch_size=REPAYMENT_BATCH_SIZE)
+        add_loans([loan])
+        count_on_commit(LOANS_CREATED)
+        invalidate_portfolio_analytics()
+    return loan
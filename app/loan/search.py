@@ -0,0 +1,150 @@
+"""
+Search of the loans of all the users by the admin user, with filters, a choice of ordering and keyset pagination.
+
+Each ordering is served by walking one index of the loan table in that order: the one leading with the status when
+the loans are filtered on their status, or the user's loan index when they are filtered on a user. Ranges on the
+ordering column are index conditions of the walk. Filters that would be checked on the rows walked instead are
+rejected, see SERVED_FILTERS.
+"""
+import base64
+import binascii
+import heapq
+import json
+from datetime import date
+
+from django.db.models import F, Q, Subquery
+from rest_framework.exceptions import ValidationError
+
+from core.models import Loan, LoanStatus, User
+from .fast_serializers import LOAN_STATUS_NAMES, RAW_STATUS
+from .pagination import LoanKeysetPagination
+
+SEARCH_ORDERINGS = ('created_date', 'amount', 'next_due_date')
+SEARCH_COLUMNS = ('id', 'user_name', 'amount', 'terms', 'raw_status', 'created_date', 'amount_paid',
+                  'outstanding_balance', 'next_due_date')
+
+# The filters each ordering can be served with, together, by an index walked in that order: the status or the user an
+# index leads with, and ranges on the ordering column, overdue=true being a range on the next due date of the approved
+# loans. Other filters would be checked on the loans walked, and a selective one would walk most of the index to fill
+# a page, so the other combinations are rejected. overdue=false, which only leaves out the overdue loans, is accepted
+# with every ordering.
+SERVED_FILTERS = {
+    'created_date': (('status', 'created_from', 'created_to'), ('user_name', 'created_from', 'created_to')),
+    'amount': (('status', 'min_amount', 'max_amount'),),
+    'next_due_date': (('status', 'overdue'),),
+}
+
+
+def unserved_filters_error(ordering, filters):
+    """Returns why the given filters cannot be served by an index walked in the given ordering, or None if they can."""
+    field = ordering.lstrip('-')
+    given = {name for name, value in filters.items()
+             if value is not None and not (name == 'overdue' and value is False)}
+    if any(given <= set(names) for names in SERVED_FILTERS[field]):
+        return None
+    return 'Ordering by {} can only be combined with the filters {}, which an index of the loans serves.'.format(
+        field, ' or '.join('({})'.format(', '.join(names)) for names in SERVED_FILTERS[field]))
+
+
+def search_loans(user_name=None, status=None, created_from=None, created_to=None, min_amount=None, max_amount=None,
+                 overdue=None, today=None):
+    """
+    Returns the loans matching the given filters, as rows of SEARCH_COLUMNS. A loan is overdue when it is approved
+    and its earliest pending repayment was due before today.
+    """
+    today = today or date.today()
+    loans = Loan.objects.all()
+    if user_name is not None:
+        # Looked up on its own, so that the user is an index condition of the walk of the user's loan index.
+        loans = loans.filter(user_id=Subquery(User.objects.filter(user_name=user_name).values('id')))
+    if status is not None:
+        loans = loans.filter(status=LoanStatus[status])
+    if created_from is not None:
+        loans = loans.filter(created_date__gte=created_from)
+    if created_to is not None:
+        loans = loans.filter(created_date__lte=created_to)
+    if min_amount is not None:
+        loans = loans.filter(amount__gte=min_amount)
+    if max_amount is not None:
+        loans = loans.filter(amount__lte=max_amount)
+    if overdue is True:
+        loans = loans.filter(status=LoanStatus.APPROVED, next_due_date__lt=today)
+    elif overdue is False and status == LoanStatus.APPROVED.name:
+        # A range on the next due date, which bounds the walk of the approved loans by next due date.
+        loans = loans.filter(Q(next_due_date__gte=today) | Q(next_due_date__isnull=True))
+    elif overdue is False:
+        loans = loans.exclude(status=LoanStatus.APPROVED, next_due_date__lt=today)
+    return loans.annotate(user_name=F('user__user_name'), raw_status=RAW_STATUS).values(*SEARCH_COLUMNS)
+
+
+def serialize_search_results(rows, today=None):
+    """Returns the rows of search_loans() as the loans listed by GET /admin/loans."""
+    today = today or date.today()
+    return [
+        {
+            'id': row['id'],
+            'user_name': row['user_name'],
+            'amount': row['amount'],
+            'terms': row['terms'],
+            'status': LOAN_STATUS_NAMES[row['raw_status']],
+            'created_date': row['created_date'].isoformat(),
+            'amount_paid': row['amount_paid'],
+            'outstanding_balance': row['outstanding_balance'],
+            'next_due_date': row['next_due_date'].isoformat() if row['next_due_date'] else None,
+            'overdue': row['raw_status'] == LoanStatus.APPROVED.value and row['next_due_date'] is not None and
+            row['next_due_date'] < today,
+        }
+        for row in rows
+    ]
+
+
+class LoanSearchPagination(LoanKeysetPagination):
+    """
+    Paginates the search results on (ordering column, id), ascending or descending, with a cursor holding the values
+    of the last loan of the page. Given archived loans too, as rows holding the ordering column, a page of them is read
+    the same way and merged in.
+    """
+    def __init__(self, request, ordering):
+        super().__init__(request)
+        self.descending = ordering.startswith('-')
+        self.field = ordering.lstrip('-')
+
+    def encode_cursor(self, row):
+        value = row[self.field]
+        value = value.isoformat() if isinstance(value, date) else value
+        return base64.urlsafe_b64encode(json.dumps([value, row['id']]).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            value, loan_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            value = int(value) if self.field == 'amount' else date.fromisoformat(value)
+            return value, int(loan_id)
+        except (binascii.Error, UnicodeError, ValueError, TypeError):
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+
+    def paginate_queryset(self, queryset, archived=None):
+        lookup = 'lt' if self.descending else 'gt'
+        cursor = self.request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, loan_id = self.decode_cursor(cursor)
+            after_cursor = (Q(**{'{}__{}'.format(self.field, lookup): value}) |
+                            Q(**{self.field: value, 'id__{}'.format(lookup): loan_id}))
+            queryset = queryset.filter(after_cursor)
+            if archived is not None:
+                archived = archived.filter(after_cursor)
+        if self.field == 'next_due_date':
+            queryset = queryset.filter(next_due_date__isnull=False)
+            # Archived loans are paid, so they have no next due date.
+            archived = None
+
+        prefix = '-' if self.descending else ''
+        ordering = (prefix + self.field, prefix + 'id')
+        loans = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        if archived is not None:
+            archived = list(archived.order_by(*ordering)[:self.page_size + 1])
+            loans = list(heapq.merge(loans, archived, key=lambda row: (row[self.field], row['id']),
+                                     reverse=self.descending))[:self.page_size + 1]
+        if len(loans) > self.page_size:
+            loans = loans[:self.page_size]
+            self.next_cursor = self.encode_cursor(loans[-1])
+        return loans
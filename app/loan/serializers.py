@@ -1,29 +1,83 @@
+from django.conf import settings
 from rest_framework import serializers
 
+from core.instrumentation import TimedListSerializer, TimedSerializerMixin
 from core.models import (
     User,
     Loan,
     Repayment,
     RepaymentStatus,
-    LoanStatus
+    LoanStatus,
+    LoanSummary
 )
+from .search import SEARCH_ORDERINGS, unserved_filters_error
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('user_name',)
 
 
-class LoanSerializer(serializers.Serializer):
-    amount = serializers.IntegerField()
-    terms = serializers.IntegerField()
+class LoanSerializer(TimedSerializerMixin, serializers.Serializer):
+    amount = serializers.IntegerField(min_value=1)
+    terms = serializers.IntegerField(min_value=1, max_value=settings.LOAN_MAX_TERMS)
+
+
+IMPORT_FORMATS = ('jsonl', 'csv')
+
+
+class LoanImportSerializer(LoanSerializer):
+    user_name = serializers.CharField(max_length=50)
+    created_date = serializers.DateField(required=False)
 
 
-class RepaymentSerializer(serializers.Serializer):
+class LoanImportRequestSerializer(TimedSerializerMixin, serializers.Serializer):
+    file = serializers.FileField()
+    name = serializers.CharField(max_length=255, required=False)
+    format = serializers.ChoiceField(choices=IMPORT_FORMATS, required=False)
+
+
+class RepaymentSerializer(TimedSerializerMixin, serializers.Serializer):
     amount = serializers.IntegerField()
 
 
+class LoanFilterSerializer(serializers.Serializer):
+    user_name = serializers.CharField(required=False)
+    created_from = serializers.DateField(required=False)
+    created_to = serializers.DateField(required=False)
+    min_amount = serializers.IntegerField(required=False)
+    max_amount = serializers.IntegerField(required=False)
+
+
+class LoanSearchSerializer(LoanFilterSerializer):
+    status = serializers.ChoiceField(choices=[loan_status.name for loan_status in LoanStatus], required=False)
+    overdue = serializers.BooleanField(allow_null=True, default=None)
+    ordering = serializers.ChoiceField(choices=[prefix + field for field in SEARCH_ORDERINGS for prefix in ('', '-')],
+                                       default='created_date')
+
+    def validate(self, attrs):
+        if attrs['ordering'].lstrip('-') == 'next_due_date' and attrs.get('status') != LoanStatus.APPROVED.name \
+                and not attrs['overdue']:
+            raise serializers.ValidationError('Ordering by next_due_date requires status=APPROVED or overdue=true.')
+        error = unserved_filters_error(attrs['ordering'], {
+            name: value for name, value in attrs.items() if name != 'ordering'})
+        if error:
+            raise serializers.ValidationError(error)
+        return attrs
+
+
+class BulkApprovalSerializer(TimedSerializerMixin, serializers.Serializer):
+    loan_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False,
+                                     max_length=settings.LOAN_APPROVAL_BATCH_LIMIT)
+    filter = LoanFilterSerializer(required=False)
+
+    def validate(self, attrs):
+        if ('loan_ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError('Provide either loan_ids or filter.')
+        return attrs
+
+
 class RepaymentListSerializer(serializers.ModelSerializer):
     status = serializers.SerializerMethodField()
 
@@ -35,7 +89,7 @@ class RepaymentListSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount', 'status', 'due_date')
 
 
-class LoanListSerializer(serializers.ModelSerializer):
+class LoanListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     status = serializers.SerializerMethodField()
     repayments = RepaymentListSerializer(many=True, read_only=True)
 
@@ -45,3 +99,11 @@ class LoanListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Loan
         fields = ('id', 'amount', 'terms', 'repayments', 'status')
+        list_serializer_class = TimedListSerializer
+
+
+class LoanSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = LoanSummary
+        fields = ('loans', 'pending_loans', 'active_loans', 'paid_loans', 'total_borrowed', 'total_paid',
+                  'outstanding_balance', 'next_due_date')
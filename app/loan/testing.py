@@ -0,0 +1,76 @@
+"""
+Test helpers for the loan APIs.
+"""
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+from rest_framework.test import APIClient
+
+from core.auth_cache import user_cache
+
+# Maximum number of database queries that a single request to an endpoint is allowed to run, keyed by the
+# (view name, HTTP method) of the endpoint. The budgets must not depend on the amount of data being returned.
+QUERY_BUDGETS = {
+    ('api:user', 'POST'): 2,
+    ('api:loan', 'GET'): 3,
+    ('api:loan', 'POST'): 6,
+    ('api:loan-summary', 'GET'): 3,
+    ('api:approval', 'PUT'): 3,
+    ('api:bulk-approval', 'PUT'): 4,
+    ('api:admin-loans', 'GET'): 2,
+    ('api:admin-analytics', 'GET'): 4,
+    ('api:repayment', 'PUT'): 8,
+}
+
+# Additional queries allowed for a request made with an Idempotency-Key header: claiming the key and storing the
+# response, or reading the stored response, and the savepoint the request runs in within a test.
+IDEMPOTENCY_KEY_QUERIES = 4
+
+# Additional query allowed for a loan listing request made with include_archived=true: reading the archived loans.
+ARCHIVED_LOAN_QUERIES = 1
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudgetAPIClient(APIClient):
+    """
+    An API client that fails the test whenever a request runs more database queries than the budget declared for
+    its endpoint in QUERY_BUDGETS.
+    """
+    def __init__(self, *args, query_budgets=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_budgets = QUERY_BUDGETS if query_budgets is None else query_budgets
+
+    def get_budget(self, path, method):
+        try:
+            return self.query_budgets.get((resolve(path).view_name, method))
+        except Resolver404:
+            return None
+
+    def request(self, **kwargs):
+        budget = self.get_budget(kwargs['PATH_INFO'], kwargs['REQUEST_METHOD'])
+        if budget is not None and 'HTTP_IDEMPOTENCY_KEY' in kwargs:
+            budget += IDEMPOTENCY_KEY_QUERIES
+        if budget is not None and 'include_archived=true' in kwargs.get('QUERY_STRING', ''):
+            budget += ARCHIVED_LOAN_QUERIES
+        with CaptureQueriesContext(connection) as queries:
+            response = super().request(**kwargs)
+
+        if budget is not None and len(queries) > budget:
+            raise QueryBudgetExceeded(
+                '{} {} ran {} queries, over its budget of {}:\n{}'.format(
+                    kwargs['REQUEST_METHOD'], kwargs['PATH_INFO'], len(queries), budget,
+                    '\n'.join(query['sql'] for query in queries.captured_queries)))
+        return response
+
+
+def reset_caches():
+    """
+    Clears the caches that outlive the per-test transaction rollback, such as cached users that no longer exist.
+    """
+    user_cache.clear()
+    for cache in caches.all():
+        cache.clear()
@@ -1,20 +1,51 @@
-from datetime import date
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.archive import archive_paid_loans
+from core.auth_cache import user_cache
+from core.partitions import archivable_partitions, archive_partitions, create_partitions
+from core.instrumentation import route_histograms
+from core.summaries import rebuild_summaries
 from core.models import (
+    ArchivedLoan,
+    IdempotencyKey,
     Loan,
+    LoanSummary,
     User,
     Repayment,
     LoanStatus,
     RepaymentStatus
 )
-from rest_framework.test import APIClient
 from rest_framework import status
 
+from . import async_views
+from .approval import approve_loans
+from .fast_serializers import FastJSONRenderer, loan_rows, serialize_loans
+from .pagination import ordered_repayments_prefetch
+from .serializers import LoanListSerializer
+from .rebalance import RebalanceResult, rebalance_pending_repayments
+from .schedule import create_loan_with_schedule
+from .search import LoanSearchPagination, search_loans
+from .testing import QueryBudgetAPIClient, QueryBudgetExceeded, reset_caches
+
 
 class UserAPITestCase(TestCase):
     def setUp(self):
-        self.client = APIClient()
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
 
     def test_create_user(self):
         response = self.client.post(reverse('api:user'), data={"user_name": "sample_user", "is_admin": False})
@@ -32,7 +63,8 @@ class UserAPITestCase(TestCase):
 
 class LoanAPITestCase(TestCase):
     def setUp(self):
-        self.client = APIClient()
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
         self.user_1 = User.objects.create(user_name='sample_user_1')
         self.user_2 = User.objects.create(user_name='sample_user_2')
         self.admin_user = User.objects.create(user_name='admin_user', is_admin=True)
@@ -73,6 +105,56 @@ class LoanAPITestCase(TestCase):
         self.assertEqual(response.data[0]['status'], 'PENDING')
         self.assertEqual(len(response.data[0]['repayments']), 2)
 
+    def test_get_loans_query_count_is_constant(self):
+        for i in range(20):
+            loan = Loan.objects.create(amount=300, terms=3, user=self.user_1)
+            for week in range(1, 4):
+                Repayment.objects.create(loan=loan, amount=100, due_date=date(2023, 7, 24 + week))
+
+        response = self.client.get(reverse('api:loan'), **self.request_header_1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 21)
+        self.assertTrue(all(len(loan['repayments']) == loan['terms'] for loan in response.data))
+
+    def test_get_loans_paginated(self):
+        loans = [self.loan_1]
+        for i in range(4):
+            loans.append(Loan.objects.create(amount=100 * (i + 2), terms=1, user=self.user_1))
+
+        loan_ids = []
+        url = reverse('api:loan') + '?page_size=2'
+        while url:
+            response = self.client.get(url, **self.request_header_1)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data), 2)
+            loan_ids.extend(loan['id'] for loan in response.data)
+            url = response.get('Link', '').partition('>')[0].lstrip('<')
+
+        self.assertEqual(loan_ids, [loan.id for loan in loans])
+
+    def test_get_loans_invalid_cursor(self):
+        response = self.client.get(reverse('api:loan') + '?cursor=invalid', **self.request_header_1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('api:loan') + '?page_size=0', **self.request_header_1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(LOAN_STREAM_CHUNK_SIZE=2)
+    def test_get_loans_streamed(self):
+        for i in range(4):
+            Loan.objects.create(amount=100, terms=1, user=self.user_1)
+
+        paginated = self.client.get(reverse('api:loan') + '?page_size=10', **self.request_header_1)
+        streamed = self.client.get(reverse('api:loan') + '?stream=true', **self.request_header_1)
+        self.assertEqual(streamed.status_code, status.HTTP_200_OK)
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(b''.join(streamed.streaming_content), paginated.content)
+
+    def test_query_budget_exceeded(self):
+        client = QueryBudgetAPIClient(query_budgets={('api:loan', 'GET'): 1})
+        with self.assertRaises(QueryBudgetExceeded):
+            client.get(reverse('api:loan'), **self.request_header_1)
+
     def test_create_loan(self):
         request_data = {
             "amount": 3000,
@@ -90,10 +172,40 @@ class LoanAPITestCase(TestCase):
         self.assertEqual(repayment.status, LoanStatus.PENDING)
         self.assertEqual(Repayment.objects.filter(loan_id=response.data['id']).count(), request_data['terms'])
 
+    def test_create_loan_schedule_adds_up_to_amount(self):
+        response = self.client.post(reverse('api:loan'), data={"amount": 100, "terms": 3}, **self.request_header_1)
+        repayments = Repayment.objects.filter(loan_id=response.data['id']).order_by('due_date')
+        self.assertEqual([repayment.amount for repayment in repayments], [34, 33, 33])
+
+        loan = Loan.objects.get(id=response.data['id'])
+        self.assertEqual([(repayment.due_date - loan.created_date).days for repayment in repayments], [7, 14, 21])
+
+    def test_create_loan_query_count_is_constant(self):
+        # Warm up the authentication cache, so that only the first request does not pay for the user lookup.
+        self.client.get(reverse('api:loan'), **self.request_header_1)
+
+        query_counts = []
+        for terms in (1, 52, 104):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('api:loan'), data={"amount": 10000, "terms": terms},
+                                            **self.request_header_1)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(Repayment.objects.filter(loan_id=response.data['id']).count(), terms)
+            query_counts.append(len(queries))
+
+        self.assertEqual(len(set(query_counts)), 1, query_counts)
+
     def test_create_loan_bad_request(self):
-        response = self.client.post(reverse('api:loan'), data={"amount": 3000, "number_of_terms": 3}, **self.request_header_1)
+        response = self.client.post(reverse('api:loan'), data={"amount": 3000, "number_of_terms": 3},
+                                    **self.request_header_1)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_loan_too_many_terms(self):
+        response = self.client.post(reverse('api:loan'), data={"amount": 3000, "terms": settings.LOAN_MAX_TERMS + 1},
+                                    **self.request_header_1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Loan.objects.filter(user=self.user_1).count(), 1)
+
     def test_create_loan_unauthorized(self):
         response = self.client.post(reverse('api:loan'), data={"amount": 3000, "terms": 3})
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -110,10 +222,59 @@ class LoanAPITestCase(TestCase):
         response = self.client.put('/approval/5', **self.admin_request_header)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_approve_paid_loan(self):
+        self.loan_1.status = LoanStatus.PAID
+        self.loan_1.save(update_fields=['status'])
+        response = self.client.put('/approval/{}'.format(self.loan_1.id), **self.admin_request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.loan_1.refresh_from_db()
+        self.assertEqual(self.loan_1.status, LoanStatus.PAID)
+
+    def test_bulk_approve_loans(self):
+        self.client.put('/approval/{}'.format(self.loan_2.id), **self.admin_request_header)
+        missing_id = self.loan_2.id + 100
+        response = self.client.put(reverse('api:bulk-approval'),
+                                   data={'loan_ids': [self.loan_1.id, self.loan_2.id, missing_id]},
+                                   format='json', **self.admin_request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['approved'], 1)
+        self.assertEqual(response.data['results'], {
+            self.loan_1.id: 'approved', self.loan_2.id: 'already_approved', missing_id: 'not_found'})
+        self.loan_1.refresh_from_db()
+        self.assertEqual(self.loan_1.status, LoanStatus.APPROVED)
+
+    def test_bulk_approve_loans_by_filter(self):
+        loan_3 = Loan.objects.create(amount=5000, terms=2, user=self.user_1)
+        response = self.client.put(reverse('api:bulk-approval'),
+                                   data={'filter': {'user_name': 'sample_user_1', 'max_amount': 1000}},
+                                   format='json', **self.admin_request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], {self.loan_1.id: 'approved'})
+        loan_3.refresh_from_db()
+        self.assertEqual(loan_3.status, LoanStatus.PENDING)
+        self.loan_2.refresh_from_db()
+        self.assertEqual(self.loan_2.status, LoanStatus.PENDING)
+
+    @override_settings(LOAN_APPROVAL_BATCH_LIMIT=1)
+    def test_bulk_approve_loans_over_limit(self):
+        response = self.client.put(reverse('api:bulk-approval'), data={'filter': {}}, format='json',
+                                   **self.admin_request_header)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Loan.objects.filter(status=LoanStatus.APPROVED).count(), 0)
+
+    def test_bulk_approve_loans_bad_request(self):
+        response = self.client.put(reverse('api:bulk-approval'), data={}, format='json', **self.admin_request_header)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.put(reverse('api:bulk-approval'), data={'loan_ids': [self.loan_1.id]}, format='json',
+                                   **self.request_header_1)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
 
 class RepaymentAPITestCase(TestCase):
     def setUp(self):
-        self.client = APIClient()
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
         self.user = User.objects.create(user_name='sample_user')
         self.admin_user = User.objects.create(user_name='admin_user', is_admin=True)
         self.request_header = {'HTTP_USERNAME': 'sample_user'}
@@ -217,6 +378,46 @@ class RepaymentAPITestCase(TestCase):
         loan.refresh_from_db()
         self.assertEqual(loan.status, LoanStatus.PAID)
 
+    def test_repay_loan_updates_counters(self):
+        response = self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, **self.request_header)
+        loan = Loan.objects.get(id=response.data['id'])
+        repayments = list(Repayment.objects.filter(loan=loan).order_by('due_date'))
+        self.assertEqual((loan.amount_paid, loan.outstanding_balance, loan.pending_repayments, loan.next_due_date),
+                         (0, 300, 3, repayments[0].due_date))
+        self.client.put('/approval/{}'.format(loan.id), **self.admin_request_header)
+
+        self.client.put('/repayment/{}/{}'.format(loan.id, repayments[0].id), data={'amount': 120},
+                        **self.request_header)
+        loan.refresh_from_db()
+        self.assertEqual((loan.amount_paid, loan.outstanding_balance, loan.pending_repayments, loan.next_due_date),
+                         (120, 180, 2, repayments[1].due_date))
+
+        for repayment in repayments[1:]:
+            self.client.put('/repayment/{}/{}'.format(loan.id, repayment.id), data={'amount': 90},
+                            **self.request_header)
+        loan.refresh_from_db()
+        self.assertEqual((loan.amount_paid, loan.outstanding_balance, loan.pending_repayments, loan.next_due_date),
+                         (300, 0, 0, None))
+        self.assertEqual(loan.status, LoanStatus.PAID)
+
+    def test_repay_paid_repayment_conflict(self):
+        # Paid repayments are due before the next due date of the loan, so they are not found from it on.
+        response = self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, **self.request_header)
+        loan = Loan.objects.get(id=response.data['id'])
+        repayments = list(Repayment.objects.filter(loan=loan).order_by('due_date'))
+        self.client.put('/approval/{}'.format(loan.id), **self.admin_request_header)
+
+        response = self.client.put('/repayment/{}/{}'.format(loan.id, repayments[0].id), data={'amount': 100},
+                                   **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put('/repayment/{}/{}'.format(loan.id, repayments[0].id), data={'amount': 100},
+                                   **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.client.put('/repayment/{}/{}'.format(loan.id, repayments[0].id + 1000), data={'amount': 100},
+                                   **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_repay_loan_insufficient_amount_error(self):
         # Create the Loan
         response = self.client.post(reverse('api:loan'), data={"amount": 3000, "terms": 2}, **self.request_header)
@@ -265,3 +466,718 @@ class RepaymentAPITestCase(TestCase):
 
 
 
+
+
+class IdempotencyKeyAPITestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
+        self.user = User.objects.create(user_name='sample_user')
+        User.objects.create(user_name='other_user')
+        # The query budgets assume the users are cached, as they are once they have made a request.
+        user_cache.get('sample_user')
+        self.request_header = {'HTTP_USERNAME': 'sample_user', 'HTTP_IDEMPOTENCY_KEY': 'key-1'}
+
+    def test_create_loan_replayed(self):
+        response = self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+        with CaptureQueriesContext(connection) as queries:
+            replayed = self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, **self.request_header)
+        self.assertEqual(replayed.status_code, status.HTTP_200_OK)
+        self.assertEqual(replayed.data, response.data)
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if Loan._meta.db_table in query['sql'] or Repayment._meta.db_table in query['sql']])
+        self.assertEqual(Loan.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Repayment.objects.filter(loan__user=self.user).count(), 3)
+
+    def test_key_reused_for_different_request(self):
+        self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, **self.request_header)
+        response = self.client.post(reverse('api:loan'), data={"amount": 500, "terms": 3}, **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Loan.objects.filter(user=self.user).count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, **self.request_header)
+        response = self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3},
+                                    HTTP_USERNAME='other_user', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Loan.objects.count(), 2)
+
+    def test_expired_key_is_reclaimed(self):
+        first = self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, **self.request_header)
+        IdempotencyKey.objects.update(created_at=F('created_at') - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL + 1))
+
+        second = self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, **self.request_header)
+        self.assertNotEqual(second.data['id'], first.data['id'])
+        self.assertEqual(IdempotencyKey.objects.get().response, {'id': second.data['id']})
+
+    def test_client_errors_replayed(self):
+        response = self.client.post(reverse('api:loan'), data={"amount": 0, "terms": 3}, **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        replayed = self.client.post(reverse('api:loan'), data={"amount": 0, "terms": 3}, **self.request_header)
+        self.assertEqual(replayed.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(replayed.data, response.data)
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+
+    def test_invalid_key(self):
+        response = self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3},
+                                    HTTP_USERNAME='sample_user', HTTP_IDEMPOTENCY_KEY='k' * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Loan.objects.exists())
+
+    def test_repayment_replayed(self):
+        loan = create_loan_with_schedule(self.user, 300, 3)
+        approve_loans([loan.id])
+        repayment = Repayment.objects.filter(loan=loan).order_by('due_date').first()
+        url = '/repayment/{}/{}'.format(loan.id, repayment.id)
+
+        for _ in range(2):
+            response = self.client.put(url, data={'amount': 150}, **self.request_header)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+        loan.refresh_from_db()
+        self.assertEqual((loan.amount_paid, loan.outstanding_balance), (150, 150))
+
+
+class AdminLoanSearchAPITestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
+        self.user_1 = User.objects.create(user_name='sample_user_1')
+        self.user_2 = User.objects.create(user_name='sample_user_2')
+        User.objects.create(user_name='admin_user', is_admin=True)
+        self.admin_request_header = {'HTTP_USERNAME': 'admin_user'}
+        today = date.today()
+        self.pending = Loan.objects.create(user=self.user_1, amount=300, terms=3, created_date=date(2023, 7, 1),
+                                           next_due_date=date(2023, 7, 8))
+        self.overdue = Loan.objects.create(user=self.user_1, amount=500, terms=5, created_date=date(2023, 7, 2),
+                                           status=LoanStatus.APPROVED, next_due_date=today - timedelta(days=1))
+        self.current = Loan.objects.create(user=self.user_2, amount=200, terms=2, created_date=date(2023, 7, 3),
+                                           status=LoanStatus.APPROVED, next_due_date=today + timedelta(days=7))
+        self.paid = Loan.objects.create(user=self.user_2, amount=400, terms=4, created_date=date(2023, 7, 4),
+                                        status=LoanStatus.PAID)
+
+    def search(self, **params):
+        response = self.client.get(reverse('api:admin-loans'), params, **self.admin_request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return [loan['id'] for loan in json.loads(response.content)]
+
+    def test_search_unauthorized(self):
+        response = self.client.get(reverse('api:admin-loans'), HTTP_USERNAME='sample_user_1')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_search_all(self):
+        response = self.client.get(reverse('api:admin-loans'), **self.admin_request_header)
+        loans = json.loads(response.content)
+        self.assertEqual([loan['id'] for loan in loans],
+                         [self.pending.id, self.overdue.id, self.current.id, self.paid.id])
+        self.assertEqual(loans[1], {
+            'id': self.overdue.id, 'user_name': 'sample_user_1', 'amount': 500, 'terms': 5, 'status': 'APPROVED',
+            'created_date': '2023-07-02', 'amount_paid': 0, 'outstanding_balance': 0,
+            'next_due_date': self.overdue.next_due_date.isoformat(), 'overdue': True,
+        })
+
+    def test_search_filters(self):
+        self.assertEqual(self.search(status='APPROVED'), [self.overdue.id, self.current.id])
+        self.assertEqual(self.search(user_name='sample_user_2'), [self.current.id, self.paid.id])
+        self.assertEqual(self.search(user_name='sample_user_unknown'), [])
+        self.assertEqual(self.search(min_amount=300, max_amount=400, ordering='amount'),
+                         [self.pending.id, self.paid.id])
+        self.assertEqual(self.search(created_from='2023-07-02', created_to='2023-07-03'),
+                         [self.overdue.id, self.current.id])
+        self.assertEqual(self.search(user_name='sample_user_1', created_from='2023-07-02'), [self.overdue.id])
+        self.assertEqual(self.search(overdue='true', ordering='next_due_date'), [self.overdue.id])
+        self.assertEqual(self.search(overdue='false'), [self.pending.id, self.current.id, self.paid.id])
+        self.assertEqual(self.search(status='APPROVED', overdue='false', ordering='next_due_date'), [self.current.id])
+
+    def test_search_ordering(self):
+        self.assertEqual(self.search(ordering='-created_date'),
+                         [self.paid.id, self.current.id, self.overdue.id, self.pending.id])
+        self.assertEqual(self.search(ordering='amount'),
+                         [self.current.id, self.pending.id, self.paid.id, self.overdue.id])
+        self.assertEqual(self.search(status='APPROVED', ordering='next_due_date'), [self.overdue.id, self.current.id])
+
+        response = self.client.get(reverse('api:admin-loans'), {'ordering': 'next_due_date'},
+                                   **self.admin_request_header)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_paginated(self):
+        for ordering in ('created_date', '-amount', 'next_due_date'):
+            params = {'ordering': ordering, 'page_size': 1}
+            if ordering == 'next_due_date':
+                params['status'] = 'APPROVED'
+            expected = self.search(**dict(params, page_size=10))
+            loan_ids, url = [], reverse('api:admin-loans')
+            while url:
+                response = self.client.get(url, params, **self.admin_request_header)
+                loan_ids.extend(loan['id'] for loan in json.loads(response.content))
+                url = response['Link'][1:response['Link'].index('>')] if 'Link' in response else None
+                params = {}
+            self.assertEqual(loan_ids, expected)
+
+    def test_search_bad_request(self):
+        for params in ({'status': 'UNKNOWN'}, {'ordering': 'terms'}, {'cursor': 'invalid'}, {'min_amount': 'x'}):
+            response = self.client.get(reverse('api:admin-loans'), params, **self.admin_request_header)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_search_pagination_merges_archived_loans(self):
+        """Test that the archived loans given to the search pagination are paged through along with the loans."""
+        list(archive_paid_loans(date(2024, 1, 1)))
+        self.assertFalse(Loan.objects.filter(id=self.paid.id).exists())
+        loan_ids, cursor = [], None
+        while True:
+            params = {'page_size': 2, 'cursor': cursor} if cursor else {'page_size': 2}
+            pagination = LoanSearchPagination(Request(APIRequestFactory().get('/admin/loans', params)), '-amount')
+            loan_ids.extend(row['id'] for row in pagination.paginate_queryset(
+                search_loans(), ArchivedLoan.objects.values('id', 'amount')))
+            cursor = pagination.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(loan_ids, [self.overdue.id, self.paid.id, self.pending.id, self.current.id])
+
+    def test_search_unserved_filters(self):
+        """Test that the filters no index walked in the ordering asked for serves are rejected."""
+        for params in ({'min_amount': 300}, {'created_from': '2023-07-02', 'ordering': 'amount'},
+                       {'user_name': 'sample_user_1', 'status': 'PENDING'},
+                       {'user_name': 'sample_user_1', 'ordering': '-amount'}, {'overdue': 'true'},
+                       {'status': 'APPROVED', 'min_amount': 300, 'ordering': 'next_due_date'}):
+            response = self.client.get(reverse('api:admin-loans'), params, **self.admin_request_header)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+
+class PortfolioAnalyticsAPITestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
+        self.user = User.objects.create(user_name='sample_user')
+        User.objects.create(user_name='admin_user', is_admin=True)
+        self.admin_request_header = {'HTTP_USERNAME': 'admin_user'}
+        today = date.today()
+        self.monday = today - timedelta(days=today.weekday())
+        created = self.monday - timedelta(weeks=5)
+
+        approved = Loan.objects.create(user=self.user, amount=400, terms=4, created_date=created,
+                                       status=LoanStatus.APPROVED, amount_paid=200, outstanding_balance=200)
+        for week in range(1, 5):
+            Repayment.objects.create(loan=approved, amount=100, due_date=created + timedelta(weeks=week),
+                                     status=RepaymentStatus.PAID if week <= 2 else RepaymentStatus.PENDING)
+        paid = Loan.objects.create(user=self.user, amount=100, terms=1, created_date=created, status=LoanStatus.PAID,
+                                   amount_paid=100)
+        Repayment.objects.create(loan=paid, amount=100, due_date=created + timedelta(weeks=1),
+                                 status=RepaymentStatus.PAID)
+        create_loan_with_schedule(self.user, 200, 2)
+
+    def get_analytics(self):
+        response = self.client.get(reverse('api:admin-analytics'), **self.admin_request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_analytics_unauthorized(self):
+        response = self.client.get(reverse('api:admin-analytics'), HTTP_USERNAME='sample_user')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_analytics(self):
+        analytics = self.get_analytics()
+        self.assertEqual(analytics['outstanding_by_status'], [
+            {'status': 'PENDING', 'loans': 1, 'principal': 200, 'amount_paid': 0, 'outstanding_principal': 200},
+            {'status': 'APPROVED', 'loans': 1, 'principal': 400, 'amount_paid': 200, 'outstanding_principal': 200},
+            {'status': 'PAID', 'loans': 1, 'principal': 100, 'amount_paid': 100, 'outstanding_principal': 0},
+        ])
+        self.assertEqual(analytics['repayment_curves'], [{
+            'origination_week': (self.monday - timedelta(weeks=5)).isoformat(),
+            'weeks': [
+                {'week': 1, 'due_amount': 200, 'paid_amount': 200, 'cumulative_repayment_rate': 1.0},
+                {'week': 2, 'due_amount': 100, 'paid_amount': 100, 'cumulative_repayment_rate': 1.0},
+                {'week': 3, 'due_amount': 100, 'paid_amount': 0, 'cumulative_repayment_rate': 0.75},
+                {'week': 4, 'due_amount': 100, 'paid_amount': 0, 'cumulative_repayment_rate': 0.6},
+            ],
+        }])
+        self.assertEqual(analytics['cash_flow'], [
+            {'due_week': (self.monday - timedelta(weeks=2)).isoformat(), 'repayments': 1, 'amount': 100,
+             'overdue_amount': 100},
+            {'due_week': (self.monday - timedelta(weeks=1)).isoformat(), 'repayments': 1, 'amount': 100,
+             'overdue_amount': 100},
+        ])
+
+    def test_analytics_cached_until_write(self):
+        analytics = self.get_analytics()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_analytics(), analytics)
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if Loan._meta.db_table in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('api:loan'), data={"amount": 300, "terms": 3}, HTTP_USERNAME='sample_user')
+        pending = self.get_analytics()['outstanding_by_status'][0]
+        self.assertEqual((pending['loans'], pending['principal']), (2, 500))
+
+
+class LoanSummaryAPITestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
+        self.user = User.objects.create(user_name='sample_user')
+        User.objects.create(user_name='admin_user', is_admin=True)
+        self.request_header = {'HTTP_USERNAME': 'sample_user'}
+        self.admin_request_header = {'HTTP_USERNAME': 'admin_user'}
+
+    def get_summary(self):
+        response = self.client.get(reverse('api:loan-summary'), **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_summary_unauthorized(self):
+        response = self.client.get(reverse('api:loan-summary'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_summary_without_loans(self):
+        summary = self.get_summary()
+        self.assertEqual((summary['loans'], summary['outstanding_balance'], summary['overdue_repayments']), (0, 0, 0))
+        self.assertIsNone(summary['next_due_date'])
+
+    def test_summary_follows_loans(self):
+        loan_ids = [self.client.post(reverse('api:loan'), data={'amount': amount, 'terms': 2},
+                                     **self.request_header).data['id'] for amount in (1000, 400)]
+        summary = self.get_summary()
+        self.assertEqual((summary['loans'], summary['pending_loans'], summary['active_loans']), (2, 2, 0))
+        self.assertEqual((summary['total_borrowed'], summary['outstanding_balance']), (1400, 1400))
+        self.assertIsNone(summary['next_due_date'])
+
+        self.client.put(reverse('api:approval', args=[loan_ids[1]]), **self.admin_request_header)
+        repayments = list(Repayment.objects.filter(loan_id=loan_ids[1]).order_by('due_date'))
+        summary = self.get_summary()
+        self.assertEqual((summary['pending_loans'], summary['active_loans']), (1, 1))
+        self.assertEqual(summary['next_due_date'], repayments[0].due_date.isoformat())
+
+        self.client.put(reverse('api:repayment', args=[loan_ids[1], repayments[0].id]), data={'amount': 250},
+                        **self.request_header)
+        summary = self.get_summary()
+        self.assertEqual((summary['total_paid'], summary['outstanding_balance']), (250, 1150))
+        self.assertEqual(summary['next_due_date'], repayments[1].due_date.isoformat())
+
+        self.client.put(reverse('api:repayment', args=[loan_ids[1], repayments[1].id]), data={'amount': 150},
+                        **self.request_header)
+        summary = self.get_summary()
+        self.assertEqual((summary['active_loans'], summary['paid_loans']), (0, 1))
+        self.assertEqual((summary['total_paid'], summary['outstanding_balance']), (400, 1000))
+        self.assertIsNone(summary['next_due_date'])
+
+    def test_summary_counts_overdue_repayments(self):
+        loan = create_loan_with_schedule(self.user, 300, 3)
+        Loan.objects.filter(id=loan.id).update(status=LoanStatus.APPROVED, next_due_date=date.today() - timedelta(7))
+        for days, repayment in zip((7, 1), Repayment.objects.filter(loan=loan).order_by('due_date')):
+            repayment.due_date = date.today() - timedelta(days)
+            repayment.save(update_fields=['due_date'])
+        rebuild_summaries([self.user.id])
+
+        summary = self.get_summary()
+        self.assertEqual((summary['active_loans'], summary['overdue_repayments']), (1, 2))
+
+
+class LoanArchiveAPITestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
+        self.user = User.objects.create(user_name='sample_user')
+        self.request_header = {'HTTP_USERNAME': 'sample_user'}
+        self.loans = []
+        for days, loan_status in ((0, LoanStatus.PAID), (1, LoanStatus.APPROVED), (2, LoanStatus.PAID),
+                                  (400, LoanStatus.PENDING)):
+            created = date(2023, 1, 2) + timedelta(days=days)
+            loan = Loan.objects.create(amount=200, terms=2, user=self.user, status=loan_status, created_date=created)
+            for week in (1, 2):
+                Repayment.objects.create(
+                    loan=loan, amount=100, due_date=created + timedelta(weeks=week),
+                    status=RepaymentStatus.PAID if loan_status == LoanStatus.PAID else RepaymentStatus.PENDING)
+            self.loans.append(loan)
+
+    def archive(self):
+        return sum(batch.archived for batch in archive_paid_loans(date(2024, 1, 1), batch_size=1))
+
+    def test_archived_loans_left_out(self):
+        self.assertEqual(self.archive(), 2)
+
+        response = self.client.get(reverse('api:loan'), **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([loan['id'] for loan in response.data], [self.loans[1].id, self.loans[3].id])
+        self.assertFalse(Repayment.objects.filter(loan_id__in=[self.loans[0].id, self.loans[2].id]).exists())
+
+    def test_include_archived(self):
+        expected = self.client.get(reverse('api:loan'), **self.request_header).content
+        self.archive()
+
+        response = self.client.get(reverse('api:loan') + '?include_archived=true', **self.request_header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected)
+
+        loan_ids = []
+        url = reverse('api:loan') + '?include_archived=true&page_size=1'
+        while url:
+            response = self.client.get(url, **self.request_header)
+            loan_ids.extend(loan['id'] for loan in response.data)
+            url = response.get('Link', '').partition('>')[0].lstrip('<')
+        self.assertEqual(loan_ids, [loan.id for loan in self.loans])
+
+    @override_settings(LOAN_STREAM_CHUNK_SIZE=1)
+    def test_include_archived_streamed(self):
+        expected = self.client.get(reverse('api:loan'), **self.request_header).content
+        self.archive()
+
+        streamed = self.client.get(reverse('api:loan') + '?include_archived=true&stream=true', **self.request_header)
+        self.assertEqual(b''.join(streamed.streaming_content), expected)
+
+    def test_listing_after_partition_archived(self):
+        user = User.objects.create(user_name='partition_user')
+        request_header = {'HTTP_USERNAME': 'partition_user'}
+        loan = Loan.objects.create(amount=200, terms=2, user=user, status=LoanStatus.PAID,
+                                   created_date=date(2022, 11, 1))
+        for day in (8, 15):
+            Repayment.objects.create(loan=loan, amount=100, due_date=date(2022, 11, day), status=RepaymentStatus.PAID)
+        expected = self.client.get(reverse('api:loan'), **request_header).content
+        create_partitions(date(2022, 11, 1), date(2022, 11, 1))
+
+        # The partition holds the repayments of a loan that is still listed, so it is kept until the loan is archived.
+        self.assertEqual(archivable_partitions(date(2022, 12, 1)), [])
+        self.archive()
+        partitions = archivable_partitions(date(2022, 12, 1))
+        self.assertEqual([partition.name for partition in partitions], ['core_repayment_p2022_11'])
+        archive_partitions(partitions)
+
+        response = self.client.get(reverse('api:loan') + '?include_archived=true', **request_header)
+        self.assertEqual(response.content, expected)
+
+    def test_summary_rebuilt_with_archived_loans(self):
+        self.archive()
+        rebuild_summaries([self.user.id])
+        summary = LoanSummary.objects.get(user=self.user)
+        self.assertEqual((summary.loans, summary.paid_loans, summary.total_borrowed), (4, 2, 800))
+
+
+class FastSerializersTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_name='sample_user')
+        for amount, terms, loan_status in ((100, 2, LoanStatus.PENDING), (1000, 3, LoanStatus.APPROVED),
+                                           (300, 1, LoanStatus.PAID)):
+            loan = Loan.objects.create(amount=amount, terms=terms, user=self.user, status=loan_status)
+            for term in range(terms):
+                Repayment.objects.create(
+                    loan=loan, amount=amount // terms, due_date=date(2023, 7, 31) + timedelta(weeks=terms - term),
+                    status=RepaymentStatus.PAID if loan_status == LoanStatus.PAID or term == 0 else
+                    RepaymentStatus.PENDING)
+        Loan.objects.create(amount=50, terms=1, user=self.user)
+
+    def test_same_output_as_serializers(self):
+        loans = Loan.objects.filter(user=self.user).order_by('created_date', 'id')
+        expected = JSONRenderer().render(
+            LoanListSerializer(loans.prefetch_related(ordered_repayments_prefetch()), many=True).data)
+        with self.assertNumQueries(2):
+            rendered = FastJSONRenderer().render(serialize_loans(list(loan_rows(loans))))
+        self.assertEqual(rendered, expected)
+
+    def test_renderer(self):
+        data = {'error': 'caf\u00e9 \u2028', 'items': [1, None, True], 'date': date(2023, 7, 31)}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+        self.assertEqual(serialize_loans([]), [])
+
+
+class RebalanceTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_name='sample_user')
+        self.loan = create_loan_with_schedule(self.user, 1000, 4)
+        self.other_loan = create_loan_with_schedule(self.user, 1000, 4)
+        self.repayments = list(Repayment.objects.filter(loan=self.loan).order_by('due_date'))
+
+    def pay(self, repayment, amount):
+        repayment.status = RepaymentStatus.PAID
+        repayment.amount = amount
+        repayment.save(update_fields=['status', 'amount'])
+
+    def pending_amounts(self, loan):
+        return list(Repayment.objects.filter(loan=loan, status=RepaymentStatus.PENDING)
+                    .order_by('due_date').values_list('amount', flat=True))
+
+    def test_rebalance_distributes_remainder(self):
+        self.pay(self.repayments[0], 300)
+        result = rebalance_pending_repayments(self.loan.id, 700)
+        self.assertEqual(self.pending_amounts(self.loan), [234, 233, 233])
+        self.assertEqual(result, RebalanceResult(pending=3, updated=3, next_due_date=self.repayments[1].due_date))
+
+    def test_rebalance_is_scoped_to_loan(self):
+        self.pay(self.repayments[0], 400)
+        with CaptureQueriesContext(connection) as queries:
+            rebalance_pending_repayments(self.loan.id, 600)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.pending_amounts(self.other_loan), [250, 250, 250, 250])
+
+    def test_rebalance_skips_unchanged_repayments(self):
+        self.pay(self.repayments[0], 250)
+        self.assertEqual(rebalance_pending_repayments(self.loan.id, 750),
+                         RebalanceResult(pending=3, updated=0, next_due_date=self.repayments[1].due_date))
+        self.assertEqual(self.pending_amounts(self.loan), [250, 250, 250])
+
+    def test_rebalance_overpaid_loan(self):
+        self.pay(self.repayments[0], 1200)
+        self.assertEqual(rebalance_pending_repayments(self.loan.id, -200),
+                         RebalanceResult(pending=3, updated=3, next_due_date=self.repayments[1].due_date))
+        self.assertEqual(self.pending_amounts(self.loan), [0, 0, 0])
+
+    def test_rebalance_without_pending_repayments(self):
+        for repayment in self.repayments:
+            self.pay(repayment, 250)
+        self.assertEqual(rebalance_pending_repayments(self.loan.id, 0),
+                         RebalanceResult(pending=0, updated=0, next_due_date=None))
+
+
+class RepaymentConcurrencyTestCase(TransactionTestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create(user_name='sample_user')
+        self.request_header = {'HTTP_USERNAME': 'sample_user'}
+        self.loan = create_loan_with_schedule(self.user, 1000, 4)
+        self.loan.status = LoanStatus.APPROVED
+        self.loan.save(update_fields=['status'])
+        self.repayment_ids = list(Repayment.objects.filter(loan=self.loan).order_by('due_date')
+                                  .values_list('id', flat=True))
+
+    def repay_in_parallel(self, repayments, idempotency_key=None):
+        """Fires the (repayment ID, amount) repayments at the loan at the same time, and returns the status codes."""
+        barrier = threading.Barrier(len(repayments))
+        status_codes = [None] * len(repayments)
+        headers = dict(self.request_header)
+        if idempotency_key:
+            headers['HTTP_IDEMPOTENCY_KEY'] = idempotency_key
+
+        def repay(i, repayment_id, amount):
+            try:
+                barrier.wait()
+                response = QueryBudgetAPIClient().put('/repayment/{}/{}'.format(self.loan.id, repayment_id),
+                                                      data={'amount': amount}, **headers)
+                status_codes[i] = response.status_code
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=repay, args=(i, repayment_id, amount))
+                   for i, (repayment_id, amount) in enumerate(repayments)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return status_codes
+
+    def test_parallel_repayments_keep_balance(self):
+        status_codes = self.repay_in_parallel([(repayment_id, 300) for repayment_id in self.repayment_ids[:3]])
+        self.assertEqual(status_codes, [status.HTTP_200_OK] * 3)
+
+        last_repayment = Repayment.objects.get(id=self.repayment_ids[3])
+        self.assertEqual(last_repayment.status, RepaymentStatus.PENDING)
+        self.assertEqual(last_repayment.amount, 100)
+
+        self.assertEqual(self.repay_in_parallel([(self.repayment_ids[3], 100)]), [status.HTTP_200_OK])
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.status, LoanStatus.PAID)
+
+    def test_parallel_repayments_of_same_repayment(self):
+        status_codes = self.repay_in_parallel([(self.repayment_ids[0], 400)] * 4)
+        self.assertEqual(sorted(status_codes), [status.HTTP_200_OK] + [status.HTTP_409_CONFLICT] * 3)
+        self.assertEqual(list(Repayment.objects.filter(loan=self.loan, status=RepaymentStatus.PENDING)
+                              .values_list('amount', flat=True)), [200, 200, 200])
+
+    def test_parallel_retries_with_idempotency_key(self):
+        status_codes = self.repay_in_parallel([(self.repayment_ids[0], 400)] * 4, idempotency_key='retry-1')
+        self.assertEqual(status_codes, [status.HTTP_200_OK] * 4)
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.amount_paid, 400)
+        self.assertEqual(list(Repayment.objects.filter(loan=self.loan, status=RepaymentStatus.PENDING)
+                              .values_list('amount', flat=True)), [200, 200, 200])
+
+
+class AsyncViewsTestCase(TransactionTestCase):
+    """The async views run their queries on other threads, so the test data must be committed."""
+    def setUp(self):
+        reset_caches()
+        self.factory = AsyncRequestFactory()
+        User.objects.create(user_name='sample_user')
+        User.objects.create(user_name='admin_user', is_admin=True)
+
+    @staticmethod
+    def content(response):
+        return json.loads(response.content)
+
+    async def test_loan_lifecycle(self):
+        response = await async_views.loan(self.factory.post(
+            '/loan', {'amount': 300, 'terms': 3}, content_type='application/json', username='sample_user'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        loan_id = self.content(response)['id']
+
+        response = await async_views.loan_approval(self.factory.put(
+            '/approval/{}'.format(loan_id), username='admin_user'), loan_id=loan_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = await async_views.loan(self.factory.get('/loan', username='sample_user'))
+        repayments = self.content(response)[0]['repayments']
+        self.assertEqual([repayment['amount'] for repayment in repayments], [100, 100, 100])
+
+        response = await async_views.repayment(self.factory.put(
+            '/repayment/{}/{}'.format(loan_id, repayments[0]['id']), {'amount': 150}, content_type='application/json',
+            username='sample_user'), loan_id=loan_id, repayment_id=repayments[0]['id'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = await async_views.loan(self.factory.get('/loan', username='sample_user'))
+        loan = self.content(response)[0]
+        self.assertEqual([repayment['amount'] for repayment in loan['repayments']], [150, 75, 75])
+
+    async def test_streamed_listing_rejected(self):
+        response = await async_views.loan(self.factory.get('/loan?stream=true', username='sample_user'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Link header', self.content(response)['error'])
+
+    async def test_concurrent_requests(self):
+        await async_views.loan(self.factory.post(
+            '/loan', {'amount': 100, 'terms': 2}, content_type='application/json', username='sample_user'))
+        responses = await asyncio.gather(*[
+            async_views.loan(self.factory.get('/loan', username='sample_user')) for _ in range(10)])
+        self.assertEqual({response.status_code for response in responses}, {status.HTTP_200_OK})
+
+        response = await async_views.loan(self.factory.get('/loan', username='unknown_user'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class LoanImportAPITestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
+        User.objects.create(user_name='sample_user', is_admin=False)
+        User.objects.create(user_name='admin_user', is_admin=True)
+
+    @staticmethod
+    def upload(name, content):
+        return SimpleUploadedFile(name, content.encode())
+
+    @override_settings(LOAN_IMPORT_ERROR_LIMIT=1)
+    def test_import_loans(self):
+        content = '{"user_name": "sample_user", "amount": 1000, "terms": 4}\n{"amount": 10}\n{"terms": 0}\n'
+        response = self.client.post(reverse('api:import'), data={'file': self.upload('loans.jsonl', content)},
+                                    format='multipart', HTTP_USERNAME='admin_user')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['imported'], response.data['failed']), (1, 2))
+        self.assertEqual([error['line'] for error in response.data['errors']], [2])
+        loan = Loan.objects.get()
+        self.assertEqual(loan.user.user_name, 'sample_user')
+        self.assertEqual(loan.repayments.count(), 4)
+        self.assertFalse(loan.repayments.filter(overdue=True).exists())
+
+    def test_import_loans_resumes(self):
+        content = 'user_name,amount,terms\nsample_user,1000,4\n'
+        self.client.post(reverse('api:import'), data={'file': self.upload('loans.csv', content), 'name': 'book'},
+                         format='multipart', HTTP_USERNAME='admin_user')
+        content += 'sample_user,500,2\n'
+        response = self.client.post(reverse('api:import'),
+                                    data={'file': self.upload('loans.csv', content), 'name': 'book'},
+                                    format='multipart', HTTP_USERNAME='admin_user')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['last_line'], response.data['imported']), (3, 2))
+        self.assertEqual(Loan.objects.count(), 2)
+        self.assertEqual(Repayment.objects.count(), 6)
+
+    def test_import_loans_bad_request(self):
+        response = self.client.post(reverse('api:import'), data={}, format='multipart', HTTP_USERNAME='admin_user')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(reverse('api:import'), data={'file': self.upload('loans.csv', 'user_name\n')},
+                                    format='multipart', HTTP_USERNAME='sample_user')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        route_histograms.clear()
+        self.client = QueryBudgetAPIClient()
+        self.user = User.objects.create(user_name='sample_user', is_admin=False)
+        User.objects.create(user_name='admin_user', is_admin=True)
+        create_loan_with_schedule(self.user, 1000, 2)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('api:loan'), HTTP_USERNAME='sample_user')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timings = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'total', 'db', 'auth', 'serializer'})
+        self.assertIn('desc="3 queries"', timings['db'])
+
+        histograms = route_histograms.snapshot()['api:loan']
+        self.assertEqual(set(histograms), {'total', 'db', 'auth', 'serializer'})
+        self.assertEqual(histograms['total']['count'], 1)
+        self.assertEqual(histograms['total']['buckets']['+Inf'], 1)
+
+    @override_settings(REQUEST_METRICS={'SAMPLE_RATE': 0, 'SERVER_TIMING': True, 'BUCKETS': (1, 10)})
+    def test_unsampled_request(self):
+        response = self.client.get(reverse('api:loan'), HTTP_USERNAME='sample_user')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(route_histograms.snapshot(), {})
+
+    def test_request_performance(self):
+        self.client.get(reverse('api:loan'), HTTP_USERNAME='sample_user')
+        response = self.client.get(reverse('api:performance'), HTTP_USERNAME='admin_user')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['api:loan']['total']['count'], 1)
+
+        response = self.client.get(reverse('api:performance'), HTTP_USERNAME='sample_user')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.client = QueryBudgetAPIClient()
+        User.objects.create(user_name='sample_user', is_admin=False)
+        User.objects.create(user_name='admin_user', is_admin=True)
+
+    @staticmethod
+    def sample(name, labels=None):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_domain_counters(self):
+        names = ('loans_created_total', 'loans_approved_total', 'repayments_processed_total',
+                 'repayment_rebalances_total', 'loans_paid_total')
+        before = {name: self.sample(name) for name in names}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('api:loan'), data={'amount': 200, 'terms': 2},
+                                        HTTP_USERNAME='sample_user')
+        loan_id = response.data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse('api:approval', args=[loan_id]), HTTP_USERNAME='admin_user')
+            self.client.put(reverse('api:approval', args=[loan_id]), HTTP_USERNAME='admin_user')
+        for repayment in Repayment.objects.filter(loan_id=loan_id).order_by('due_date'):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.put(reverse('api:repayment', args=[loan_id, repayment.id]),
+                                           data={'amount': 100}, HTTP_USERNAME='sample_user')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        increments = {name: self.sample(name) - before[name] for name in names}
+        self.assertEqual(increments, {
+            'loans_created_total': 1,
+            'loans_approved_total': 1,
+            'repayments_processed_total': 2,
+            'repayment_rebalances_total': 2,
+            'loans_paid_total': 1,
+        })
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('api:loan'), HTTP_USERNAME='sample_user')
+        self.client.get(reverse('api:loan'), HTTP_USERNAME='sample_user')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="api:loan"}', content)
+        self.assertIn('auth_user_cache_lookups_total{result="local_hit"}', content)
+        self.assertIn('loans_created_total', content)
+        self.assertIn('db_connections{database="default",state="active"}', content)
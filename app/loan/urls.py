@@ -1,16 +1,28 @@
 """
 URL mappings for the loan APIs.
 """
+from django.conf import settings
 from django.urls import path
-from .views import loan_approval
 
-from loan import views
+from loan import async_views, views
+
+if settings.ASYNC_VIEWS:
+    loan_view, repayment_view, loan_approval = async_views.loan, async_views.repayment, async_views.loan_approval
+else:
+    loan_view, repayment_view, loan_approval = (views.LoanView.as_view(), views.RepaymentView.as_view(),
+                                                views.loan_approval)
 
 app_name = 'api'
 
 urlpatterns = [
     path('user', views.UserView.as_view(), name='user'),
-    path('loan', views.LoanView.as_view(), name='loan'),
-    path('approval/<int:loan_id>', loan_approval),
-    path('repayment/<int:loan_id>/<int:repayment_id>',  views.RepaymentView.as_view(), name='repayment'),
+    path('loan', loan_view, name='loan'),
+    path('loan/summary', views.loan_summary, name='loan-summary'),
+    path('approval', views.bulk_loan_approval, name='bulk-approval'),
+    path('approval/<int:loan_id>', loan_approval, name='approval'),
+    path('import', views.loan_import, name='import'),
+    path('admin/loans', views.admin_loans, name='admin-loans'),
+    path('admin/analytics', views.portfolio_analytics, name='admin-analytics'),
+    path('performance', views.request_performance, name='performance'),
+    path('repayment/<int:loan_id>/<int:repayment_id>', repayment_view, name='repayment'),
 ]
@@ -1,24 +1,48 @@
+import codecs
+from itertools import islice
+
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from django.db.models import Sum
-from rest_framework.decorators import api_view, authentication_classes
+from django.db import transaction
+from rest_framework.decorators import api_view, authentication_classes, renderer_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import GenericAPIView
+from rest_framework.renderers import BrowsableAPIRenderer
 from loan import serializers
 from rest_framework.response import Response
 from rest_framework import status
 
+from .approval import APPROVED, NOT_FOUND, approve_loans, pending_loan_ids
+from .imports import ImportConflict, detect_format, import_loans, iter_errors
 from .serializers import (
     UserSerializer,
-    LoanListSerializer
+    BulkApprovalSerializer,
+    LoanImportRequestSerializer,
+    LoanSearchSerializer,
+    LoanSummarySerializer
 )
+from .fast_serializers import FastJSONRenderer, loan_rows, serialize_loans
+from .pagination import LoanKeysetPagination, streaming_loans_response
+from .rebalance import rebalance_pending_repayments
+from .schedule import create_loan_with_schedule
+from .search import LoanSearchPagination, search_loans, serialize_search_results
+from core.analytics import get_portfolio_analytics, invalidate_portfolio_analytics
 from core.backend import BasicRequestBodyAuthentication
+from core.idempotency import idempotent
+from core.instrumentation import route_histograms
+from core.metrics import LOANS_PAID, REPAYMENTS_PROCESSED, count_on_commit
+from core.summaries import add_repayment, count_overdue_repayments
+from core.routing import use_primary
 from core.models import (
     User,
+    ArchivedLoan,
     Loan,
+    LoanImport,
+    LoanSummary,
     Repayment,
     LoanStatus,
     RepaymentStatus
 )
-from datetime import timedelta
 
 INVALID_USER_CREDENTIALS = 'Invalid/missing user credentials in the request header'
 
@@ -35,23 +59,146 @@ class AuthMixin:
 
 @api_view(['PUT'])
 @authentication_classes([BasicRequestBodyAuthentication])
+@use_primary
 def loan_approval(request, loan_id):
     """Handles loan approvals by the admin user."""
     try:
         if not AuthMixin.authenticate_admin_request(request):
             return Response(data={'error': INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
 
-        loan = Loan.objects.get(id=loan_id)
-        loan.status = LoanStatus.APPROVED
-        loan.save(update_fields=['status'])
+        if approve_loans([loan_id])[loan_id] == NOT_FOUND:
+            return Response({'error': "Loan with ID {} does not exist.".format(loan_id)},
+                            status=status.HTTP_404_NOT_FOUND)
         return Response(data={'message': "Loan, with ID {} is approved.".format(loan_id)})
-    except Loan.DoesNotExist:
-        return Response({'error': "Loan with ID {} does not exist.".format(loan_id)},
-                        status=status.HTTP_404_NOT_FOUND)
     except Exception as ex:
         return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@authentication_classes([BasicRequestBodyAuthentication])
+def loan_summary(request):
+    """Handles retrieving the totals of the loans of a user."""
+    try:
+        if not AuthMixin.authenticate_request(request):
+            return Response(data={'error': INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
+
+        summary = LoanSummary.objects.filter(user_id=request.user.id).first() or LoanSummary(user_id=request.user.id)
+        data = LoanSummarySerializer(summary).data
+        data['overdue_repayments'] = count_overdue_repayments(summary)
+        return Response(data=data)
+    except Exception as ex:
+        return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['PUT'])
+@authentication_classes([BasicRequestBodyAuthentication])
+def bulk_loan_approval(request):
+    """Handles approving many loans at once by the admin user."""
+    try:
+        if not AuthMixin.authenticate_admin_request(request):
+            return Response(data={'error': INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
+
+        approval_data = BulkApprovalSerializer(data=request.data)
+        if not approval_data.is_valid():
+            return Response({'error': str(approval_data.errors)}, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = settings.LOAN_APPROVAL_BATCH_LIMIT
+        loan_ids = approval_data.validated_data.get('loan_ids')
+        if loan_ids is None:
+            loan_ids = pending_loan_ids(limit + 1, **approval_data.validated_data['filter'])
+            if len(loan_ids) > limit:
+                return Response({'error': "The filter matches more than {} pending loans. Please narrow it "
+                                          "down.".format(limit)}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = approve_loans(loan_ids)
+        return Response(data={
+            'approved': sum(result == APPROVED for result in results.values()),
+            'results': results,
+        })
+    except Exception as ex:
+        return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@authentication_classes([BasicRequestBodyAuthentication])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer])
+def admin_loans(request):
+    """Handles searching the loans of all the users by the admin user."""
+    try:
+        if not AuthMixin.authenticate_admin_request(request):
+            return Response(data={'error': INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
+
+        search_data = LoanSearchSerializer(data=request.query_params)
+        if not search_data.is_valid():
+            return Response({'error': str(search_data.errors)}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = dict(search_data.validated_data)
+        pagination = LoanSearchPagination(request, filters.pop('ordering'))
+        page = pagination.paginate_queryset(search_loans(**filters))
+        return Response(serialize_search_results(page), headers=pagination.get_headers())
+    except ValidationError as ex:
+        return Response({'error': str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as ex:
+        return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@authentication_classes([BasicRequestBodyAuthentication])
+def portfolio_analytics(request):
+    """Handles retrieving the portfolio analytics by the admin user."""
+    try:
+        if not AuthMixin.authenticate_admin_request(request):
+            return Response(data={'error': INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response(data=get_portfolio_analytics())
+    except Exception as ex:
+        return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@authentication_classes([BasicRequestBodyAuthentication])
+def loan_import(request):
+    """Handles bulk imports of loans from an uploaded JSONL or CSV file by the admin user."""
+    try:
+        if not AuthMixin.authenticate_admin_request(request):
+            return Response(data={'error': INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
+
+        import_data = LoanImportRequestSerializer(data=request.data)
+        if not import_data.is_valid():
+            return Response({'error': str(import_data.errors)}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = import_data.validated_data['file']
+        name = import_data.validated_data.get('name') or upload.name
+        file_format = import_data.validated_data.get('format') or detect_format(upload.name)
+        progress = None
+        for progress in import_loans(codecs.iterdecode(upload, 'utf-8'), file_format, name):
+            pass
+        if progress is None:
+            progress = LoanImport.objects.get(name=name)
+
+        return Response(data={
+            'name': progress.name,
+            'last_line': progress.last_line,
+            'imported': progress.imported,
+            'failed': progress.failed,
+            'errors': list(islice(iter_errors(progress), settings.LOAN_IMPORT_ERROR_LIMIT)),
+        })
+    except ImportConflict as ex:
+        return Response({'error': str(ex)}, status=status.HTTP_409_CONFLICT)
+    except UnicodeDecodeError:
+        return Response({'error': 'The file is not UTF-8 encoded.'}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as ex:
+        return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@authentication_classes([BasicRequestBodyAuthentication])
+def request_performance(request):
+    """Handles retrieving the request timing histograms per route by the admin user."""
+    if not AuthMixin.authenticate_admin_request(request):
+        return Response(data={'error': INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
+    return Response(data=route_histograms.snapshot())
+
+
 class UserView(GenericAPIView):
     serializer_class = UserSerializer
 
@@ -82,19 +229,31 @@ class UserView(GenericAPIView):
 class LoanView(GenericAPIView, AuthMixin):
     serializer_class = serializers.LoanSerializer
     authentication_classes = (BasicRequestBodyAuthentication,)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
 
     def get(self, request):
-        """Handles retrieving ALL loan records for a particular user."""
+        """Handles retrieving the loan records for a particular user."""
         try:
             if not self.authenticate_request(request):
                 return Response(data={'error': INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
 
             loans = Loan.objects.filter(user_id=request.user.id)
-            serializer = LoanListSerializer(loans, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            archived = None
+            if request.query_params.get('include_archived') == 'true':
+                archived = ArchivedLoan.objects.filter(user_id=request.user.id)
+            if request.query_params.get('stream') == 'true':
+                return streaming_loans_response(loans, archived)
+
+            pagination = LoanKeysetPagination(request)
+            page = pagination.paginate_queryset(loan_rows(loans), archived)
+            return Response(serialize_loans(page), status=status.HTTP_200_OK, headers=pagination.get_headers())
+        except ValidationError as ex:
+            return Response({'error': str(ex)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as ex:
             return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @use_primary
+    @idempotent
     def post(self, request):
         """Handles creation of new loan record for a particular user."""
         try:
@@ -106,14 +265,11 @@ class LoanView(GenericAPIView, AuthMixin):
             if loan_data.is_valid():
                 loan_amount = loan_data.validated_data['amount']
                 number_of_terms = loan_data.validated_data['terms']
-                loan = Loan.objects.create(user=request.user, amount=loan_amount, terms=number_of_terms)
-                for i in range(number_of_terms):
-                    due_date = loan.created_date + timedelta(weeks=i+1)
-                    repayment = Repayment.objects.create(loan=loan, amount=loan_amount/number_of_terms, due_date=due_date)
+                loan = create_loan_with_schedule(request.user, loan_amount, number_of_terms)
                 return Response(data={'id': loan.id}, status=status.HTTP_200_OK)
             else:
                 return Response({'error': str(loan_data.errors)}, status=status.HTTP_400_BAD_REQUEST)
-        except serializers.ValidationError as ex:
+        except ValidationError as ex:
             return Response({'error': str(ex)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as ex:
             return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -126,69 +282,112 @@ class RepaymentView(GenericAPIView, AuthMixin):
     @staticmethod
     def balance_repayments(loan):
         """
-        This balances the pending repayment ampounts if the incoming repayment amount is more than the expected value.
+        This balances the pending repayment amounts of the loan if the incoming repayment amount is more than the
+        expected value. See rebalance.py for the details.
         """
-        paid_repayments_amount = Repayment.objects.filter(status=RepaymentStatus.PAID, loan_id=loan.id).aggregate(Sum('amount'))['amount__sum']
-        balance_amount = loan.amount - paid_repayments_amount
-
-        pending_repayments = Repayment.objects.filter(loan_id=loan.id, status=RepaymentStatus.PENDING).count()
-        if pending_repayments > 0:
-            new_unpaid_rep_amount = balance_amount/pending_repayments
-            Repayment.objects.filter(status=RepaymentStatus.PENDING).update(amount=new_unpaid_rep_amount)
+        return rebalance_pending_repayments(loan.id, loan.outstanding_balance, loan.next_due_date)
 
     @staticmethod
     def mark_loan_paid(loan):
         """This marks a loan as paid if all the repayments against it have been marked as paid."""
-        if not Repayment.objects.filter(loan_id=loan.id, status=RepaymentStatus.PENDING).exists():
+        if loan.pending_repayments == 0:
             loan.status = LoanStatus.PAID
-            loan.save(update_fields=['status'])
 
-    def put(self, request, loan_id, repayment_id):
-        """Handles making repayments for a particular loan."""
-        try:
-            if not self.authenticate_request(request):
-                return Response(data={"error": INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
+    def record_repayment(self, loan, repayment_amount):
+        """
+        This updates the counters of the loan with the incoming repayment, rebalances the pending repayments against
+        the new outstanding balance, and saves the loan with a single update. The repayment is then recorded in the
+        loan summary of the user.
+        """
+        previous_balance = loan.outstanding_balance
+        loan.amount_paid += repayment_amount
+        loan.outstanding_balance = max(loan.amount - loan.amount_paid, 0)
+
+        rebalance = self.balance_repayments(loan)
+        loan.pending_repayments = rebalance.pending
+        loan.next_due_date = rebalance.next_due_date
+        self.mark_loan_paid(loan)
+        loan.save(update_fields=['amount_paid', 'outstanding_balance', 'pending_repayments', 'next_due_date', 'status'])
+        add_repayment(loan, repayment_amount, previous_balance - loan.outstanding_balance)
+        invalidate_portfolio_analytics()
+
+        count_on_commit(REPAYMENTS_PROCESSED)
+        if loan.status == LoanStatus.PAID:
+            count_on_commit(LOANS_PAID)
 
-            loan = Loan.objects.get(id=loan_id)
-            repayment = Repayment.objects.get(loan_id=loan_id, id=repayment_id)
+    @staticmethod
+    def get_repayment(loan, repayment_id):
+        """
+        Returns the repayment of the loan. Pending repayments are never due before the next due date of the loan, so
+        they are looked up from that date on, which only reads the partitions of the repayment table from its month on.
+        Other repayments, e.g. already paid ones, are looked up across all the partitions.
+        """
+        repayments = Repayment.objects.filter(loan_id=loan.id, id=repayment_id)
+        if loan.next_due_date is not None:
+            repayment = repayments.filter(due_date__gte=loan.next_due_date).first()
+            if repayment is not None:
+                return repayment
+        return repayments.get()
+
+    def make_repayment(self, request, loan_id, repayment_id):
+        """
+        Makes the repayment. This must run inside a transaction, which keeps the loan row locked until the end, so that
+        concurrent repayments against the same loan are applied one after the other.
+        """
+        loan = Loan.objects.select_for_update().get(id=loan_id)
+        repayment = self.get_repayment(loan, repayment_id)
 
-            # if not is_date_difference_less_than_one_week(loan.created_date, repayment.due_date):
-            #     return Response({'error': "error in approving, its past the due date"}, status=HTTP_400_BAD_REQUEST)
+        # if not is_date_difference_less_than_one_week(loan.created_date, repayment.due_date):
+        #     return Response({'error': "error in approving, its past the due date"}, status=HTTP_400_BAD_REQUEST)
 
-            if loan.status == LoanStatus.PENDING:
-                return Response({'error': "The loan is not approved yet. Repayments can only be done for approved loans"},
-                                status=status.HTTP_400_BAD_REQUEST)
+        if loan.status == LoanStatus.PENDING:
+            return Response({'error': "The loan is not approved yet. Repayments can only be done for approved loans"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-            if loan.status == LoanStatus.PAID:
-                return Response({'error': "All repayments for this loan are already complete"}, status=status.HTTP_200_OK)
+        if loan.status == LoanStatus.PAID:
+            return Response({'error': "All repayments for this loan are already complete"}, status=status.HTTP_200_OK)
 
-            repayment_data = self.serializer_class(data=request.data)
+        if repayment.status == RepaymentStatus.PAID:
+            return Response({'error': "Repayment with ID {} is already paid.".format(repayment_id)},
+                            status=status.HTTP_409_CONFLICT)
 
-            if repayment_data.is_valid():
-                repayment_amount = repayment_data.validated_data['amount']
+        repayment_data = self.serializer_class(data=request.data)
 
-                if repayment_amount < repayment.amount:
-                    return Response({'error': "The repayment amount is less than expected. The minimum expected"
-                                              "amount for this repayment is {}.".format(str(repayment.amount))},
-                                    status=status.HTTP_400_BAD_REQUEST)
+        if repayment_data.is_valid():
+            repayment_amount = repayment_data.validated_data['amount']
 
-                repayment.status = RepaymentStatus.PAID
-                repayment.amount = repayment_amount
-                repayment.save(update_fields=['status', 'amount'])
+            if repayment_amount < repayment.amount:
+                return Response({'error': "The repayment amount is less than expected. The minimum expected"
+                                          "amount for this repayment is {}.".format(str(repayment.amount))},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-                self.balance_repayments(loan)
-                self.mark_loan_paid(loan)
+            # Updated by its full primary key, so that only the partition of its due date is written.
+            Repayment.objects.filter(id=repayment.id, due_date=repayment.due_date).update(
+                status=RepaymentStatus.PAID, amount=repayment_amount)
 
-                return Response(data={'message': "Repayment successfully completed."}, status=status.HTTP_200_OK)
-            else:
-                return Response({'error': str(repayment_data.errors)}, status=status.HTTP_400_BAD_REQUEST)
+            self.record_repayment(loan, repayment_amount)
+
+            return Response(data={'message': "Repayment successfully completed."}, status=status.HTTP_200_OK)
+        else:
+            return Response({'error': str(repayment_data.errors)}, status=status.HTTP_400_BAD_REQUEST)
+
+    @use_primary
+    @idempotent
+    def put(self, request, loan_id, repayment_id):
+        """Handles making repayments for a particular loan."""
+        try:
+            if not self.authenticate_request(request):
+                return Response(data={"error": INVALID_USER_CREDENTIALS}, status=status.HTTP_401_UNAUTHORIZED)
+
+            with transaction.atomic():
+                return self.make_repayment(request, loan_id, repayment_id)
         except Loan.DoesNotExist:
             return Response({'error': "Loan with ID {} does not exist.".format(loan_id)},
                             status=status.HTTP_404_NOT_FOUND)
         except Repayment.DoesNotExist:
             return Response({'error': "Repayment with ID {} does not exist.".format(repayment_id)},
                             status=status.HTTP_404_NOT_FOUND)
-        except serializers.ValidationError as ex:
+        except ValidationError as ex:
             return Response({'error': str(ex)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as ex:
             return Response({'error': str(ex)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)